@@ -0,0 +1,61 @@
+# bench_keyword_matching.py
+# 对比逐个 re.search 客服名称格式与分层关键字匹配的耗时，客服名称数量逐步增加
+# 用法: python bench_keyword_matching.py [名称数量] [查询次数]
+import random
+import re
+import sys
+import time
+from config import CUSTOME_SERVICE_PATTERNS
+from models.keyword_matcher import NamePatternMatcher
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂"
+
+
+def make_patterns(name_count: int):
+    """配置中的格式加上随机生成的客服名称，名称混合完全相同、前缀与包含三种写法"""
+    rng = random.Random(name_count)
+    patterns = list(CUSTOME_SERVICE_PATTERNS)
+    for i in range(name_count):
+        name = f"{rng.choice(SURNAMES)}{rng.choice(GIVEN_NAMES)}{rng.choice(GIVEN_NAMES)}客服{i}"
+        patterns.append((f"^{name}$", f"^{name}", name)[i % 3])
+    return patterns
+
+
+def make_names(query_count: int):
+    """查询的发送者名称，大部分是客户"""
+    rng = random.Random(query_count)
+    return [f"{rng.choice(SURNAMES)}{rng.choice(GIVEN_NAMES)}{rng.choice('先生女士老板')}{rng.randint(1, 999)}"
+            for _ in range(query_count)]
+
+
+def run_loop(patterns, names):
+    """原有实现: 每个名称逐个 re.search 全部格式"""
+    start = time.perf_counter()
+    results = [any(re.search(pattern, name, re.DOTALL) for pattern in patterns) for name in names]
+    return time.perf_counter() - start, results
+
+
+def run_matcher(patterns, names):
+    matcher = NamePatternMatcher(patterns)
+    start = time.perf_counter()
+    results = [matcher.matches(name) for name in names]
+    return time.perf_counter() - start, results
+
+
+def main():
+    name_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    names = make_names(query_count)
+    for count in sorted({10, name_count // 10, name_count}):
+        patterns = make_patterns(count)
+        loop_elapsed, loop_results = run_loop(patterns, names)
+        matcher_elapsed, matcher_results = run_matcher(patterns, names)
+        assert loop_results == matcher_results
+        print(f"{len(patterns)} 个格式, {query_count} 次查询: 逐个正则 {loop_elapsed:.3f}s, "
+              f"分层匹配 {matcher_elapsed:.3f}s ({loop_elapsed / matcher_elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
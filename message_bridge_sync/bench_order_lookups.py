@@ -0,0 +1,68 @@
+# bench_order_lookups.py
+# 对比同步客户端逐个查询与异步客户端并发查询订单所属会话的耗时
+# 用法: python bench_order_lookups.py [订单数量] [并发数]
+import asyncio
+import sys
+import time
+from models.redis_queue import RedisQueue
+from models.async_redis_queue import AsyncRedisQueue
+from models.redis_client import close_async_redis_client
+
+BENCH_SESSION_ID = "bench_order_lookups"
+
+
+def make_orders(order_count: int):
+    return [f"YT{7508000000000 + i}" for i in range(order_count)]
+
+
+def run_sync(redis_queue: RedisQueue, order_numbers):
+    """同步客户端: 所有查询排在一个连接上依次往返"""
+    start = time.perf_counter()
+    for order_number in order_numbers:
+        redis_queue.find_session_id_by_order_number(order_number)
+    return time.perf_counter() - start
+
+
+async def run_async(order_numbers, concurrency: int):
+    """异步客户端: concurrency 个协程同时查询，共用一个连接池"""
+    queue = await AsyncRedisQueue.create()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(order_number: str):
+        async with semaphore:
+            return await queue.find_session_id_by_order_number(order_number)
+
+    try:
+        # 预热，建立连接并加载脚本
+        await asyncio.gather(*[lookup(order_number) for order_number in order_numbers[:concurrency]])
+        start = time.perf_counter()
+        results = await asyncio.gather(*[lookup(order_number) for order_number in order_numbers])
+        elapsed = time.perf_counter() - start
+        assert all(session_id == BENCH_SESSION_ID for session_id in results)
+        return elapsed
+    finally:
+        await queue.close()
+        await close_async_redis_client()
+
+
+def main():
+    order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    redis_queue = RedisQueue()
+    order_numbers = make_orders(order_count)
+    redis_queue.put_orders_to_session(BENCH_SESSION_ID, order_numbers)
+    try:
+        print(f"查询 {order_count} 个订单")
+        elapsed = run_sync(redis_queue, order_numbers)
+        print(f"同步逐个查询: {elapsed:.2f}s, {order_count / elapsed:.0f} 次/秒")
+        elapsed = asyncio.run(run_async(order_numbers, concurrency))
+        print(f"异步并发 {concurrency}: {elapsed:.2f}s, {order_count / elapsed:.0f} 次/秒")
+    finally:
+        redis_key = redis_queue._session_key(redis_queue.session_order_queue, BENCH_SESSION_ID)
+        redis_queue.order_index.remove_if_owner(BENCH_SESSION_ID, order_numbers)
+        redis_queue.redis_client.delete(redis_key)
+
+
+if __name__ == "__main__":
+    main()
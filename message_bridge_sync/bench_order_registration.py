@@ -0,0 +1,108 @@
+# bench_order_registration.py
+# 对比逐条注册与批量注册订单时，每条消息产生的 redis 往返次数和耗时
+# 用法: python bench_order_registration.py [订单数量] [消息数量]
+import sys
+import time
+from models.redis_queue import RedisQueue
+
+BENCH_SESSION_ID = "bench_order_registration"
+
+
+class RoundTripCounter:
+    """统计 redis 往返次数，单条命令与 pipeline 都算一次往返"""
+
+    def __init__(self, redis_client):
+        self.count = 0
+        self.redis_client = redis_client
+        self._execute_command = redis_client.execute_command
+        self._pipeline = redis_client.pipeline
+        redis_client.execute_command = self._count_command
+        redis_client.pipeline = self._count_pipeline
+
+    def _count_command(self, *args, **kwargs):
+        self.count += 1
+        return self._execute_command(*args, **kwargs)
+
+    def _count_pipeline(self, *args, **kwargs):
+        pipe = self._pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def _count_execute(*execute_args, **execute_kwargs):
+            self.count += 1
+            return execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = _count_execute
+        return pipe
+
+    def reset(self):
+        self.count = 0
+
+
+def make_orders(message_index: int, order_count: int):
+    return [f"YT{7509000000000 + message_index * 1000 + i}" for i in range(order_count)]
+
+
+def legacy_keys(redis_queue: RedisQueue, session_id: str):
+    """旧实现使用的会话订单集合与映射 hash，单独命名，不影响当前布局下的数据"""
+    return (f"{redis_queue.session_order_queue}_legacy_{session_id}",
+            f"{redis_queue.order_to_session_queue}_legacy_{session_id}")
+
+
+def register_one_by_one(redis_queue: RedisQueue, session_id: str, order_numbers):
+    """旧实现: 每个订单分别 ZSCORE 检查、ZADD、HSET 映射、ZCARD 检查上限，超限时再裁剪"""
+    redis_client = redis_queue.redis_client
+    redis_key, mapping_key = legacy_keys(redis_queue, session_id)
+    _, limit, _ = redis_queue._retention_limits(redis_queue._session_key(redis_queue.session_order_queue, session_id))
+    for order_number in order_numbers:
+        if redis_client.zscore(redis_key, order_number) is not None:
+            continue
+        redis_client.zadd(redis_key, {order_number: time.time()}, nx=True)
+        redis_client.hset(mapping_key, order_number, session_id)
+        if redis_client.zcard(redis_key) > limit and limit:
+            removed_order = redis_client.zrange(redis_key, 0, 0)[0]
+            redis_client.zremrangebyrank(redis_key, 0, 0)
+            redis_client.hdel(mapping_key, removed_order)
+
+
+def register_bulk(redis_queue: RedisQueue, session_id: str, order_numbers):
+    """新实现: 一次脚本调用"""
+    redis_queue.put_orders_to_session(session_id, order_numbers)
+
+
+def cleanup(redis_queue: RedisQueue, session_id: str):
+    redis_key = redis_queue._session_key(redis_queue.session_order_queue, session_id)
+    orders = [redis_queue.order_index.decode(member) for member in redis_queue.redis_client.zrange(redis_key, 0, -1)]
+    if orders:
+        redis_queue.order_index.remove_if_owner(session_id, orders)
+    redis_queue.redis_client.delete(redis_key, *legacy_keys(redis_queue, session_id))
+
+
+def run(name, register, redis_queue, counter, order_count, message_count):
+    cleanup(redis_queue, BENCH_SESSION_ID)
+    # 预热，避免脚本首次加载影响统计
+    register(redis_queue, BENCH_SESSION_ID, make_orders(-1, 1))
+    counter.reset()
+
+    start = time.perf_counter()
+    for message_index in range(message_count):
+        register(redis_queue, BENCH_SESSION_ID, make_orders(message_index, order_count))
+    elapsed = time.perf_counter() - start
+
+    print(f"{name}: 每条消息 {counter.count / message_count:.1f} 次往返, "
+          f"{elapsed / message_count * 1000:.2f} ms/消息")
+    cleanup(redis_queue, BENCH_SESSION_ID)
+
+
+def main():
+    order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    message_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    redis_queue = RedisQueue()
+    counter = RoundTripCounter(redis_queue.redis_client)
+    print(f"每条消息 {order_count} 个订单, 共 {message_count} 条消息")
+    run("逐条注册", register_one_by_one, redis_queue, counter, order_count, message_count)
+    run("批量注册", register_bulk, redis_queue, counter, order_count, message_count)
+
+
+if __name__ == "__main__":
+    main()
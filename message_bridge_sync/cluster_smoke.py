@@ -0,0 +1,129 @@
+# cluster_smoke.py
+# 在本地多进程 redis 集群上验证 cluster 键布局: 群的键位于同一槽位、订单映射分片、队列与限流脚本可用
+# 用法: python cluster_smoke.py [--start] [--port 7000] [--nodes 3]
+#   --start 在临时目录启动 nodes 个 redis-server 进程并创建集群(需要 redis-server 与 redis-cli)，结束后关闭
+#   不加 --start 时连接已在 port 起连续端口上运行的集群
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+import config
+
+SMOKE_SESSION_ID = "cluster_smoke"
+
+
+def start_cluster(port: int, nodes: int):
+    """启动本地集群节点进程并分配槽位，返回进程列表与数据目录"""
+    data_dir = tempfile.mkdtemp(prefix="redis_cluster_")
+    processes = []
+    for node_port in range(port, port + nodes):
+        processes.append(subprocess.Popen(
+            ['redis-server', '--port', str(node_port), '--cluster-enabled', 'yes',
+             '--cluster-config-file', f"nodes-{node_port}.conf", '--appendonly', 'no',
+             '--save', '', '--dir', data_dir],
+            stdout=subprocess.DEVNULL
+        ))
+    time.sleep(1)
+    subprocess.run(
+        ['redis-cli', '--cluster', 'create',
+         *[f"127.0.0.1:{node_port}" for node_port in range(port, port + nodes)],
+         '--cluster-replicas', '0', '--cluster-yes'],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    # 等待所有节点确认槽位分配
+    for _ in range(50):
+        info = subprocess.run(['redis-cli', '-p', str(port), 'cluster', 'info'], capture_output=True, text=True)
+        if 'cluster_state:ok' in info.stdout:
+            break
+        time.sleep(0.2)
+    return processes, data_dir
+
+
+def stop_cluster(processes, data_dir: str):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def check(name: str, condition: bool):
+    print(f"{'OK  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        raise SystemExit(1)
+
+
+def run_checks():
+    # 配置需要在导入 models 之前修改
+    from models.message import Message, MessageSource
+    from models.rate_limiter import RateLimiter
+    from models.redis_queue import RedisQueue
+
+    redis_queue = RedisQueue()
+    redis_client = redis_queue.redis_client
+    check("使用集群客户端与 cluster 键布局", redis_queue.cluster_client and redis_queue.cluster_layout)
+
+    session_keys = [redis_queue._session_key(redis_queue.wechat_processed_queue, SMOKE_SESSION_ID),
+                    redis_queue._session_key(redis_queue.session_order_queue, SMOKE_SESSION_ID)]
+    check("同一群的键位于同一槽位", len({redis_client.keyslot(key) for key in session_keys}) == 1)
+
+    queue_keys = [redis_queue.wechat_queue, redis_queue.yto_queue, redis_queue.retry_queue,
+                  redis_queue.wechat_notify_queue, redis_queue.yto_ready_queue,
+                  f"{redis_queue.yto_session_queue_prefix}{SMOKE_SESSION_ID}"]
+    check("队列类键位于同一槽位", len({redis_client.keyslot(key) for key in queue_keys}) == 1)
+
+    shard_nodes = {redis_client.get_node_from_key(key).name for key in redis_queue.order_index.keys()}
+    print(f"     订单映射 {len(redis_queue.order_index.keys())} 个分片分布在 {len(shard_nodes)} 个节点")
+    check("订单映射分片分布到多个节点", len(shard_nodes) > 1)
+
+    orders = [f"YT{7509000000000 + i}" for i in range(50)]
+    check("批量注册订单", redis_queue.put_orders_to_session(SMOKE_SESSION_ID, orders) == len(orders))
+    check("重复注册不新增", redis_queue.put_orders_to_session(SMOKE_SESSION_ID, orders) == 0)
+    check("按订单号查找会话",
+          all(redis_queue.find_session_id_by_order_number(order) == SMOKE_SESSION_ID for order in orders))
+
+    check("检查并标记已处理消息",
+          redis_queue.mark_wechat_processed_batch(["消息1", "消息2", "消息1"], SMOKE_SESSION_ID) == [True, True, False])
+
+    message = Message(content="YT7509000000000 拦截", source=MessageSource.WECHAT, session_id=SMOKE_SESSION_ID)
+    redis_queue.put_wechat_message(message)
+    redis_queue.put_yto_message(message)
+    received = {redis_queue.wait_for_message([redis_queue.wechat_queue, redis_queue.yto_queue], 1)[0]
+                for _ in range(2)}
+    check("阻塞等待多个队列", received == {redis_queue.wechat_queue, redis_queue.yto_queue})
+
+    redis_queue.schedule_retry(redis_queue.wechat_queue, message.to_dict())
+    redis_client.zadd(redis_queue.retry_queue, {member: 0 for member in redis_client.zrange(redis_queue.retry_queue, 0, -1)})
+    check("到期重试放回队列", redis_queue.promote_due_retries() == 1 and redis_queue.get_wechat_message() is not None)
+
+    rate_limiter = RateLimiter(redis_client)
+    check("多桶限流脚本", rate_limiter.acquire("wechat", SMOKE_SESSION_ID) == 0)
+
+    # 订单未超过保留上限，这里只验证裁剪脚本在集群上可执行
+    redis_queue.enforce_retention(full=True)
+    redis_queue.order_index.remove_if_owner(SMOKE_SESSION_ID, orders)
+    check("清理分片映射", redis_queue.find_session_id_by_order_number(orders[0]) is None)
+
+    redis_client.delete(*session_keys)
+    print("集群检查全部通过")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 redis 集群键布局检查")
+    parser.add_argument('--start', action='store_true', help="启动本地多进程集群，结束后关闭")
+    parser.add_argument('--port', type=int, default=7000, help="第一个节点端口")
+    parser.add_argument('--nodes', type=int, default=3, help="节点数量，至少 3 个")
+    args = parser.parse_args()
+
+    config.REDIS_CLUSTER_NODES = [{'host': '127.0.0.1', 'port': port} for port in range(args.port, args.port + args.nodes)]
+    processes, data_dir = start_cluster(args.port, args.nodes) if args.start else ([], None)
+    try:
+        run_checks()
+    finally:
+        if args.start:
+            stop_cluster(processes, data_dir)
+
+
+if __name__ == "__main__":
+    main()
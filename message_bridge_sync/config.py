@@ -5,9 +5,32 @@ REDIS_CONFIG = {
     'db': 0,
     'password': None,
 	'decode_responses': True,
-    'max_connections': 100
+    'max_connections': 100,
+    'socket_connect_timeout': 3,  # 连接超时(秒)，redis 不可用时尽快转入溢出日志
 }
 
+# 异步客户端 (AsyncRedisQueue) 进程内共享一个连接池，连接数上限为 REDIS_CONFIG['max_connections']
+ASYNC_REDIS = {
+    'pool_timeout': 5,  # 连接全部占用时等待空闲连接的时间(秒)，超时后报错
+    'socket_timeout': 15,  # 读写超时(秒)，需大于 QUEUE_BLOCK_TIMEOUT，否则阻塞等待会提前超时
+    'health_check_interval': 30,  # 连接空闲超过该时间(秒)后，取用前先 PING
+    'ping_interval': 10,  # 后台健康检查间隔(秒)
+    'reconnect_retries': 3,  # 命令遇到连接错误时的重连次数
+    'reconnect_backoff': (0.1, 5),  # 重连退避 (基数, 上限) 秒，指数增长并加随机抖动，避免同时重连
+}
+
+# redis 集群节点，配置后使用集群客户端并强制使用 cluster 键布局，如 [{'host': '127.0.0.1', 'port': 7000}]
+REDIS_CLUSTER_NODES = []
+# 键布局 classic: 单节点键名; cluster: 用 hash tag 将每个群的键固定在同一槽位，订单映射分片
+KEY_LAYOUT = "classic"
+# cluster 键布局下订单到会话映射的分片数
+ORDER_INDEX_SHARDS = 16
+# 订单到会话映射 hash: 每个订单一个字段; compact: 订单号编码为整数分桶存入小 hash，按 session_order_max_age 整桶过期
+# 切换模式后旧映射不再读取，已注册订单需等重新提及后写入
+ORDER_INDEX_MODE = "hash"
+# compact 模式的桶数量，建议为跟踪订单数 / 100，使每个桶的字段数低于 hash-max-listpack-entries(默认128)
+ORDER_INDEX_BUCKETS = 4096
+
 # 圆通订单号格式
 ORDER_FORMAT = [
 	r'YT\d{13,15}',  
@@ -22,13 +45,16 @@ WECHAT_MESSAGE_FORMATS = [
     r".*YT\d{13,15}\s*(改地址|改址|更址|修改地址)\s*$",
 ]
 
+# 包含多个订单号的微信消息拆成每个订单号一条请求，没有意图的订单号继承相邻行的意图
+SPLIT_WAYBILLS = True
+
 # 圆通消息格式
 YTO_MESSAGE_FORMATS = [
     r'YT\d{13,15}.*',
 	r'YT\d{13,15}\s(test)',
 ]
 
-# 客服名称格式
+# 客服名称格式，^名称$ 完全相同，^名称 前缀，不含正则元字符时名称中包含即匹配，其余按正则匹配
 CUSTOME_SERVICE_PATTERNS = [
 	r"小圆在线.*",
 	r"蓝胖子",
@@ -37,21 +63,161 @@ CUSTOME_SERVICE_PATTERNS = [
 	r"大黄",
 	r"巧儿",
 	r"佳佳",
-	r"Y",
+	r"^Y$",
 	r"小圆服务",
 ]
 
 # 圆通智能客服ID
 YTO_SERVICE_ID = "小圆-总公司"
 
+# 已处理消息集合保存的指纹位数 64 / 128，0 表示保存完整消息内容
+# 启用前先停止服务并运行 migrate_fingerprints.py，否则已有的完整消息不再匹配，近期消息会被重新处理
+PROCESSED_FINGERPRINT_BITS = 0
+# 指纹加入的盐，可选 'session'、'sender'；加入 'sender' 后同一内容不同发送者视为不同消息
+PROCESSED_FINGERPRINT_SALT = []
+
+# 进程内缓存，订单到会话查询与已处理消息判断，依赖 redis 6+ 客户端跟踪失效
+LOCAL_CACHE = {
+    'enabled': True,
+    'max_size': 20000,  # 最大缓存条目数，超出按 LRU 淘汰
+    'warm_up': True,  # 启动时批量加载监控群的已处理消息与订单
+    'reconnect_delay': 3,  # 跟踪连接断开后的重连间隔(秒)，期间缓存不生效
+    'ping_interval': 10,  # 跟踪连接空闲该秒数后发送 PING，再过该秒数没有响应视为断开
+    'stats_interval': 600,  # 命中率日志输出间隔(秒)
+}
+
+# 订单号索引，订单号映射不到群时按部分或输错的订单号查找；启动时从监控群的会话订单重建
+WAYBILL_INDEX = {
+    'enabled': True,
+    'max_size': 200000,  # 最多索引的订单号数量，超出按写入顺序淘汰
+    'min_digits': 6,  # 部分订单号至少的数字位数
+    'max_candidates': 50,  # 单次前缀或后缀查找最多的候选数量，超出视为无法确定
+    'refresh_interval': 60,  # 查找不到时重新加载的最短间隔(秒)，其他进程注册的订单重新加载后可见
+}
+
+# keyspace_report.py 检查的各类键预算，keys 为键数量，memory 为字节，0 表示不限制
+KEYSPACE_BUDGETS = {
+    'wechat_processed': {'keys': 0, 'memory': 64 * 1024 * 1024},
+    'yto_processed': {'keys': 0, 'memory': 16 * 1024 * 1024},
+    'session_order': {'keys': 0, 'memory': 64 * 1024 * 1024},
+    'order_index': {'keys': 0, 'memory': 128 * 1024 * 1024},
+    'queue': {'keys': 0, 'memory': 32 * 1024 * 1024},
+    'send_ledger': {'keys': 200000, 'memory': 0},
+}
+
+# 已处理标记与订单注册延后批量写入 redis，扫描界面时不等待写入；本进程的去重与订单查询能读到尚未写入的数据
+# 需要返回是否为新消息的检查-标记仍同步执行，进程异常退出时最多丢失一个刷新间隔内的写入
+WRITE_BEHIND = {
+    'enabled': True,
+    'interval': 0.005,  # 刷新间隔(秒)
+    'max_items': 100,  # 积压条数达到后立即刷新
+    'retry_delay': 1,  # 写入失败后的重试间隔(秒)，期间的写入积压在内存中
+}
+
+# redis 不可用时，消息入队、已处理标记与订单注册写入本地溢出日志，恢复后按顺序回放
+SPILL = {
+    'enabled': True,
+    'path': 'redis_spill_{process_type}.journal',  # 每个进程一个日志文件
+    'max_bytes': 50 * 1024 * 1024,  # 日志大小上限，超出后写入直接失败
+    'fsync': 'interval',  # always: 每条记录同步到磁盘; interval: 按间隔同步; never: 由系统决定
+    'fsync_interval': 1,  # 秒
+    'replay_interval': 5,  # 回放失败后再次尝试的间隔(秒)，期间写入直接进入日志，不再等待redis
+    'recent_marks': 20000,  # 记录本进程最近标记的已处理消息数量，redis 不可用时用于去重
+}
+
+# 已处理消息与会话订单的保留策略，在热路径之外批量裁剪
+RETENTION = {
+    'processed_max_age': 7 * 24 * 3600,  # 已处理消息保留时间(秒)，0 表示不按时间裁剪
+    'processed_max_count': 1000,  # 每个已处理集合的数量上限，0 表示不限制
+    'session_order_max_age': 7 * 24 * 3600,  # 每个群订单保留时间(秒)
+    'session_order_max_count': 1000,  # 每个群订单数量上限
+    'interval': 60,  # 后台裁剪间隔(秒)
+    'probability': 0.0,  # 不运行后台裁剪的进程，每次写入按该概率顺带裁剪
+}
+
 NEW_WECHAT_MESSAGE_COUNT = 5
 NEW_YTO_MESSAGE_COUNT = 5
 
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # 秒
+RETRY_DELAY = 5  # 秒，首次重试延迟，之后按指数退避
+RETRY_MAX_DELAY = 300  # 秒，重试延迟上限
 
 PROCESS_TYPE = "wechat_send"  # wechat_recieve wechat_send
 
+# 运行模式 sync: 单进程直接收发; queue: 通过redis队列收发，配合PROCESS_TYPE部署两台服务器
+RUN_MODE = "sync"
+
+# 队列阻塞等待超时时间，有消息立即唤醒
+QUEUE_BLOCK_TIMEOUT = 5  # 秒
+
+# 两次实际发送之间的拟人化间隔
+SEND_INTERVAL = (3.5, 5.5)  # 秒
+
+# 微信消息队列模式 fifo: 单一队列; priority: 按意图分优先级通道，最早截止时间优先(仅 list 队列类型)
+WECHAT_QUEUE_MODE = "fifo"
+
+# 意图优先级通道，按顺序优先级递减；deadline 为期望发出的时限(秒)，demote 为超时后是否降级
+PRIORITY_LANES = {
+    'high': {'intents': ['拦截', '取消拦截', '改地址', '改址', '更址', '修改地址'], 'deadline': 120},
+    'normal': {'intents': ['催件'], 'deadline': 600},
+    'low': {'intents': ['查重', '重量', '到哪里', '到那里', '退回了吗'], 'deadline': 1800, 'demote': True},
+}
+# 没有识别到意图时使用的通道
+PRIORITY_DEFAULT_LANE = 'normal'
+# 可降级通道超过截止时间该秒数仍未发出时降级，只在其他通道为空时发送
+PRIORITY_STALE_GRACE = 600
+
+# 圆通回复队列模式 fifo: 单一队列; per_session: 每个群一个队列，按权重轮询消费(仅 list 队列类型)
+YTO_QUEUE_MODE = "fifo"
+# 群队列权重，每轮连续发送的条数，未配置的群为1，如 {"5": 2}
+SESSION_QUEUE_WEIGHTS = {}
+
+# 发送限流，两台服务器共享的 redis 令牌桶；启用后代替 SEND_INTERVAL 的固定间隔
+# rate: 每秒补充令牌数  burst: 桶容量(允许的突发条数)，均须大于0
+RATE_LIMITS = {
+    'enabled': False,
+    'global': {'rate': 1.0, 'burst': 5},  # 所有发送合计
+    'account': {'rate': 0.5, 'burst': 3},  # 每个微信账号
+    'group': {'rate': 0.2, 'burst': 2},  # 每个微信群
+    'yto': {'rate': 0.5, 'burst': 3},  # 圆通客服页面
+}
+# 当前进程使用的微信账号，同一账号的进程共享账号桶
+WECHAT_ACCOUNT_ID = "default"
+
+# 发送记录，同一目的地、订单与内容在窗口内只发送一次，进程重启后重放的发送直接跳过
+SEND_LEDGER = {
+    'enabled': True,
+    'ttl': 6 * 3600,  # 发送记录保留时间(秒)，窗口内相同内容不再发送
+    'reserve_ttl': 120,  # 发送前预留的有效期(秒)，需大于一次界面发送的耗时；进程中途退出时到期后允许重新发送
+}
+
+# 队列后端 redis: 接收与发送服务器共享; memory: 进程内，单进程部署、测试与基准; sqlite: 本机文件，同一主机的多个进程共享
+# memory 与 sqlite 不支持优先级通道、群队列、stream 与发送限流
+QUEUE_BACKEND = "redis"
+
+# sqlite 队列后端配置
+SQLITE_QUEUE = {
+    'path': 'message_bridge.db',
+    'poll_interval': 0.5,  # 阻塞等待时检查其他进程写入的间隔(秒)
+    'busy_timeout': 5000,  # 等待其他进程写锁的时间(毫秒)
+}
+
+# 队列消息编码 msgpack: 带版本号的二进制信封，需要安装 msgpack，未安装时使用 json; json: 与旧版本相同
+# 两种编码的消息都可以读取，升级时先升级消费端
+MESSAGE_ENCODING = "msgpack"
+
+# 队列类型 list: redis列表; stream: redis stream消费组，支持确认与崩溃后认领
+QUEUE_TYPE = "list"
+
+# redis stream 队列配置
+STREAM_CONFIG = {
+    'group': 'message_bridge',  # 消费组名称
+    'consumer': None,  # 消费者名称，默认 主机名-进程号
+    'maxlen': 10000,  # stream 最大长度，近似裁剪
+    'claim_idle': 60000,  # 未确认消息空闲超过该时间(毫秒)后可被其他消费者认领
+    'max_deliveries': 5,  # 消息投递超过该次数仍未确认时确认并放入死信队列，避免反复导致崩溃的消息一直被认领
+}
+
 # 监控的会话
 MONITORED_GROUPS = {
 	"1": 'yto-test群',
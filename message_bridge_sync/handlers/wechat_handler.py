@@ -8,12 +8,14 @@ from typing import Any, Optional, Dict, List
 from models.message import Message
 from models.message import MessageSource
 from models.redis_queue import RedisQueue
-from collections import deque
 import re
-from config import CUSTOME_SERVICE_PATTERNS, WECHAT_MESSAGE_FORMATS, MONITORED_GROUPS, NEW_WECHAT_MESSAGE_COUNT, PROCESS_TYPE
+from models.classifier import classify
+from models.fingerprint import fingerprint
+from models.keyword_matcher import CUSTOMER_SERVICE_MATCHER
+from config import MONITORED_GROUPS, NEW_WECHAT_MESSAGE_COUNT, PROCESS_TYPE
 
 class WeChatHandler:
-    def __init__(self, redis_queue):
+    def __init__(self, redis_queue, send_ledger=None):
         self.wx = None
         self.last_messages: Dict[str, str] = {}
         self.current_session_id = None
@@ -21,12 +23,16 @@ class WeChatHandler:
         self.group_handles: Dict[str, auto.WindowControl] = {}
         self.max_retries = 3
         self.retry_delay = 0.5
-        self.buffer = {}
-        self.buffer_size = 1000
+        # 只检查未标记的消息ID -> 发送者，入队后标记时使用
+        self.pending_senders: Dict[str, str] = {}
         self.new_message = None
         self.last_message_count = NEW_WECHAT_MESSAGE_COUNT
         self.monitoring_groups: Dict[str, str] = {}
         self.redis_queue = redis_queue    
+        # 发送记录，重启或重试后已发送过的消息不再发送
+        self.send_ledger = send_ledger
+        # 最近一次实际发送成功的时间，发送记录跳过的不计入
+        self.last_sent_at = 0.0
 
     def init_wx(self) -> bool:
         """初始化微信窗口"""
@@ -107,13 +113,8 @@ class WeChatHandler:
 
     def is_valid_message(self, msg: str) -> bool:
         """过滤消息"""
-        # 过滤掉不符合规则的消息
-        patterns = WECHAT_MESSAGE_FORMATS
-        for pattern in patterns:
-            match = re.search(pattern, msg, re.DOTALL)
-            if match:
-                return True
-        return False
+        # 过滤掉不符合规则的消息，全部格式编译为一个模式一次扫描，结果供提取订单号与定优先级复用
+        return classify(msg).valid
 
     def is_customer(self, name: str) -> bool:
         """判断是否自己"""
@@ -121,12 +122,7 @@ class WeChatHandler:
             return False
 
         """判断是否是客服"""
-        patterns = CUSTOME_SERVICE_PATTERNS
-        for pattern in patterns:
-            match = re.search(pattern, name, re.DOTALL)
-            if match:
-                return False
-        return True
+        return not CUSTOMER_SERVICE_MATCHER.matches(name)
 
     def get_groups_to_handle(self):
         """获取新消息的群"""
@@ -152,8 +148,8 @@ class WeChatHandler:
             logger.error(f"获取新消息群失败: {e}")
             raise
     
-    def handle_group_message(self, session_id: str, session_item: auto.WindowControl) -> List[Message]:
-        """处理群消息"""
+    def handle_group_message(self, session_id: str, session_item: auto.WindowControl, mark: bool = True) -> List[Message]:
+        """处理群消息，mark 为 False 时只检查不标记，入队后再调用 mark_processed"""
         try:
             # if not self.current_session_id == session_id:
             session_item.Click(simulateMove=True)
@@ -171,129 +167,76 @@ class WeChatHandler:
                     # 获取最后几条消息
                     latest_messages = children[-get_message_count:]  # 可以调整获取的消息数量
                     
+                    candidates = []
+                    senders = []
                     for msg_item in latest_messages:
                         sender_name = msg_item.TextControl().Name
                         # 过滤圆通客服
                         if self.is_valid_message(msg_item.Name) and self.is_customer(sender_name):
                             msg_content = msg_item.Name
-                            # 如果消息未处理过，添加到redis队列
-                            if msg_content and self.redis_queue.is_message_in_wechat_processed_queue(msg_content, session_id) is False:
-                                self.redis_queue.put_wechat_processed_message(msg_content, session_id)
-                                message = Message(
-                                    content=msg_content,
-                                    source=MessageSource.WECHAT,
-                                    session_id=session_id
-                                )
-                                messages.append(message)
-                                self.current_session_id = session_id
+                            if msg_content:
+                                candidates.append(msg_content)
+                                senders.append(sender_name)
+
+                    if mark:
+                        # 整个窗口一次检查并标记，只保留未处理过的消息
+                        is_new_flags = self.redis_queue.mark_wechat_processed_batch(candidates, session_id, senders)
+                    else:
+                        # 窗口内重复的消息只保留第一条
+                        seen = set()
+                        is_new_flags = []
+                        for msg_content, sender_name in zip(candidates, senders):
+                            member = fingerprint(msg_content, session_id, sender_name)
+                            is_new_flags.append(member not in seen and not self.redis_queue.is_message_in_wechat_processed_queue(
+                                msg_content, session_id, sender_name))
+                            seen.add(member)
+                    for msg_content, sender_name, is_new in zip(candidates, senders, is_new_flags):
+                        if is_new:
+                            message = Message(
+                                content=msg_content,
+                                source=MessageSource.WECHAT,
+                                session_id=session_id
+                            )
+                            if not mark:
+                                self.pending_senders[message.id] = sender_name
+                            messages.append(message)
                     
             return messages
         except Exception as e:
             logger.error(f"处理群消息失败: {e}")
             raise  # 重新抛出异常
 
-    def try_get_message(self) -> Optional[str]:
-        """尝试获取并处理消息，带重试机制"""
-        try:
-            # self.wx.SetActive()  # 激活微信窗口
-            session = self.wx.ListControl(Name="会话")
-            self.new_message = session.TextControl(searchDepth=3)
-
-            if self.new_message.Exists():
-                for session_item in session.GetChildren():
-                    try:
-                        # self.new_message.Click(simulateMove=False)
-                        
-                        if not session_item.Exists() or not re.search(r'\d+条新消息$', session_item.Name):
-                            continue
-                        
-                        print(f"新消息: {session_item.Name}")
-
-                            # if group_name != re.sub(r'\d+条新消息$', '', session_item.Name):
-                        session_item.Click(simulateMove=False)
-                        time.sleep(random.uniform(3, 5))  # 适当的循环间隔
-                        
-                        group_name = self.get_session_id()
-                        session_id = next((k for k, v in self.monitoring_groups.items() if v == group_name), None)
-
-                        # 判断group在监控群里面 且 在拿到的会话列表里面
-                        if session_id is not None and session_id in self.group_cache:                                                        
-                            
-                            if session_id not in self.buffer:
-                                self.buffer[session_id] = deque(maxlen=self.buffer_size)  # 确保 buffer 中存在 session_id
-
-                            msg_list = self.wx.ListControl(Name='消息')
-                            if msg_list.Exists():
-                                children = msg_list.GetChildren()
-                                if children:
-                                    # 判断需要获取的消息数量
-                                    get_message_count = len(children) if len(children) < self.last_message_count else self.last_message_count
-                                    # 判断当前群是否处理过消息，如果没处理过，get_message_count = 1
-                                    # 获取最后几条消息
-                                    latest_messages = children[-get_message_count:]  # 可以调整获取的消息数量
-                                    # is_processed = False
-                                    for msg_item in latest_messages:
-                                        sender_name = msg_item.TextControl().Name
-                                        # 过滤圆通客服
-                                        if self.is_valid_message(msg_item.Name) and self.is_customer(sender_name):
-                                            msg_content = msg_item.Name
-                                            # 如果消息未处理过，添加到缓冲区
-                                            if msg_content and self.redis_queue.is_message_in_wechat_processed_queue(msg_content, session_id) is False:
-                                                self.buffer[session_id].append(msg_content)
-                                                self.redis_queue.put_wechat_processed_message(msg_content, session_id)
-                                                self.current_session_id = session_id
-                                                # is_processed = True
-                                    
-                                    # if is_processed:
-                                    #     return True
-                    except Exception as e:
-                        logger.error(f"获取消息失败，重试中: {e}")
-                        raise  # 重新抛出异常
-                        # time.sleep(self.retry_delay)
-                    
-            # print(f"无法获取会话，继续下一次循环")
-            time.sleep(random.uniform(5, 10))  # 适当的循环间隔
-        
-        except Exception as e:
-            logger.error(f"获取微信会话发生错误: {e}")
-            raise  # 重新抛出异常
-    
-    def get_next_message(self) -> Optional[str]:
-        """从缓冲区获取下一条要处理的消息"""
-        if self.current_session_id in self.buffer and self.buffer[self.current_session_id]:
-            return self.buffer[self.current_session_id].popleft()
-        else:
-            return None
-        
     def get_messages(self) -> List[Message]:
-        """获取新消息"""
+        """获取各群的新消息，只检查不标记，入队后由 mark_processed 标记"""
+        # 上一轮未标记的消息没有入队，下一轮会被重新读取
+        self.pending_senders = {}
         messages = []
-        
-        # 尝试获取新消息
-        if self.try_get_message():
-            # 处理缓冲区中的所有消息
-            while True:
-                msg = self.get_next_message()
-                if msg is None:
-                    break
-                message = Message(
-                    content=msg,
-                    source=MessageSource.WECHAT,
-                    session_id=self.current_session_id
-                )
-                messages.append(message)
-        
+        for session_id, session_item in self.get_groups_to_handle().items():
+            messages.extend(self.handle_group_message(session_id, session_item, mark=False))
+            time.sleep(random.uniform(1, 2))  # 适当的切换间隔
+
         time.sleep(0.5)  # 适当的循环间隔
-            
+
         return messages
-    
+
+    def mark_processed(self, message: Message):
+        """消息入队后标记为已处理"""
+        sender = self.pending_senders.pop(message.id, None)
+        self.redis_queue.put_wechat_processed_message(message.content, message.session_id, sender)
+
     def filter_message(self, msg: str) -> str:
         """过滤消息"""
         msg = msg.replace('\n', ' ')
         return re.sub(r'@\w+', '', msg)
 
-    def send_message(self, message: str, session_id: str, group_name:str) -> bool:
-        """向指定群发送消息"""
+    def send_message(self, message: str, session_id: str, group_name:str, order_number: str = None) -> bool:
+        """向指定群发送消息，同一群、订单与内容在发送记录窗口内只发送一次"""
+        if self.send_ledger is None:
+            return self._send_message(message, session_id, group_name)
+        return self.send_ledger.send_once(f"wechat_{session_id}", self.filter_message(message),
+                                          lambda: self._send_message(message, session_id, group_name), order_number)
+
+    def _send_message(self, message: str, session_id: str, group_name:str) -> bool:
         try:
             # if not self.switch_to_session(session_id):
             #     return False
@@ -327,6 +270,7 @@ class WeChatHandler:
                 
             # send_button.Click(simulateMove=False)
             logger.info(f"微信消息已发送到群 {session_id}: {message}")
+            self.last_sent_at = time.time()
             return True
             
         except Exception as e:
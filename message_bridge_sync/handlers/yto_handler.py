@@ -9,6 +9,7 @@ from selenium.webdriver.common.keys import Keys
 from logger import logger
 from models.message import Message
 from models.message import MessageSource
+from models.yto_reply import parse_yto_reply
 from typing import Any, Optional, Dict, List
 from models.redis_queue import RedisQueue
 from collections import deque
@@ -17,12 +18,16 @@ import re
 from config import YTO_MESSAGE_FORMATS, YTO_SERVICE_ID, NEW_YTO_MESSAGE_COUNT
 
 class YtoHandler:
-    def __init__(self, redis_queue):
+    def __init__(self, redis_queue, send_ledger=None):
         self.driver = None
         self.max_processed_count = 10
         self.buffer = deque(maxlen=self.max_processed_count)
         self.current_session_id = None
         self.redis_queue = redis_queue
+        # 发送记录，重启或重试后已发送过的消息不再发送
+        self.send_ledger = send_ledger
+        # 最近一次实际发送成功的时间，发送记录跳过的不计入
+        self.last_sent_at = 0.0
         
     def init_browser(self):
         """初始化浏览器"""
@@ -89,8 +94,13 @@ class YtoHandler:
                 return True
         return False
     
-    def send_message(self, message: str) -> bool:
-        """发送消息到圆通系统"""
+    def send_message(self, message: str, order_number: str = None) -> bool:
+        """发送消息到圆通系统，同一订单与内容在发送记录窗口内只发送一次"""
+        if self.send_ledger is None:
+            return self._send_message(message)
+        return self.send_ledger.send_once("yto", message, lambda: self._send_message(message), order_number)
+
+    def _send_message(self, message: str) -> bool:
         try:
             # # 找到消息输入框
             # 
@@ -110,6 +120,7 @@ class YtoHandler:
             send_button.click()
             
             logger.info(f"消息已发送到圆通系统: {message}")
+            self.last_sent_at = time.time()
             return True
             
         except Exception as e:
@@ -127,6 +138,8 @@ class YtoHandler:
             # last_news_message_elements = self.driver.execute_script("return window.getNewItems();")
 
             messages = []
+            candidates = []
+            send_times = []
             for msg_item in last_news_message_elements:
                     # msg_item = new_msg_item.find_element(By.CSS_SELECTOR, ".news-box")
 
@@ -142,18 +155,25 @@ class YtoHandler:
                         # logger.info(f"收到来自 {sender_span.text} 的消息: {msg_content}")
                         continue
                     
-                    if self.is_valid_message(msg_content):
-                        # 如果消息未处理过，添加到缓冲区
-                        if msg_content and self.redis_queue.is_message_in_yto_processed_queue(msg_content) is False:
-                            self.redis_queue.put_yto_processed_message(msg_content)
-                            message = Message(
-								content=msg_content,
-								source=MessageSource.YTO,
-								# session_id=self.current_session_id
-							)
-                            messages.append(message)
-                            # self.current_session_id = session_id
-                            logger.info(f"获取到yto消息: {msg_content}")
+                    if msg_content and self.is_valid_message(msg_content):
+                        candidates.append(msg_content)
+                        send_times.append(send_time)
+
+            # 整个窗口一次检查并标记，只保留未处理过的消息
+            is_new_flags = self.redis_queue.mark_yto_processed_batch(candidates)
+            for msg_content, send_time, is_new in zip(candidates, send_times, is_new_flags):
+                if is_new:
+                    # 采集时解析一次，后续按解析结果匹配订单与群
+                    reply = parse_yto_reply(msg_content, send_time)
+                    message = Message(
+                        content=msg_content,
+                        source=MessageSource.YTO,
+                        order_number=reply.waybill,
+                        # session_id=self.current_session_id
+                        reply=reply,
+                    )
+                    messages.append(message)
+                    logger.info(f"获取到yto消息: {msg_content}, 解析结果: {reply}")
             
             return messages
         except Exception as e:
@@ -186,9 +206,8 @@ class YtoHandler:
                     
                     if self.is_valid_message(msg_content):
                         # 如果消息未处理过，添加到缓冲区
-                        if msg_content and self.redis_queue.is_message_in_yto_processed_queue(msg_content) is False:
-                            self.buffer.append(msg_content)
-                            self.redis_queue.put_yto_processed_message(msg_content)
+                        if msg_content and self.redis_queue.mark_yto_processed(msg_content):
+                            self.buffer.append((msg_content, parse_yto_reply(msg_content, send_time)))
                             # self.current_session_id = session_id
                             logger.info(f"获取到yto消息: {msg_content}")
                             return True
@@ -204,8 +223,8 @@ class YtoHandler:
             logger.error(f"获取圆通消息失败: {e}")
             raise  # 重新抛出异常
             
-    def get_next_message(self) -> Optional[str]:
-        """从缓冲区获取下一条要处理的消息"""
+    def get_next_message(self) -> Optional[tuple]:
+        """从缓冲区获取下一条要处理的消息及解析结果"""
         if self.buffer:
             return self.buffer.popleft()
         else:
@@ -219,13 +238,16 @@ class YtoHandler:
         if self.try_get_message():
             # 处理缓冲区中的所有消息
             while True:
-                msg = self.get_next_message()
-                if msg is None:
+                item = self.get_next_message()
+                if item is None:
                     break
+                msg, reply = item
                 message = Message(
                     content=msg,
                     source=MessageSource.YTO,
+                    order_number=reply.waybill,
                     # session_id=self.current_session_id
+                    reply=reply,
                 )
                 messages.append(message)
         
@@ -0,0 +1,199 @@
+# keyspace_report.py
+# 按类统计桥接服务在 redis 中的键: 数量、成员数、内存、编码与增长，按群汇总，标记已退出紧凑编码的键
+# 用法: python keyspace_report.py [--count 1000] [--pause 0] [--top 10] [--snapshot keyspace_report.json] [--enforce]
+#   --snapshot 读取上次的统计计算增长，并写入本次统计
+#   --enforce 检查 KEYSPACE_BUDGETS，超出预算的已处理集合与会话订单先执行一次全量保留策略，仍超出时退出码为 1
+import argparse
+import json
+import os
+import re
+import time
+from config import KEYSPACE_BUDGETS
+from models.redis_client import create_redis_client
+
+# 键名到类别，cluster 键布局的 hash tag 一并匹配；已处理集合需要排在队列之前
+KEY_FAMILIES = [
+    ('wechat_processed', re.compile(r'^wechat_messages_processed_\{?(?P<session>.*?)\}?$')),
+    ('yto_processed', re.compile(r'^yto_messages_processed$')),
+    ('session_order', re.compile(r'^session_order_\{?(?P<session>.*?)\}?$')),
+    ('order_index', re.compile(r'^order_to_session')),
+    ('queue', re.compile(r'^(\{bridge\})?(wechat_messages|yto_messages|retry_messages|dead_letter_messages)')),
+    ('rate_limit', re.compile(r'^\{?rate_limit\}?_')),
+    ('send_ledger', re.compile(r'^send_ledger_')),
+]
+
+# 紧凑编码，超过 *-max-listpack-entries / *-max-listpack-value 后转为普通编码，内存占用成倍增加
+COMPACT_ENCODINGS = {'listpack', 'ziplist', 'intset', 'quicklist', 'embstr', 'int'}
+
+# 各类型的成员数量命令
+CARDINALITY_COMMANDS = {'zset': 'ZCARD', 'hash': 'HLEN', 'list': 'LLEN', 'set': 'SCARD', 'stream': 'XLEN', 'string': 'STRLEN'}
+
+
+def classify(redis_key: str):
+    """返回 (类别, 会话ID)，不属于桥接服务的键返回 (None, None)"""
+    for family, pattern in KEY_FAMILIES:
+        match = pattern.match(redis_key)
+        if match:
+            return family, match.groupdict().get('session')
+    return None, None
+
+
+def inspect_keys(redis_client, redis_keys):
+    """两次 pipeline 取得一批键的类型、内存、编码与成员数"""
+    pipe = redis_client.pipeline(transaction=False)
+    for redis_key in redis_keys:
+        pipe.type(redis_key)
+        pipe.memory_usage(redis_key)
+        pipe.object('encoding', redis_key)
+    first = pipe.execute(raise_on_error=False)
+
+    pipe = redis_client.pipeline(transaction=False)
+    for i, redis_key in enumerate(redis_keys):
+        pipe.execute_command(CARDINALITY_COMMANDS.get(first[3 * i], 'EXISTS'), redis_key)
+    cardinalities = pipe.execute(raise_on_error=False)
+
+    for i, redis_key in enumerate(redis_keys):
+        key_type, memory, encoding = first[3 * i:3 * i + 3]
+        if key_type == 'none':
+            # 扫描之后被删除或过期
+            continue
+        # 托管 redis 可能禁用 MEMORY/OBJECT 命令，此时内存与编码不统计
+        memory = memory if isinstance(memory, int) else 0
+        encoding = encoding if isinstance(encoding, str) else None
+        members = cardinalities[i] if isinstance(cardinalities[i], int) else 0
+        yield redis_key, key_type, memory, encoding, members
+
+
+def scan(redis_client, count: int, pause: float):
+    """SCAN 全部键并按类别汇总，每批一组 pipeline，批次之间暂停以减轻对线上的影响"""
+    families = {}
+    sessions = {}
+    flagged = []
+    batch = []
+
+    def flush():
+        for redis_key, key_type, memory, encoding, members in inspect_keys(redis_client, batch):
+            family, session_id = classify(redis_key)
+            stats = families.setdefault(family, {'keys': 0, 'members': 0, 'memory': 0, 'encodings': {}})
+            stats['keys'] += 1
+            stats['members'] += members
+            stats['memory'] += memory
+            stats['encodings'][encoding] = stats['encodings'].get(encoding, 0) + 1
+            if session_id is not None:
+                session_stats = sessions.setdefault(session_id, {})
+                family_stats = session_stats.setdefault(family, {'members': 0, 'memory': 0})
+                family_stats['members'] += members
+                family_stats['memory'] += memory
+            if encoding and encoding not in COMPACT_ENCODINGS and key_type in ('zset', 'hash', 'set', 'list'):
+                flagged.append((redis_key, key_type, encoding, members, memory))
+        batch.clear()
+        if pause:
+            time.sleep(pause)
+
+    for redis_key in redis_client.scan_iter(count=count):
+        if classify(redis_key)[0] is None:
+            continue
+        batch.append(redis_key)
+        if len(batch) >= count:
+            flush()
+    if batch:
+        flush()
+    return families, sessions, flagged
+
+
+def human_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def growth(current: dict, previous: dict, elapsed: float) -> str:
+    """与上次统计相比的键数与内存变化，以及按天折算的内存增长"""
+    if not previous:
+        return ''
+    keys = current['keys'] - previous.get('keys', 0)
+    memory = current['memory'] - previous.get('memory', 0)
+    per_day = memory / elapsed * 86400 if elapsed > 0 else 0
+    return f"{keys:+d} 键, {'+' if memory >= 0 else '-'}{human_bytes(abs(memory))} ({human_bytes(per_day)}/天)"
+
+
+def report(families, sessions, flagged, previous, top: int):
+    elapsed = time.time() - previous.get('time', time.time())
+    print(f"{'类别':<18}{'键数':>10}{'成员数':>12}{'内存':>12}  编码  增长")
+    for family, stats in sorted(families.items(), key=lambda item: -item[1]['memory']):
+        encodings = ', '.join(f"{encoding}:{count}" for encoding, count in sorted(stats['encodings'].items(), key=str))
+        change = growth(stats, previous.get('families', {}).get(family, {}), elapsed)
+        print(f"{family:<18}{stats['keys']:>10}{stats['members']:>12}{human_bytes(stats['memory']):>12}  "
+              f"{encodings}  {change}")
+
+    if sessions:
+        print(f"\n内存占用最多的 {top} 个群:")
+        totals = sorted(sessions.items(), key=lambda item: -sum(stats['memory'] for stats in item[1].values()))
+        for session_id, session_stats in totals[:top]:
+            detail = ', '.join(f"{family} {stats['members']} 条 {human_bytes(stats['memory'])}"
+                               for family, stats in sorted(session_stats.items()))
+            print(f"  {session_id}: {detail}")
+
+    if flagged:
+        print(f"\n已退出紧凑编码的键 {len(flagged)} 个，可调大 *-max-listpack-entries 或降低保留上限:")
+        for redis_key, key_type, encoding, members, memory in sorted(flagged, key=lambda item: -item[4])[:top]:
+            print(f"  {redis_key} {key_type}/{encoding} {members} 条 {human_bytes(memory)}")
+
+
+def over_budget(families) -> dict:
+    """返回超出预算的类别及原因"""
+    violations = {}
+    for family, budget in KEYSPACE_BUDGETS.items():
+        stats = families.get(family, {'keys': 0, 'memory': 0})
+        reasons = []
+        if budget.get('keys') and stats['keys'] > budget['keys']:
+            reasons.append(f"键数 {stats['keys']} > {budget['keys']}")
+        if budget.get('memory') and stats['memory'] > budget['memory']:
+            reasons.append(f"内存 {human_bytes(stats['memory'])} > {human_bytes(budget['memory'])}")
+        if reasons:
+            violations[family] = reasons
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="redis 键空间使用统计")
+    parser.add_argument('--count', type=int, default=1000, help="每次 SCAN 与 pipeline 的键数量")
+    parser.add_argument('--pause', type=float, default=0, help="批次之间暂停的秒数")
+    parser.add_argument('--top', type=int, default=10, help="按群汇总与编码告警显示的条数")
+    parser.add_argument('--snapshot', default=None, help="统计快照文件，用于计算增长")
+    parser.add_argument('--enforce', action='store_true', help="检查预算，超出时执行保留策略")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.snapshot and os.path.exists(args.snapshot):
+        with open(args.snapshot, 'r', encoding='utf-8') as snapshot:
+            previous = json.load(snapshot)
+
+    redis_client = create_redis_client()
+    families, sessions, flagged = scan(redis_client, args.count, args.pause)
+    report(families, sessions, flagged, previous, args.top)
+
+    if args.snapshot:
+        with open(args.snapshot, 'w', encoding='utf-8') as snapshot:
+            json.dump({'time': time.time(), 'families': families}, snapshot, ensure_ascii=False)
+
+    if not args.enforce:
+        return
+    violations = over_budget(families)
+    if set(violations) & {'wechat_processed', 'yto_processed', 'session_order', 'order_index'}:
+        # 已处理集合、会话订单与订单映射可由保留策略裁剪，裁剪后重新统计
+        from models.redis_queue import RedisQueue
+        removed = RedisQueue().enforce_retention(full=True)
+        print(f"\n超出预算，执行全量保留策略，移除 {removed} 条")
+        families = scan(redis_client, args.count, args.pause)[0]
+        violations = over_budget(families)
+    for family, reasons in violations.items():
+        print(f"超出预算 {family}: {', '.join(reasons)}")
+    if violations:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
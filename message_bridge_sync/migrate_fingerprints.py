@@ -0,0 +1,21 @@
+# migrate_fingerprints.py
+# 将已处理集合中保存的完整消息内容迁移为定长指纹
+# 用法: python migrate_fingerprints.py [--dry-run]
+import argparse
+from models.redis_queue import RedisQueue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="已处理消息集合迁移为指纹")
+    parser.add_argument('--dry-run', action='store_true', help="只统计需要迁移的数量，不修改数据")
+    args = parser.parse_args()
+
+    redis_queue = RedisQueue()
+    migrated = redis_queue.migrate_processed_fingerprints(dry_run=args.dry_run)
+    for redis_key, count in migrated.items():
+        print(f"{redis_key}: {count}")
+    print(f"共 {len(migrated)} 个键, {sum(migrated.values())} 条消息{'需要迁移' if args.dry_run else '已迁移'}")
+
+
+if __name__ == "__main__":
+    main()
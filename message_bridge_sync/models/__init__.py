@@ -1,5 +1,11 @@
 from .message import Message, MessageSource, MessageType
+from .queue_backend import QueueBackend, create_queue_backend
 from .redis_queue import RedisQueue
+from .async_redis_queue import AsyncRedisQueue
+from .stream_queue import RedisStreamQueue
+from .memory_queue import MemoryQueue
+from .sqlite_queue import SqliteQueue
 from .order_manager import OrderManager
 
-__all__ = ['Message', 'MessageSource', 'MessageType', 'RedisQueue', 'OrderManager']
\ No newline at end of file
+__all__ = ['Message', 'MessageSource', 'MessageType', 'QueueBackend', 'create_queue_backend', 'RedisQueue',
+           'AsyncRedisQueue', 'RedisStreamQueue', 'MemoryQueue', 'SqliteQueue', 'OrderManager']
\ No newline at end of file
@@ -0,0 +1,441 @@
+import asyncio
+import json
+import random
+import time
+import redis
+from redis.client import NEVER_DECODE
+from logger import logger
+from models.message import Message
+from typing import Any, Optional, Dict, List, Tuple
+from config import ASYNC_REDIS, SESSION_QUEUE_WEIGHTS, QUEUE_TYPE, MAX_RETRIES
+from models.redis_layout import RedisLayout
+from models.envelope import encode_message, decode_message
+from models.redis_client import get_async_redis_client
+from models.fingerprint import fingerprint
+from models.priority import classify_priority, lane_deadline
+
+class AsyncRedisQueue(RedisLayout):
+    """基于 redis.asyncio 的队列实现，方法与 RedisQueue 相同，均为协程
+
+    所有实例共用进程内的异步连接池，多个查询可以同时进行，不会排在一个阻塞调用之后。
+    键布局、重试条目与保留策略来自 RedisLayout，与 RedisQueue 一致，两者可以同时读写同一个 redis。
+    本地缓存、溢出日志与延后写入依赖常驻线程，只在 RedisQueue 中提供；保留策略由调用方定期执行 enforce_retention。
+    """
+
+    def __init__(self, redis_client=None):
+        if QUEUE_TYPE == "stream":
+            raise ValueError("异步队列只支持 list 队列类型")
+        self.redis_client = redis_client or get_async_redis_client()
+        # 只有一个客户端，二进制消息由 _raw 读取时不解码
+        self._init_layout(self.redis_client)
+
+        # 单个事件循环内访问，无需加锁
+        self.dirty_keys = set()
+        self.healthy = True
+        self.health_task = None
+
+    @classmethod
+    async def create(cls, redis_client=None) -> 'AsyncRedisQueue':
+        """创建队列，写入群权重并启动后台健康检查"""
+        queue = cls(redis_client)
+        if queue.per_session_queue:
+            await queue._init_session_weights()
+        queue.start_health_check()
+        return queue
+
+    async def close(self):
+        """停止健康检查；共享连接池由 close_async_redis_client 关闭"""
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+    async def _raw(self, *args) -> Any:
+        """执行命令，响应不解码，用于读取二进制消息"""
+        return await self.redis_client.execute_command(*args, **{NEVER_DECODE: True})
+
+    async def _raw_script(self, script, keys: List[str], args: list) -> Any:
+        """执行返回二进制消息的脚本，脚本未加载时先加载"""
+        try:
+            return await self._raw('EVALSHA', script.sha, len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            await self.redis_client.script_load(script.script)
+            return await self._raw('EVALSHA', script.sha, len(keys), *keys, *args)
+
+    # ---------- 连接健康检查 ----------
+
+    def start_health_check(self):
+        """启动后台健康检查任务"""
+        if self.health_task is None:
+            self.health_task = asyncio.ensure_future(self._health_check())
+
+    async def _health_check(self):
+        """定期 PING；失败时断开空闲连接，按带抖动的指数退避重试，避免多个进程同时重连"""
+        failures = 0
+        base, cap = ASYNC_REDIS['reconnect_backoff']
+        while True:
+            try:
+                await self.redis_client.ping()
+                if failures:
+                    logger.info(f"redis 连接已恢复，失败 {failures} 次")
+                failures = 0
+                self.healthy = True
+                delay = ASYNC_REDIS['ping_interval']
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                failures += 1
+                self.healthy = False
+                logger.warning(f"redis 健康检查失败 {failures} 次: {e}")
+                if not self.cluster_client:
+                    # 失效的空闲连接不再复用，正在使用的连接由各自的命令重连
+                    await self.redis_client.connection_pool.disconnect(inuse_connections=False)
+                delay = random.uniform(0, min(cap, base * 2 ** failures))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"redis 健康检查出错: {e}")
+                delay = ASYNC_REDIS['ping_interval']
+            await asyncio.sleep(delay)
+
+    async def _init_session_weights(self):
+        """将配置的群权重写入redis，供轮询脚本读取"""
+        pipe = self._pipeline(transaction=True)
+        pipe.delete(self.yto_weight_queue)
+        if SESSION_QUEUE_WEIGHTS:
+            pipe.hset(self.yto_weight_queue, mapping=SESSION_QUEUE_WEIGHTS)
+        await pipe.execute()
+
+    # ---------- 消息队列 ----------
+
+    async def put_wechat_message(self, message: Message):
+        """将微信消息放入队列"""
+        try:
+            if self.priority_queue:
+                priority = classify_priority(message.content)
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.zadd(self.wechat_lane_queues[priority],
+                          {encode_message(message): time.time() + lane_deadline(priority)})
+                pipe.rpush(self.wechat_notify_queue, 1)
+                pipe.ltrim(self.wechat_notify_queue, -1, -1)
+                await pipe.execute()
+            else:
+                await self.redis_client.rpush(self.wechat_queue, encode_message(message))
+            logger.info(f"消息已加入微信队列: {message.content}")
+        except Exception as e:
+            logger.error(f"添加微信消息到队列失败: {e}")
+            raise
+
+    async def get_wechat_message(self) -> Optional[dict]:
+        """从队列获取微信消息"""
+        try:
+            if self.priority_queue:
+                return await self._pop_priority_wechat_message()
+            data = await self._raw('LPOP', self.wechat_queue)
+            return decode_message(data) if data else None
+        except Exception as e:
+            logger.error(f"从队列获取微信消息失败: {e}")
+            raise
+
+    async def _pop_priority_wechat_message(self) -> Optional[dict]:
+        keys, args = self._priority_pop_call()
+        data = await self._raw_script(self.pop_earliest_deadline_script, keys, args)
+        return decode_message(data) if data else None
+
+    async def put_yto_message(self, message: Message):
+        """将圆通消息放入队列"""
+        try:
+            if self.per_session_queue:
+                keys, args = self._session_message_call(message)
+                await self.put_session_message_script(keys=keys, args=args)
+            else:
+                await self.redis_client.rpush(self.yto_queue, encode_message(message))
+            logger.info(f"消息已加入圆通队列: {message.content}")
+        except Exception as e:
+            logger.error(f"添加圆通消息到队列失败: {e}")
+            raise
+
+    async def get_yto_message(self) -> Optional[dict]:
+        """从队列获取圆通消息"""
+        try:
+            if self.per_session_queue:
+                return await self._pop_fair_yto_message()
+            data = await self._raw('LPOP', self.yto_queue)
+            return decode_message(data) if data else None
+        except Exception as e:
+            logger.error(f"从队列获取圆通消息失败: {e}")
+            raise
+
+    async def _pop_fair_yto_message(self) -> Optional[dict]:
+        while True:
+            keys, args = self._fair_pop_call()
+            result = await self._raw_script(self.pop_fair_message_script, keys, args)
+            if not self._declare_session_queue(result):
+                return decode_message(result[1]) if result else None
+
+    async def wait_for_message(self, queues: List[str], timeout: int) -> Optional[Tuple[str, dict]]:
+        """阻塞等待多个队列，任一队列有消息立即返回 (队列名, 消息)，超时返回None；只占用一个连接"""
+        try:
+            pollers = {}
+            if self.priority_queue and self.wechat_queue in queues:
+                pollers[self.wechat_queue] = (self.wechat_notify_queue, self._pop_priority_wechat_message)
+            if self.per_session_queue and self.yto_queue in queues:
+                pollers[self.yto_queue] = (self.yto_notify_queue, self._pop_fair_yto_message)
+            for queue, (_, pop_message) in pollers.items():
+                message = await pop_message()
+                if message:
+                    return queue, message
+
+            block_queues = [pollers[queue][0] if queue in pollers else queue for queue in queues]
+            result = await self._raw('BLPOP', *block_queues, timeout)
+            if not result:
+                return None
+            block_queue, data = result
+            block_queue = block_queue.decode()
+            for queue, (notify_queue, pop_message) in pollers.items():
+                if block_queue == notify_queue:
+                    message = await pop_message()
+                    return (queue, message) if message else None
+            return block_queue, decode_message(data)
+        except Exception as e:
+            logger.error(f"阻塞获取队列消息失败: {e}")
+            raise
+
+    async def ack_message(self, queue: str, message: dict):
+        """确认消息已处理完成，取出即删除的队列无需确认"""
+        pass
+
+    # ---------- 重试与死信 ----------
+
+    async def schedule_retry(self, queue: str, message: dict, error: Exception = None) -> bool:
+        """发送失败的消息按指数退避放入重试队列，超过最大重试次数放入死信队列，返回是否会重试"""
+        try:
+            entry, message, delay = self._retry_plan(queue, message, error)
+            if delay is None:
+                await self.redis_client.rpush(self.dead_letter_queue, entry)
+                logger.error(f"消息重试 {MAX_RETRIES} 次仍失败，放入死信队列: {message.get('content')}")
+                return False
+
+            await self.redis_client.zadd(self.retry_queue, {entry: time.time() + delay})
+            logger.warning(f"消息发送失败，{delay} 秒后第 {message['attempts']} 次重试: {message.get('content')}")
+            return True
+        except Exception as e:
+            logger.error(f"添加重试消息失败: {e}")
+            raise
+
+    async def pop_due_retries(self, limit: int = 100) -> List[Tuple[str, dict]]:
+        """取出已到期的重试消息，返回 (队列名, 消息) 列表"""
+        try:
+            entries = await self.pop_due_retries_script(keys=[self.retry_queue], args=[time.time(), limit])
+            return [(entry['queue'], entry['message']) for entry in map(json.loads, entries)]
+        except Exception as e:
+            logger.error(f"获取到期重试消息失败: {e}")
+            raise
+
+    async def requeue_message(self, queue: str, message: dict):
+        """将消息重新放回原队列"""
+        if queue == self.wechat_queue:
+            await self.put_wechat_message(Message.from_dict(message))
+        else:
+            await self.put_yto_message(Message.from_dict(message))
+
+    async def promote_due_retries(self, limit: int = 100) -> int:
+        """将到期的重试消息放回原队列，返回数量"""
+        due = await self.pop_due_retries(limit)
+        for index, (queue, message) in enumerate(due):
+            try:
+                await self.requeue_message(queue, message)
+            except Exception:
+                await self.redis_client.zadd(self.retry_queue, {
+                    self._retry_entry(failed_queue, failed_message): time.time()
+                    for failed_queue, failed_message in due[index:]
+                })
+                raise
+        return len(due)
+
+    async def list_dead_letters(self, limit: int = 100) -> List[dict]:
+        """查看死信队列中的消息"""
+        try:
+            return [json.loads(data) for data in await self.redis_client.lrange(self.dead_letter_queue, 0, limit - 1)]
+        except Exception as e:
+            logger.error(f"查看死信队列失败: {e}")
+            raise
+
+    async def replay_dead_letters(self, limit: int = None, queue: str = None) -> int:
+        """将死信队列中的消息批量放回原队列，重试次数清零；queue 指定时只重放该队列的消息"""
+        try:
+            # 先查看再放回，只删除已放回的消息；中途失败时其余消息仍在死信队列，未选中的消息保持原有位置
+            replayed = []
+            try:
+                for data in await self.redis_client.lrange(self.dead_letter_queue, 0, -1 if limit is None else limit - 1):
+                    target = self._replay_target(data, queue)
+                    if target is None:
+                        continue
+                    await self.requeue_message(*target)
+                    replayed.append(data)
+            finally:
+                if replayed:
+                    pipe = self._pipeline(transaction=False)
+                    for data in replayed:
+                        pipe.lrem(self.dead_letter_queue, 1, data)
+                    await pipe.execute()
+            logger.info(f"死信队列重放 {len(replayed)} 条消息")
+            return len(replayed)
+        except Exception as e:
+            logger.error(f"重放死信队列失败: {e}")
+            raise
+
+    # ---------- 已处理消息 ----------
+
+    async def _check_and_mark(self, redis_key: str, members: List[str]) -> List[bool]:
+        if not members:
+            return []
+        added = await self.check_and_mark_script(keys=[redis_key], args=[time.time(), *members])
+        self.dirty_keys.add(redis_key)
+        return [bool(flag) for flag in added]
+
+    async def put_wechat_processed_message(self, message: str, session_id: str, sender: str = None):
+        """将微信消息放入已处理队列"""
+        await self.mark_wechat_processed(message, session_id, sender)
+
+    async def mark_wechat_processed(self, message: str, session_id: str, sender: str = None) -> bool:
+        """检查并标记微信消息为已处理，返回是否为新消息"""
+        return (await self.mark_wechat_processed_batch([message], session_id, [sender]))[0]
+
+    async def mark_wechat_processed_batch(self, messages: List[str], session_id: str,
+                                          senders: Optional[List[str]] = None) -> List[bool]:
+        """批量检查并标记微信消息为已处理，返回每条消息是否为新消息"""
+        try:
+            redis_key = self._session_key(self.wechat_processed_queue, session_id)
+            senders = senders or [None] * len(messages)
+            members = [fingerprint(message, session_id, sender) for message, sender in zip(messages, senders)]
+            return await self._check_and_mark(redis_key, members)
+        except Exception as e:
+            logger.error(f"标记微信消息为已处理失败: {e}")
+            raise
+
+    async def is_message_in_wechat_processed_queue(self, message: str, session_id: str, sender: str = None) -> bool:
+        """判断消息是否在已处理队列中"""
+        redis_key = self._session_key(self.wechat_processed_queue, session_id)
+        return await self.redis_client.zscore(redis_key, fingerprint(message, session_id, sender)) is not None
+
+    async def put_yto_processed_message(self, message: str):
+        """将圆通消息放入已处理队列"""
+        await self.mark_yto_processed(message)
+
+    async def mark_yto_processed(self, message: str) -> bool:
+        """检查并标记圆通消息为已处理，返回是否为新消息"""
+        return (await self.mark_yto_processed_batch([message]))[0]
+
+    async def mark_yto_processed_batch(self, messages: List[str]) -> List[bool]:
+        """批量检查并标记圆通消息为已处理，返回每条消息是否为新消息"""
+        try:
+            return await self._check_and_mark(self.yto_processed_queue, [fingerprint(message) for message in messages])
+        except Exception as e:
+            logger.error(f"标记圆通消息为已处理失败: {e}")
+            raise
+
+    async def is_message_in_yto_processed_queue(self, message: str) -> bool:
+        """判断消息是否在已处理队列中"""
+        return await self.redis_client.zscore(self.yto_processed_queue, fingerprint(message)) is not None
+
+    # ---------- 订单与会话 ----------
+
+    async def put_orders_to_session(self, session_id: str, order_numbers: List[str]) -> int:
+        """处理订单列表，将不在会话中的订单添加到会话中，返回新增订单数量"""
+        try:
+            if not order_numbers:
+                return 0
+            keys, args = self._register_orders_call(session_id, order_numbers)
+            added = await self.register_orders_script(keys=keys, args=args)
+            if not self.order_index.inline_key and added:
+                pipe = self.redis_client.pipeline(transaction=False)
+                self.order_index.queue_set_many(pipe, session_id, [self.order_index.decode(member) for member in added])
+                await pipe.execute()
+            self.dirty_keys.add(keys[0])
+            return len(added)
+        except Exception as e:
+            logger.error(f"将订单加入微信会话失败: {e}")
+            raise
+
+    async def put_session_order(self, session_id: str, order_number: str):
+        """将订单放入微信关联群"""
+        await self.put_orders_to_session(session_id, [order_number])
+
+    async def is_order_in_session(self, session_id: str, order_number: str) -> bool:
+        """判断订单是否已在会话中"""
+        redis_key = self._session_key(self.session_order_queue, session_id)
+        return await self.redis_client.zscore(redis_key, self.order_index.encode(order_number)) is not None
+
+    async def find_session_id_by_order_number(self, order_number: str) -> Optional[str]:
+        """根据订单号查找对应的会话ID"""
+        return (await self.find_session_ids_by_order_numbers([order_number])).get(order_number)
+
+    async def find_session_ids_by_order_numbers(self, order_numbers: List[str]) -> Dict[str, Optional[str]]:
+        """批量查找订单号对应的会话ID，一次 pipeline"""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            parse = self.order_index.queue_get_many(pipe, order_numbers)
+            return {order_number: session_id or None for order_number, session_id in parse(await pipe.execute()).items()}
+        except Exception as e:
+            logger.error(f"查找订单号对应的会话ID失败: {e}")
+            raise
+
+    async def list_session_orders(self, session_ids: List[str]) -> Dict[str, List[str]]:
+        """返回各会话中的订单号，按写入顺序，一次 pipeline 完成"""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for session_id in session_ids:
+                pipe.zrange(self._session_key(self.session_order_queue, session_id), 0, -1)
+            return {session_id: [self.order_index.decode(member) for member in members]
+                    for session_id, members in zip(session_ids, await pipe.execute())}
+        except Exception as e:
+            logger.error(f"获取会话订单失败: {e}")
+            raise
+
+    # ---------- 保留策略与缓存 ----------
+
+    async def enforce_retention(self, full: bool = False) -> int:
+        """按时间窗口与数量上限批量裁剪写入过的集合；full 为 True 时扫描全部集合"""
+        try:
+            redis_keys, self.dirty_keys = self.dirty_keys, set()
+            if full:
+                redis_keys.add(self.yto_processed_queue)
+                for pattern in self._retention_scan_patterns():
+                    redis_keys.update([redis_key async for redis_key in self.redis_client.scan_iter(match=pattern, count=500)])
+            if not redis_keys:
+                return 0
+
+            policies = [self._retention_policy(redis_key) for redis_key in redis_keys]
+            if self.cluster_client:
+                results = [await self.trim_script(keys=keys, args=args) for keys, args in policies]
+            else:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for keys, args in policies:
+                    await self.trim_script(keys=keys, args=args, client=pipe)
+                results = await pipe.execute()
+
+            removed = 0
+            for (keys, args), result in zip(policies, results):
+                if not isinstance(result, list):
+                    removed += result
+                    continue
+                removed += len(result)
+                orders = [self.order_index.decode(member) for member in result]
+                for redis_key, fields in self.order_index.removal_groups(orders).items():
+                    await self.order_index.remove_script(keys=[redis_key], args=[args[2], *fields])
+            if removed:
+                logger.info(f"保留策略裁剪 {len(redis_keys)} 个集合, 移除 {removed} 条")
+            return removed
+        except Exception as e:
+            logger.error(f"执行保留策略失败: {e}")
+            raise
+
+    async def warm_up_cache(self, session_ids: List[str]):
+        """没有本地缓存，无需预热"""
+        pass
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """没有本地缓存，返回空"""
+        return {}
+
+    async def flush_writes(self) -> bool:
+        """没有延后写入，无需刷新"""
+        return True
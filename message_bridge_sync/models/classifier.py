@@ -0,0 +1,106 @@
+import re
+from functools import lru_cache
+from typing import Any, Optional, Dict, List, NamedTuple, Tuple
+from models.keyword_matcher import INTENT_MATCHER
+from config import ORDER_FORMAT, WECHAT_MESSAGE_FORMATS
+
+class Classification(NamedTuple):
+    """一次扫描得到的分类结果"""
+    valid: bool  # 命中任一 WECHAT_MESSAGE_FORMATS
+    intents: Tuple[str, ...]  # 订单号后面跟随的意图关键字，按出现顺序
+    waybills: Tuple[str, ...]  # 全部订单号，按出现顺序
+    waybill_intents: Tuple[Optional[str], ...]  # 每个订单号后面的意图，没有时为 None
+    spans: Tuple[Tuple[int, int], ...]  # 每个订单号(含意图)在文本中的位置
+
+
+def _strip_wildcards(pattern: str) -> str:
+    """去掉格式首尾的 .*，search 本身就不要求从头匹配，首部的 .* 还会让每个位置都回溯到文本末尾"""
+    if pattern.startswith('.*'):
+        pattern = pattern[2:]
+    if pattern.endswith('.*') and not pattern.endswith('\\.*'):
+        pattern = pattern[:-2]
+    return pattern
+
+
+def _wrap_waybill(pattern: str) -> Tuple[str, bool]:
+    """把格式中的订单号部分包成分组，返回 (新格式, 是否包含订单号)"""
+    for order_format in ORDER_FORMAT:
+        index = pattern.find(order_format)
+        if index >= 0:
+            end = index + len(order_format)
+            return f"{pattern[:index]}({order_format}){pattern[end:]}", True
+    return pattern, False
+
+
+def _compile():
+    """把全部格式编译为一个交替模式，记录每个分支的订单号与意图分组位置
+
+    分支顺序: 消息格式、单独的订单号；同一位置取第一个能匹配的分支。
+    单独的订单号之后的意图关键字由 INTENT_MATCHER 在匹配结束位置查找，不随关键字数量增加回溯。
+    """
+    # (分支, 是否消息格式, 订单号分组偏移, 意图分组偏移)，偏移相对分支外层分组
+    branches = []
+    for pattern in WECHAT_MESSAGE_FORMATS:
+        body, has_waybill = _wrap_waybill(_strip_wildcards(pattern))
+        inner_groups = re.compile(body, re.DOTALL).groups
+        # 格式自身的第一个分组为意图
+        intent_offset = 1 + has_waybill if inner_groups > has_waybill else None
+        branches.append((body, True, 1 if has_waybill else None, intent_offset))
+    order_pattern = '|'.join(ORDER_FORMAT)
+    branches.append((f"({order_pattern})\\s*", False, 1, None))
+
+    # 分支外层分组号 -> (是否消息格式, 订单号分组, 意图分组)
+    index = {}
+    group_index = 1
+    for body, valid, waybill_offset, intent_offset in branches:
+        index[group_index] = (valid,
+                              None if waybill_offset is None else group_index + waybill_offset,
+                              None if intent_offset is None else group_index + intent_offset)
+        group_index += 1 + re.compile(body, re.DOTALL).groups
+    combined = re.compile('|'.join(f"({body})" for body, _, _, _ in branches), re.DOTALL)
+    # 单独订单号分支排在最后，外层分组号最大
+    return combined, index, max(index)
+
+
+CLASSIFIER_PATTERN, _BRANCHES, _WAYBILL_BRANCH = _compile()
+ORDER_PATTERN = re.compile('|'.join(ORDER_FORMAT))
+
+
+@lru_cache(maxsize=4096)
+def classify(text: str) -> Classification:
+    """一次扫描返回 是否有效消息、意图、订单号与位置；同一条消息在处理、入队、定优先级时只扫描一次"""
+    valid = False
+    intents = []
+    waybills = []
+    waybill_intents = []
+    spans = []
+    for match in CLASSIFIER_PATTERN.finditer(text or ''):
+        branch_valid, waybill_group, intent_group = _BRANCHES[match.lastindex]
+        valid = valid or branch_valid
+        intent = match.group(intent_group) if intent_group is not None else None
+        span = match.span()
+        if match.lastindex == _WAYBILL_BRANCH:
+            # 消息格式之外的意图也用于确定通道，最长匹配，避免 取消拦截 被识别为 拦截
+            intent = INTENT_MATCHER.match_prefix(text, match.end())
+            span = (match.start(), match.end() + len(intent)) if intent else match.span(waybill_group)
+        if intent:
+            intents.append(intent)
+        if waybill_group is not None:
+            found = [match.group(waybill_group)]
+        else:
+            # 格式中没有写出订单号格式时，在本次匹配范围内查找
+            found = ORDER_PATTERN.findall(match.group())
+        waybills.extend(found)
+        waybill_intents.extend([intent or None] * len(found))
+        spans.extend([span] * len(found))
+    return Classification(valid, tuple(intents), tuple(waybills), tuple(waybill_intents), tuple(spans))
+
+
+def is_valid_message(text: str) -> bool:
+    """消息是否符合任一 WECHAT_MESSAGE_FORMATS"""
+    return classify(text).valid
+
+
+def extract_waybills(text: str) -> List[str]:
+    """按出现顺序提取全部订单号"""
+    return list(classify(text).waybills)
@@ -0,0 +1,47 @@
+import json
+from logger import logger
+from models.message import Message
+from typing import Any, Optional, Dict, List, Union
+from config import MESSAGE_ENCODING
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 二进制信封是 msgpack 数组，第一个元素为版本号，其余字段按版本固定顺序排列，不保存字段名
+ENVELOPE_VERSION = 2
+ENVELOPE_FIELDS = {
+    1: ('id', 'created_at', 'attempts', 'trace_id', 'source', 'type', 'session_id', 'order_number', 'content'),
+    # 2: 增加圆通回复的解析结果
+    2: ('id', 'created_at', 'attempts', 'trace_id', 'source', 'type', 'session_id', 'order_number', 'content', 'reply'),
+}
+
+if MESSAGE_ENCODING == "msgpack" and msgpack is None:
+    logger.warning("未安装 msgpack，队列消息使用 json 编码")
+
+def is_binary_encoding() -> bool:
+    """队列消息是否使用二进制信封"""
+    return MESSAGE_ENCODING == "msgpack" and msgpack is not None
+
+def encode_message(message: Message) -> Union[bytes, str]:
+    """编码队列消息"""
+    if not is_binary_encoding():
+        return json.dumps(message.to_dict())
+    return msgpack.packb([
+        ENVELOPE_VERSION, message.id, message.timestamp.timestamp(), message.attempts, message.trace_id,
+        message.source.value, message.type.value, message.session_id, message.order_number, message.content,
+        list(message.reply) if message.reply else None,
+    ])
+
+def decode_message(data: Union[bytes, str]) -> dict:
+    """解码队列消息，兼容队列中已有的 json 消息，返回与 Message.to_dict 相同结构的字典"""
+    if isinstance(data, str) or data[:1] == b'{':
+        return json.loads(data)
+    if msgpack is None:
+        raise ValueError("收到二进制队列消息，但未安装 msgpack")
+    values = msgpack.unpackb(data, raw=False)
+    fields = ENVELOPE_FIELDS.get(values[0])
+    if fields is None:
+        raise ValueError(f"不支持的消息信封版本: {values[0]}")
+    return dict(zip(fields, values[1:]))
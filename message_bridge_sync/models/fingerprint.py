@@ -0,0 +1,32 @@
+import base64
+import hashlib
+import re
+from config import PROCESSED_FINGERPRINT_BITS, PROCESSED_FINGERPRINT_SALT
+
+# 指纹为 urlsafe base64 编码的摘要，64 位 11 个字符，128 位 22 个字符
+FINGERPRINT_LENGTHS = {64: 11, 128: 22}
+
+
+def is_fingerprint_enabled() -> bool:
+    """是否使用指纹代替完整消息内容"""
+    return PROCESSED_FINGERPRINT_BITS in FINGERPRINT_LENGTHS
+
+
+def fingerprint(content: str, session_id: str = None, sender: str = None) -> str:
+    """计算消息内容的定长指纹，按配置加入会话与发送者作为盐；未启用时原样返回"""
+    if not is_fingerprint_enabled():
+        return content
+
+    digest = hashlib.blake2b(digest_size=PROCESSED_FINGERPRINT_BITS // 8)
+    if 'session' in PROCESSED_FINGERPRINT_SALT and session_id:
+        digest.update(session_id.encode('utf-8') + b'\x00')
+    if 'sender' in PROCESSED_FINGERPRINT_SALT and sender:
+        digest.update(sender.encode('utf-8') + b'\x00')
+    digest.update(content.encode('utf-8'))
+    return base64.urlsafe_b64encode(digest.digest()).rstrip(b'=').decode('ascii')
+
+
+def looks_like_fingerprint(member: str) -> bool:
+    """判断集合成员是否已经是指纹，原始消息至少包含一个完整订单号，长度不会与指纹相同"""
+    length = FINGERPRINT_LENGTHS.get(PROCESSED_FINGERPRINT_BITS)
+    return length is not None and re.fullmatch(rf'[A-Za-z0-9_-]{{{length}}}', member) is not None
@@ -0,0 +1,141 @@
+import re
+from collections import deque
+from typing import Any, Optional, Dict, List, Tuple
+from config import CUSTOME_SERVICE_PATTERNS, PRIORITY_LANES
+
+# 正则元字符，不含这些字符的格式按普通文本处理
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多关键字匹配，构建一次，每个字符只做常数次查表，与关键字数量无关"""
+
+    def __init__(self, keywords: List[str]):
+        # 状态 0 为根；goto[状态][字符] -> 状态，fail[状态] -> 失配时回退的状态
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # 以该状态结尾的最长关键字，以及沿失配链可以输出的最长关键字
+        self.keyword: List[Optional[str]] = [None]
+        self.output: List[Optional[str]] = [None]
+        for keyword in keywords:
+            if keyword:
+                self._add(keyword)
+        self._build()
+
+    def _add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.keyword.append(None)
+                self.output.append(None)
+                self.goto[state][char] = next_state
+            state = next_state
+        self.keyword[state] = keyword
+
+    def _build(self):
+        """按层计算失配链"""
+        pending = deque()
+        for state in self.goto[0].values():
+            self.output[state] = self.keyword[state]
+            pending.append(state)
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self.goto[state].items():
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.output[next_state] = self.keyword[next_state] or self.output[self.fail[next_state]]
+                pending.append(next_state)
+
+    def find_all(self, text: str) -> List[Tuple[int, str]]:
+        """返回文本中出现的关键字 (起始位置, 关键字)，同一结束位置只取最长的"""
+        found = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            keyword = self.output[state]
+            if keyword:
+                found.append((index + 1 - len(keyword), keyword))
+        return found
+
+    def search(self, text: str) -> Optional[str]:
+        """返回文本中最先结束的关键字，没有时返回 None"""
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                return self.output[state]
+        return None
+
+    def match_prefix(self, text: str, start: int = 0) -> Optional[str]:
+        """返回从 start 开始的最长关键字，没有时返回 None"""
+        state = 0
+        longest = None
+        for index in range(start, len(text)):
+            state = self.goto[state].get(text[index])
+            if state is None:
+                break
+            longest = self.keyword[state] or longest
+        return longest
+
+
+class NamePatternMatcher:
+    """按格式分层匹配名称: 完全相同、前缀、包含与正则，前三层不逐个尝试格式
+
+    ^名称$ 为完全相同，^名称 为前缀，不含正则元字符的为包含(与 re.search 一致)，其余格式逐个编译为正则。
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.exact = set()
+        prefixes = []
+        keywords = []
+        regexes = []
+        for pattern in patterns:
+            # 首尾的 .* 对 search 没有影响
+            body = pattern[2:] if pattern.startswith('.*') else pattern
+            if body.endswith('.*') and not body.endswith('\\.*'):
+                body = body[:-2]
+            anchored = body.startswith('^')
+            literal = body[1:] if anchored else body
+            whole = anchored and literal.endswith('$')
+            if whole:
+                literal = literal[:-1]
+            if not literal or REGEX_METACHARACTERS & set(literal):
+                regexes.append(pattern)
+            elif whole:
+                self.exact.add(literal)
+            elif anchored:
+                prefixes.append(literal)
+            else:
+                keywords.append(literal)
+        self.prefixes = KeywordMatcher(prefixes) if prefixes else None
+        self.keywords = KeywordMatcher(keywords) if keywords else None
+        # 逐个编译，(?i) 等全局内联标志只能位于格式开头，合并为一个交替模式时会报错
+        self.regexes = [re.compile(pattern, re.DOTALL) for pattern in regexes]
+
+    def matches(self, name: str) -> bool:
+        if name in self.exact:
+            return True
+        if self.prefixes and self.prefixes.match_prefix(name):
+            return True
+        if self.keywords and self.keywords.search(name):
+            return True
+        return any(regex.search(name) for regex in self.regexes)
+
+
+# 优先级通道的意图关键字
+INTENT_KEYWORDS = sorted({intent for lane in PRIORITY_LANES.values() for intent in lane['intents']},
+                         key=len, reverse=True)
+
+# 由配置构建一次，发送者过滤与意图识别共用
+CUSTOMER_SERVICE_MATCHER = NamePatternMatcher(CUSTOME_SERVICE_PATTERNS)
+INTENT_MATCHER = KeywordMatcher(INTENT_KEYWORDS)
@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Dict, List, Tuple
+
+class LocalCache:
+    """进程内有界 LRU 缓存，按 redis 键分组失效
+
+    缓存项以 (redis键, 字段) 为键，收到某个 redis 键的失效通知时整组删除。
+    每个 redis 键维护一个版本号，读 redis 前取版本号，写缓存时版本号已变化
+    说明期间收到了失效通知，放弃写入，避免缓存旧值。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()
+        self.fields_by_key: Dict[str, set] = {}
+        self.generations: Dict[str, int] = {}
+        self.epoch = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def generation(self, redis_key: str) -> Tuple[int, int]:
+        """获取 redis 键当前的版本号，全部失效时 epoch 递增"""
+        with self.lock:
+            return self.epoch, self.generations.get(redis_key, 0)
+
+    def get(self, redis_key: str, field: str, family: str) -> Optional[Any]:
+        """读取缓存，按 family 统计命中率"""
+        with self.lock:
+            value = self.items.get((redis_key, field))
+            if value is None:
+                self.misses[family] = self.misses.get(family, 0) + 1
+                return None
+            self.items.move_to_end((redis_key, field))
+            self.hits[family] = self.hits.get(family, 0) + 1
+            return value
+
+    def put(self, redis_key: str, field: str, value: Any, generation: Optional[Tuple[int, int]] = None):
+        """写入缓存，generation 与当前版本号不一致时忽略"""
+        if value is None:
+            return
+        with self.lock:
+            if generation is not None and generation != (self.epoch, self.generations.get(redis_key, 0)):
+                return
+            self.items[(redis_key, field)] = value
+            self.items.move_to_end((redis_key, field))
+            self.fields_by_key.setdefault(redis_key, set()).add(field)
+            while len(self.items) > self.max_size:
+                (old_key, old_field), _ = self.items.popitem(last=False)
+                fields = self.fields_by_key.get(old_key)
+                if fields is not None:
+                    fields.discard(old_field)
+                    if not fields:
+                        del self.fields_by_key[old_key]
+
+    def invalidate(self, redis_keys: Optional[List[str]] = None):
+        """按 redis 键失效，None 表示全部失效(如 FLUSHDB 或跟踪连接断开)"""
+        with self.lock:
+            if redis_keys is None:
+                self.epoch += 1
+                self.items.clear()
+                self.fields_by_key.clear()
+                return
+            for redis_key in redis_keys:
+                self.generations[redis_key] = self.generations.get(redis_key, 0) + 1
+                for field in self.fields_by_key.pop(redis_key, ()):
+                    self.items.pop((redis_key, field), None)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各类缓存的命中次数、未命中次数与命中率"""
+        with self.lock:
+            result = {'size': {'items': len(self.items), 'max_size': self.max_size}}
+            for family in set(self.hits) | set(self.misses):
+                hits = self.hits.get(family, 0)
+                misses = self.misses.get(family, 0)
+                result[family] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                }
+            return result
@@ -0,0 +1,254 @@
+# lua_scripts.py
+# redis 服务端脚本，一次往返完成多条命令，同时保证原子性
+
+# 检查并标记已处理消息，集合大小由保留策略在热路径之外裁剪
+# KEYS[1]: 已处理有序集合
+# ARGV[1]: 时间戳  ARGV[2...]: 消息
+# 返回: 每条消息是否为新消息(1/0)
+CHECK_AND_MARK_PROCESSED = """
+local timestamp = tonumber(ARGV[1])
+local added = {}
+for i = 2, #ARGV do
+    -- 同一批次内按顺序递增分数，保证裁剪时先移除更早的消息
+    added[#added + 1] = redis.call('ZADD', KEYS[1], 'NX', timestamp + (i - 2) * 0.000001, ARGV[i])
+end
+return added
+"""
+
+# 批量注册订单与会话的关联，集合大小由保留策略在热路径之外裁剪
+# KEYS[1]: 会话订单有序集合  KEYS[2]: 可选，订单到会话的映射；分片映射与会话不在同一槽位时由调用方写入
+# ARGV[1]: 时间戳  ARGV[2]: 会话ID  ARGV[3...]: 订单号
+# 返回: 新加入会话的订单号列表
+REGISTER_SESSION_ORDERS = """
+local timestamp = tonumber(ARGV[1])
+local session_id = ARGV[2]
+local added = {}
+for i = 3, #ARGV do
+    if redis.call('ZADD', KEYS[1], 'NX', timestamp + (i - 3) * 0.000001, ARGV[i]) == 1 then
+        if #KEYS > 1 then
+            redis.call('HSET', KEYS[2], ARGV[i], session_id)
+        end
+        added[#added + 1] = ARGV[i]
+    end
+end
+return added
+"""
+
+# 按时间窗口与数量上限裁剪有序集合，可同时清理订单到会话的映射
+# KEYS[1]: 有序集合  KEYS[2]: 可选，订单到会话的映射
+# ARGV[1]: 截止时间戳(0 表示不按时间)  ARGV[2]: 数量上限(0 表示不限制)  ARGV[3]: 会话ID
+# ARGV[4]: 为 1 时返回移除的元素，由调用方清理不在同一槽位的分片映射
+# 返回: 移除的元素数量，或移除的元素列表
+TRIM_SORTED_SET = """
+local cutoff = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local with_index = #KEYS > 1
+local return_removed = ARGV[4] == '1'
+local collect = with_index or return_removed
+local removed = {}
+local count = 0
+if cutoff > 0 then
+    if collect then
+        removed = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. cutoff)
+    end
+    count = redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. cutoff)
+end
+if limit > 0 then
+    local overflow = redis.call('ZCARD', KEYS[1]) - limit
+    if overflow > 0 then
+        if collect then
+            for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, overflow - 1)) do
+                removed[#removed + 1] = member
+            end
+        end
+        count = count + redis.call('ZREMRANGEBYRANK', KEYS[1], 0, overflow - 1)
+    end
+end
+if with_index then
+    for _, order_number in ipairs(removed) do
+        -- 订单可能已被其他群重新提及，只清理仍指向本群的映射
+        if redis.call('HGET', KEYS[2], order_number) == ARGV[3] then
+            redis.call('HDEL', KEYS[2], order_number)
+        end
+    end
+end
+if return_removed then
+    return removed
+end
+return count
+"""
+
+# 清理仍指向指定会话的订单映射，订单可能已被其他群重新提及
+# KEYS[1]: 订单到会话的映射(分片)
+# ARGV[1]: 会话ID  ARGV[2...]: 订单号
+# 返回: 清理的映射数量
+REMOVE_ORDER_INDEX = """
+local count = 0
+for i = 2, #ARGV do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[1] then
+        count = count + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return count
+"""
+
+# 消息放入群队列，群队列由空变为非空时加入就绪环，并唤醒阻塞的消费者
+# KEYS[1]: 群队列  KEYS[2]: 就绪环  KEYS[3]: 唤醒列表
+# ARGV[1]: 会话ID  ARGV[2]: 消息
+PUT_SESSION_MESSAGE = """
+if redis.call('RPUSH', KEYS[1], ARGV[2]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+redis.call('RPUSH', KEYS[3], 1)
+redis.call('LTRIM', KEYS[3], -1, -1)
+return 1
+"""
+
+# 按权重轮询取出下一条消息，就绪环中只保存队列非空的群
+# 环头的群连续发送达到权重后轮转到环尾，队列取空后移出环
+# 群队列键全部通过 KEYS 传入，不在脚本中拼接，cluster 下与就绪环使用相同的 hash tag，位于同一槽位
+# KEYS[1]: 就绪环  KEYS[2]: 本轮已发送计数  KEYS[3]: 群权重  KEYS[4...]: 各群队列
+# ARGV[1]: 群队列键前缀，用于从群队列键得到会话ID
+# 返回: {会话ID, 消息}，没有消息时返回nil；环头的群队列不在 KEYS 中时返回 {会话ID}，由调用方加入后重新执行
+POP_FAIR_MESSAGE = """
+local queues = {}
+for i = 4, #KEYS do
+    queues[string.sub(KEYS[i], #ARGV[1] + 1)] = KEYS[i]
+end
+while true do
+    local session_id = redis.call('LINDEX', KEYS[1], 0)
+    if not session_id then
+        return nil
+    end
+    local queue = queues[session_id]
+    if not queue then
+        return {session_id}
+    end
+    local data = redis.call('LPOP', queue)
+    if not data then
+        -- 队列已被清空，移出就绪环后继续下一个群
+        redis.call('LPOP', KEYS[1])
+        redis.call('HDEL', KEYS[2], session_id)
+    else
+        if redis.call('LLEN', queue) == 0 then
+            redis.call('LPOP', KEYS[1])
+            redis.call('HDEL', KEYS[2], session_id)
+        else
+            local weight = tonumber(redis.call('HGET', KEYS[3], session_id) or '1')
+            if redis.call('HINCRBY', KEYS[2], session_id, 1) >= weight then
+                redis.call('RPUSH', KEYS[1], redis.call('LPOP', KEYS[1]))
+                redis.call('HDEL', KEYS[2], session_id)
+            end
+        end
+        return {session_id, data}
+    end
+end
+"""
+
+# 按最早截止时间取出下一条消息，每个通道是以截止时间为分数的有序集合
+# 可降级通道中超过截止时间加宽限仍未发出的消息移入降级队列，只在各通道都为空时发送
+# KEYS[1...n-1]: 各优先级通道  KEYS[n]: 降级队列
+# ARGV[1]: 当前时间  ARGV[2]: 降级宽限(秒)  ARGV[3...]: 各通道是否可降级(1/0)
+# 返回: 消息，没有消息时返回nil
+POP_EARLIEST_DEADLINE = """
+local now = tonumber(ARGV[1])
+local grace = tonumber(ARGV[2])
+local stale_key = KEYS[#KEYS]
+local best_key = nil
+local best_score = nil
+for i = 1, #KEYS - 1 do
+    if ARGV[i + 2] == '1' then
+        local stale = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', '(' .. (now - grace), 'WITHSCORES', 'LIMIT', 0, 100)
+        for j = 1, #stale, 2 do
+            redis.call('ZADD', stale_key, stale[j + 1], stale[j])
+            redis.call('ZREM', KEYS[i], stale[j])
+        end
+    end
+    local head = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+    if #head > 0 and (best_score == nil or tonumber(head[2]) < best_score) then
+        best_key = KEYS[i]
+        best_score = tonumber(head[2])
+    end
+end
+if best_key == nil then
+    best_key = stale_key
+end
+local item = redis.call('ZPOPMIN', best_key)
+return item[1]
+"""
+
+# 取出已到期的重试消息
+# KEYS[1]: 重试队列，分数为到期时间
+# ARGV[1]: 当前时间  ARGV[2]: 最多取出数量
+# 返回: 到期的重试消息列表
+POP_DUE_RETRIES = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+# 令牌桶限流，同时检查多个桶，全部有足够令牌时一起扣减
+# KEYS[1...n]: 令牌桶
+# ARGV[1]: 本次消耗令牌数  ARGV[2*i], ARGV[2*i+1]: 第i个桶每秒补充令牌数与容量
+# 返回: 0 表示已获取，否则为需要等待的毫秒数
+ACQUIRE_TOKENS = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[2 * i])
+    local capacity = tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local last = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - last) * rate / 1000)
+    tokens[i] = available
+    if available < cost then
+        wait = math.max(wait, math.ceil((cost - available) * 1000 / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[2 * i])
+    local capacity = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', KEYS[i], 'tokens', tokens[i] - cost, 'ts', now)
+    -- 桶补满后即可过期，下次按满桶处理
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity * 1000 / rate) + 1000)
+end
+return 0
+"""
+
+# 发送前预留发送记录，记录不存在时写入本次预留的令牌
+# KEYS[1]: 发送记录
+# ARGV[1]: 预留令牌  ARGV[2]: 预留有效期(毫秒)，进程在发送中途退出时预留到期后可重新发送
+# 返回: 1 预留成功; 0 已发送过; -1 正在由其他发送方发送
+RESERVE_SEND = """
+local value = redis.call('GET', KEYS[1])
+if not value then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if value == 'sent' then
+    return 0
+end
+return -1
+"""
+
+# 发送失败时释放预留，只删除本次预留的记录
+# KEYS[1]: 发送记录
+# ARGV[1]: 预留令牌
+RELEASE_SEND = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from logger import logger
+from models.message import Message
+from typing import Any, Optional, Dict, List, Tuple
+from models.queue_backend import QueueBackend
+from models.envelope import encode_message, decode_message
+
+class MemoryQueue(QueueBackend):
+    """进程内实现，没有网络往返，用于单进程部署、测试与基准
+
+    数据只保存在当前进程，进程退出后丢失；接收与发送需要在同一进程中运行。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.condition = threading.Condition()
+        self.queues: Dict[str, deque] = {self.wechat_queue: deque(), self.yto_queue: deque()}
+        self.retries: List[Tuple[float, int, str]] = []
+        self.retry_sequence = itertools.count()
+        self.dead_letters: deque = deque()
+        # 有序集合: 键 -> {成员: 分数}
+        self.sorted_sets: Dict[str, Dict[str, float]] = {}
+        self.order_sessions: Dict[str, str] = {}
+
+    def _put(self, queue: str, message: Message):
+        with self.condition:
+            self.queues[queue].append(encode_message(message))
+            self.condition.notify_all()
+
+    def _pop(self, queues: List[str]) -> Optional[Tuple[str, dict]]:
+        for queue in queues:
+            if self.queues[queue]:
+                return queue, decode_message(self.queues[queue].popleft())
+        return None
+
+    def put_wechat_message(self, message: Message):
+        """将微信消息放入队列"""
+        self._put(self.wechat_queue, message)
+        logger.info(f"消息已加入微信队列: {message.content}")
+
+    def get_wechat_message(self) -> Optional[dict]:
+        """从队列获取微信消息"""
+        with self.condition:
+            result = self._pop([self.wechat_queue])
+        return result[1] if result else None
+
+    def put_yto_message(self, message: Message):
+        """将圆通消息放入队列"""
+        self._put(self.yto_queue, message)
+        logger.info(f"消息已加入圆通队列: {message.content}")
+
+    def get_yto_message(self) -> Optional[dict]:
+        """从队列获取圆通消息"""
+        with self.condition:
+            result = self._pop([self.yto_queue])
+        return result[1] if result else None
+
+    def wait_for_message(self, queues: List[str], timeout: int) -> Optional[Tuple[str, dict]]:
+        """阻塞等待多个队列，任一队列有消息立即返回 (队列名, 消息)，超时返回None"""
+        with self.condition:
+            self.condition.wait_for(lambda: any(self.queues[queue] for queue in queues), timeout)
+            return self._pop(queues)
+
+    def _add_retries(self, entries: Dict[str, float]):
+        with self.condition:
+            for entry, due in entries.items():
+                heapq.heappush(self.retries, (due, next(self.retry_sequence), entry))
+
+    def _pop_due_retry_entries(self, now: float, limit: int) -> List[str]:
+        with self.condition:
+            due = []
+            while self.retries and self.retries[0][0] <= now and len(due) < limit:
+                due.append(heapq.heappop(self.retries)[2])
+            return due
+
+    def _add_dead_letters(self, entries: List[str]):
+        with self.condition:
+            self.dead_letters.extend(entries)
+
+    def _peek_dead_letters(self, limit: Optional[int]) -> List[str]:
+        with self.condition:
+            return list(itertools.islice(self.dead_letters, limit))
+
+    def _remove_dead_letters(self, entries: List[str]):
+        with self.condition:
+            for entry in entries:
+                if entry in self.dead_letters:
+                    self.dead_letters.remove(entry)
+
+    def _check_and_mark(self, redis_key: str, members: List[str]) -> List[bool]:
+        timestamp = time.time()
+        with self.condition:
+            members_scores = self.sorted_sets.setdefault(redis_key, {})
+            added = []
+            for i, member in enumerate(members):
+                added.append(member not in members_scores)
+                if added[-1]:
+                    # 同一批次内按顺序递增分数，保证裁剪时先移除更早的消息
+                    members_scores[member] = timestamp + i * 0.000001
+        self._mark_dirty(redis_key)
+        return added
+
+    def _is_member(self, redis_key: str, member: str) -> bool:
+        with self.condition:
+            return member in self.sorted_sets.get(redis_key, {})
+
+    def put_orders_to_session(self, session_id: str, order_numbers: List[str]) -> int:
+        """处理订单列表，将不在会话中的订单添加到会话中，返回新增订单数量"""
+        redis_key = self._session_key(self.session_order_queue, session_id)
+        timestamp = time.time()
+        added = 0
+        with self.condition:
+            members_scores = self.sorted_sets.setdefault(redis_key, {})
+            for i, order_number in enumerate(order_numbers):
+                if order_number not in members_scores:
+                    members_scores[order_number] = timestamp + i * 0.000001
+                    self.order_sessions[order_number] = session_id
+                    added += 1
+        self._mark_dirty(redis_key)
+        return added
+
+    def is_order_in_session(self, session_id: str, order_number: str) -> bool:
+        """判断订单是否已在会话中"""
+        return self._is_member(self._session_key(self.session_order_queue, session_id), order_number)
+
+    def find_session_id_by_order_number(self, order_number: str) -> Optional[str]:
+        """根据订单号查找对应的会话ID"""
+        with self.condition:
+            return self.order_sessions.get(order_number)
+
+    def list_session_orders(self, session_ids: List[str]) -> Dict[str, List[str]]:
+        """返回各会话中的订单号，按写入顺序"""
+        orders = {}
+        with self.condition:
+            for session_id in session_ids:
+                members_scores = self.sorted_sets.get(self._session_key(self.session_order_queue, session_id), {})
+                orders[session_id] = sorted(members_scores, key=members_scores.get)
+        return orders
+
+    def enforce_retention(self, full: bool = False) -> int:
+        """按时间窗口与数量上限裁剪写入过的集合，full 为 True 时裁剪全部集合"""
+        redis_keys = self._take_dirty_keys()
+        removed = 0
+        with self.condition:
+            if full:
+                redis_keys = set(self.sorted_sets)
+            for redis_key in redis_keys:
+                members_scores = self.sorted_sets.get(redis_key)
+                if not members_scores:
+                    continue
+                cutoff, limit, session_id = self._retention_limits(redis_key)
+                ordered = sorted(members_scores, key=members_scores.get)
+                expired = [member for member in ordered if members_scores[member] < cutoff]
+                overflow = len(ordered) - len(expired) - limit if limit else 0
+                if overflow > 0:
+                    expired.extend(ordered[len(expired):len(expired) + overflow])
+                for member in expired:
+                    del members_scores[member]
+                    # 订单可能已被其他群重新提及，只清理仍指向本群的映射
+                    if session_id is not None and self.order_sessions.get(member) == session_id:
+                        del self.order_sessions[member]
+                removed += len(expired)
+        if removed:
+            logger.info(f"保留策略裁剪 {len(redis_keys)} 个集合, 移除 {removed} 条")
+        return removed
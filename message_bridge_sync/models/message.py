@@ -1,5 +1,7 @@
+import uuid
 from enum import Enum
 from datetime import datetime
+from models.yto_reply import reply_from_list
 
 class MessageSource(Enum):
     WECHAT = "wechat"
@@ -10,31 +12,55 @@ class MessageType(Enum):
     IMAGE = "image"
 
 class Message:
+    __slots__ = ('id', 'content', 'source', 'session_id', 'order_number', 'type', 'timestamp', 'attempts', 'trace_id', 'reply')
+
     def __init__(self, content: str, source: MessageSource, session_id: str = None, 
-                 order_number: str = None, msg_type: MessageType = MessageType.TEXT):
+                 order_number: str = None, msg_type: MessageType = MessageType.TEXT, attempts: int = 0,
+                 message_id: str = None, timestamp: datetime = None, trace_id: str = None, reply=None):
+        self.id = message_id or uuid.uuid4().hex
         self.content = content
         self.source = source
         self.session_id = session_id
         self.order_number = order_number
         self.type = msg_type
-        self.timestamp = datetime.now()
+        self.timestamp = timestamp or datetime.now()  # 创建时间，经过队列后保留，用于统计排队延迟
+        self.attempts = attempts  # 已重试次数
+        self.trace_id = trace_id or self.id  # 同一请求相关的消息共用，默认为消息id
+        self.reply = reply  # 圆通回复的解析结果 YtoReply，采集时解析
 
     def to_dict(self):
         return {
+            'id': self.id,
             'content': self.content,
             'source': self.source.value,
             'session_id': self.session_id,
             'order_number': self.order_number,
             'type': self.type.value,
-            'timestamp': self.timestamp.isoformat()
+            'timestamp': self.timestamp.isoformat(),
+            'created_at': self.timestamp.timestamp(),
+            'attempts': self.attempts,
+            'trace_id': self.trace_id,
+            'reply': list(self.reply) if self.reply else None,
         }
 
     @classmethod
     def from_dict(cls, data: dict):
+        # 旧消息没有 created_at，使用 ISO 格式的 timestamp
+        if data.get('created_at') is not None:
+            timestamp = datetime.fromtimestamp(data['created_at'])
+        elif data.get('timestamp'):
+            timestamp = datetime.fromisoformat(data['timestamp'])
+        else:
+            timestamp = None
         return cls(
             content=data['content'],
             source=MessageSource(data['source']),
             session_id=data['session_id'],
             order_number=data['order_number'],
-            msg_type=MessageType(data['type'])
+            msg_type=MessageType(data['type']),
+            attempts=data.get('attempts', 0),
+            message_id=data.get('id'),
+            timestamp=timestamp,
+            trace_id=data.get('trace_id'),
+            reply=reply_from_list(data.get('reply')),
         )
@@ -0,0 +1,220 @@
+import time
+import zlib
+from typing import Any, Callable, Optional, Dict, List, Tuple
+from models.lua_scripts import REMOVE_ORDER_INDEX
+
+class OrderIndex:
+    """订单到会话的映射，保存在单个 hash 中
+
+    单节点时会话订单集合与映射可以在同一个脚本中更新，inline_key 返回映射键；
+    分片映射返回 None，由调用方在脚本之后单独写入。
+    """
+
+    def __init__(self, redis_client, name: str = 'order_to_session'):
+        self.redis_client = redis_client
+        self.name = name
+        self.remove_script = self.redis_client.register_script(REMOVE_ORDER_INDEX)
+
+    @property
+    def inline_key(self) -> Optional[str]:
+        return self.name
+
+    def key(self, order_number: str) -> str:
+        """订单所在的映射键"""
+        return self.name
+
+    def keys(self) -> List[str]:
+        """全部映射键"""
+        return [self.name]
+
+    def cache_key(self, redis_key: str) -> str:
+        """本地缓存使用的键，任一映射键的失效通知都要删除对应的缓存"""
+        return redis_key
+
+    def encode(self, order_number: str) -> str:
+        """会话订单集合中保存的订单号"""
+        return order_number
+
+    def decode(self, member: str) -> str:
+        """从会话订单集合的成员还原订单号"""
+        return member
+
+    def _group(self, order_numbers: List[str]) -> Dict[str, List[str]]:
+        """按映射键分组订单"""
+        groups: Dict[str, List[str]] = {}
+        for order_number in order_numbers:
+            groups.setdefault(self.key(order_number), []).append(order_number)
+        return groups
+
+    def get(self, order_number: str) -> Optional[str]:
+        return self.redis_client.hget(self.key(order_number), order_number)
+
+    def get_many(self, order_numbers: List[str]) -> Dict[str, Optional[str]]:
+        """批量查询，每个映射键一条 HMGET，一次 pipeline"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        parse = self.queue_get_many(pipe, order_numbers)
+        return parse(pipe.execute())
+
+    def queue_get_many(self, pipe, order_numbers: List[str]) -> Callable[[list], Dict[str, Optional[str]]]:
+        """将批量查询加入 pipeline，返回从执行结果中取出映射的函数；同步与异步客户端共用"""
+        groups = self._group(order_numbers)
+        for redis_key, orders in groups.items():
+            pipe.hmget(redis_key, orders)
+
+        def parse(results: list) -> Dict[str, Optional[str]]:
+            result = {}
+            for orders, session_ids in zip(groups.values(), results):
+                result.update(zip(orders, session_ids))
+            return result
+        return parse
+
+    def set_many(self, session_id: str, order_numbers: List[str]):
+        """批量写入订单到会话的映射，一次 pipeline"""
+        if not order_numbers:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_set_many(pipe, session_id, order_numbers)
+        pipe.execute()
+
+    def queue_set_many(self, pipe, session_id: str, order_numbers: List[str]):
+        """将批量写入加入 pipeline"""
+        for redis_key, orders in self._group(order_numbers).items():
+            pipe.hset(redis_key, mapping={order_number: session_id for order_number in orders})
+
+    def removal_groups(self, order_numbers: List[str]) -> Dict[str, List[str]]:
+        """清理映射时每个键需要检查的字段"""
+        return self._group(order_numbers)
+
+    def remove_if_owner(self, session_id: str, order_numbers: List[str]) -> int:
+        """清理仍指向该会话的映射，每个映射键一次脚本调用"""
+        removed = 0
+        for redis_key, fields in self.removal_groups(order_numbers).items():
+            removed += self.remove_script(keys=[redis_key], args=[session_id, *fields])
+        return removed
+
+
+class ShardedOrderIndex(OrderIndex):
+    """按订单号哈希分片的映射，分片键带 hash tag，集群下分散到不同节点"""
+
+    def __init__(self, redis_client, name: str = 'order_to_session', shards: int = 16):
+        super().__init__(redis_client, name)
+        self.shards = shards
+
+    @property
+    def inline_key(self) -> Optional[str]:
+        return None
+
+    def key(self, order_number: str) -> str:
+        shard = zlib.crc32(order_number.encode('utf-8')) % self.shards
+        return f"{self.name}_{{{shard}}}"
+
+    def keys(self) -> List[str]:
+        """全部分片键"""
+        return [f"{self.name}_{{{shard}}}" for shard in range(self.shards)]
+
+
+class CompactOrderIndex(OrderIndex):
+    """订单号编码为整数并分桶的紧凑映射
+
+    YT 订单号去掉前缀后在数字前补 1 (保留前导零与位数) 转为整数 n，
+    桶号为 n % buckets，字段为 n // buckets，每个桶是字段很少的小 hash，
+    redis 以 listpack 紧凑编码保存，整数字段按整数存储。
+    映射按时间分代写入，每代一组桶键，过期时间为下一代结束，查询当前代与上一代，
+    条目在 max_age 到 2 * max_age 之间整桶过期，无需逐条清理。
+    会话订单集合中的订单号同样保存为整数编码。
+    """
+
+    def __init__(self, redis_client, name: str = 'order_to_session', buckets: int = 4096,
+                 max_age: int = 0, hash_tag: bool = False):
+        super().__init__(redis_client, name)
+        self.buckets = buckets
+        self.max_age = max_age
+        self.hash_tag = hash_tag
+
+    @property
+    def inline_key(self) -> Optional[str]:
+        return None
+
+    def encode(self, order_number: str) -> str:
+        if order_number.startswith('YT') and order_number[2:].isdigit():
+            return f"1{order_number[2:]}"
+        return order_number
+
+    def decode(self, member: str) -> str:
+        if member.isdigit() and member.startswith('1'):
+            return f"YT{member[1:]}"
+        return member
+
+    def _period(self, now: float = None) -> int:
+        """当前代，不按时间过期时始终为0"""
+        if not self.max_age:
+            return 0
+        return int((now or time.time()) // self.max_age)
+
+    def _bucket_key(self, bucket: int, period: int) -> str:
+        # cluster 键布局下同一个桶的各代键位于同一槽位
+        bucket_part = f"{{{bucket}}}" if self.hash_tag else str(bucket)
+        return f"{self.name}_c{bucket_part}:{period}"
+
+    def _locate(self, order_number: str) -> Tuple[Optional[int], str]:
+        """返回订单所在的桶与字段，非 YT 订单号放在 -1 号桶，字段为原订单号"""
+        encoded = self.encode(order_number)
+        if encoded == order_number:
+            return None, order_number
+        value = int(encoded)
+        return value % self.buckets, str(value // self.buckets)
+
+    def _keys_for(self, order_number: str) -> Tuple[str, str, str]:
+        """返回 (当前代键, 上一代键, 字段)"""
+        bucket, field = self._locate(order_number)
+        bucket = -1 if bucket is None else bucket
+        period = self._period()
+        return self._bucket_key(bucket, period), self._bucket_key(bucket, period - 1), field
+
+    def key(self, order_number: str) -> str:
+        return self._keys_for(order_number)[0]
+
+    def keys(self) -> List[str]:
+        period = self._period()
+        return [self._bucket_key(bucket, period) for bucket in range(-1, self.buckets)]
+
+    def cache_key(self, redis_key: str) -> str:
+        """同一个桶的各代键对应同一个缓存键，上一代键被清理或过期时当前代键下的缓存同样失效"""
+        if redis_key.startswith(f"{self.name}_c"):
+            return redis_key.rsplit(':', 1)[0]
+        return redis_key
+
+    def get(self, order_number: str) -> Optional[str]:
+        return self.get_many([order_number]).get(order_number)
+
+    def queue_get_many(self, pipe, order_numbers: List[str]) -> Callable[[list], Dict[str, Optional[str]]]:
+        """批量查询当前代与上一代，当前代优先"""
+        for current_key, previous_key, field in [self._keys_for(order_number) for order_number in order_numbers]:
+            pipe.hget(current_key, field)
+            pipe.hget(previous_key, field)
+
+        def parse(results: list) -> Dict[str, Optional[str]]:
+            return {order_number: results[2 * i] or results[2 * i + 1]
+                    for i, order_number in enumerate(order_numbers)}
+        return parse
+
+    def queue_set_many(self, pipe, session_id: str, order_numbers: List[str]):
+        """写入当前代，桶键在下一代结束时过期"""
+        groups: Dict[str, Dict[str, str]] = {}
+        for order_number in order_numbers:
+            current_key, _, field = self._keys_for(order_number)
+            groups.setdefault(current_key, {})[field] = session_id
+        expire_at = (self._period() + 2) * self.max_age
+        for redis_key, mapping in groups.items():
+            pipe.hset(redis_key, mapping=mapping)
+            if self.max_age:
+                pipe.expireat(redis_key, expire_at)
+
+    def removal_groups(self, order_numbers: List[str]) -> Dict[str, List[str]]:
+        """清理当前代与上一代中的字段"""
+        groups: Dict[str, List[str]] = {}
+        for order_number in order_numbers:
+            current_key, previous_key, field = self._keys_for(order_number)
+            groups.setdefault(current_key, []).append(field)
+            groups.setdefault(previous_key, []).append(field)
+        return groups
@@ -1,24 +1,27 @@
-import re
+import time
 from logger import logger
 from typing import Any, Optional, Dict, List
 from models.redis_queue import RedisQueue
-from config import ORDER_FORMAT
+from models.classifier import classify
+from models.waybill_index import WaybillIndex
+from config import WAYBILL_INDEX
 
 class OrderManager:
     def __init__(self, redis_queue):
-        # 订单号与群ID的映射关系
-        self.order_session_map: Dict[str, str] = {}
+        # 订单号与群ID的映射关系由 redis_queue 的本地缓存维护
         self.redis_queue = redis_queue
+        # 映射不到群时按部分或输错的订单号兜底查找
+        self.waybill_index = None
+        self.index_sessions: List[str] = []
+        self.index_loaded_at = 0.0
+        if WAYBILL_INDEX['enabled']:
+            self.waybill_index = WaybillIndex(WAYBILL_INDEX['max_size'], WAYBILL_INDEX['min_digits'],
+                                              WAYBILL_INDEX['max_candidates'])
         
     def extract_order_number(self, text: str) -> Optional[List[str]]:
         """从文本中提取订单号"""
-        # 支持多种订单号格式
-        patterns = ORDER_FORMAT
-        order_numbers = []
-        for pattern in patterns:
-            match = re.findall(pattern, text)
-            order_numbers.extend(match)
-            
+        # 支持多种订单号格式，与消息过滤共用一次扫描的结果
+        order_numbers = list(classify(text).waybills)
         return order_numbers if order_numbers else None
     
     def register_order(self, order_numbers: List, session_id: str):
@@ -27,8 +30,31 @@ class OrderManager:
             return
 
         self.redis_queue.put_orders_to_session(session_id, order_numbers)
+        if self.waybill_index is not None:
+            self.waybill_index.add(session_id, order_numbers)
+
+    def load_waybill_index(self, session_ids: List[str]):
+        """从各群的会话订单重建订单号索引"""
+        if self.waybill_index is None:
+            return
+        self.index_sessions = list(session_ids)
+        self.index_loaded_at = time.time()
+        for session_id, order_numbers in self.redis_queue.list_session_orders(self.index_sessions).items():
+            self.waybill_index.add(session_id, order_numbers)
+        logger.info(f"订单号索引加载完成，共 {len(self.waybill_index)} 个订单号")
     
     def get_session_id(self, order_number: str) -> Optional[str]:
         """获取订单号对应的会话ID"""
-        return self.redis_queue.find_session_id_by_order_number(order_number)
-    
\ No newline at end of file
+        session_id = self.redis_queue.find_session_id_by_order_number(order_number)
+        if session_id or self.waybill_index is None:
+            return session_id
+
+        session_id = self.waybill_index.resolve(order_number)
+        if session_id is None and self.index_sessions and \
+                time.time() - self.index_loaded_at >= WAYBILL_INDEX['refresh_interval']:
+            # 其他进程注册的订单重新加载后才能查到
+            self.load_waybill_index(self.index_sessions)
+            session_id = self.waybill_index.resolve(order_number)
+        if session_id:
+            logger.info(f"订单 {order_number} 没有登记的群，按订单号索引匹配到群 {session_id}")
+        return session_id
@@ -0,0 +1,42 @@
+from enum import Enum
+from typing import Any, Optional, Dict, List
+from models.classifier import classify
+from config import PRIORITY_LANES, PRIORITY_DEFAULT_LANE
+
+# 通道由 PRIORITY_LANES 的名称生成，默认配置为 HIGH(拦截、改地址等)、NORMAL(催件)、LOW(查重、查询物流)
+MessagePriority = Enum('MessagePriority', {lane.upper(): lane for lane in PRIORITY_LANES})
+if PRIORITY_DEFAULT_LANE not in PRIORITY_LANES:
+    raise ValueError(f"PRIORITY_DEFAULT_LANE '{PRIORITY_DEFAULT_LANE}' 不在 PRIORITY_LANES 中: {list(PRIORITY_LANES)}")
+
+# 通道按配置顺序排列，越靠前优先级越高
+LANE_ORDER = [MessagePriority(lane) for lane in PRIORITY_LANES]
+
+# 意图关键字 -> 通道
+INTENT_LANES: Dict[str, MessagePriority] = {
+    intent: MessagePriority(lane)
+    for lane, lane_config in PRIORITY_LANES.items()
+    for intent in lane_config['intents']
+}
+
+
+def classify_intent(content: str) -> List[str]:
+    """提取消息中订单号后面跟随的意图关键字"""
+    return [intent for intent in classify(content or '').intents if intent in INTENT_LANES]
+
+
+def classify_priority(content: str) -> MessagePriority:
+    """按消息中优先级最高的意图确定通道，没有识别到意图时使用默认通道"""
+    lanes = [INTENT_LANES[intent] for intent in classify_intent(content)]
+    if not lanes:
+        return MessagePriority(PRIORITY_DEFAULT_LANE)
+    return min(lanes, key=LANE_ORDER.index)
+
+
+def lane_deadline(priority: MessagePriority) -> int:
+    """通道的期望发送时限(秒)"""
+    return PRIORITY_LANES[priority.value]['deadline']
+
+
+def lane_demotable(priority: MessagePriority) -> bool:
+    """通道超时后是否降级"""
+    return PRIORITY_LANES[priority.value].get('demote', False)
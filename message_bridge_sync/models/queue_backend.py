@@ -0,0 +1,349 @@
+import json
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from logger import logger
+from models.message import Message
+from typing import Any, Optional, Dict, List, Tuple
+from config import QUEUE_BACKEND, QUEUE_TYPE, RETENTION, MAX_RETRIES, RETRY_DELAY, RETRY_MAX_DELAY
+from models.fingerprint import fingerprint
+
+class QueueEntries:
+    """键名、重试条目与保留策略等不访问存储的部分，QueueBackend 与 AsyncRedisQueue 共用"""
+
+    wechat_queue = 'wechat_messages'
+    yto_queue = 'yto_messages'
+    wechat_processed_queue = 'wechat_messages_processed'
+    yto_processed_queue = 'yto_messages_processed'
+    session_order_queue = 'session_order'
+
+    def _session_key(self, prefix: str, session_id: str) -> str:
+        """群相关的键"""
+        return f"{prefix}_{session_id}"
+
+    def _session_id_from_key(self, prefix: str, redis_key: str) -> str:
+        """从群相关的键中取出会话ID"""
+        return redis_key[len(prefix) + 1:]
+
+    def _retry_entry(self, queue: str, message: dict, error: Exception = None) -> str:
+        """重试与死信队列中保存的消息，带唯一id避免有序集合成员重复"""
+        return json.dumps({
+            'id': uuid.uuid4().hex,
+            'queue': queue,
+            'message': message,
+            'error': str(error) if error else None,
+            'failed_at': time.time(),
+        })
+
+    def _retry_plan(self, queue: str, message: dict, error: Exception = None) -> Tuple[str, dict, Optional[float]]:
+        """返回 (重试条目, 累加重试次数后的消息, 退避秒数)，超过最大重试次数时退避为 None，应放入死信队列"""
+        message = {key: value for key, value in message.items() if key != 'stream_id'}
+        message['attempts'] = message.get('attempts', 0) + 1
+        entry = self._retry_entry(queue, message, error)
+        if message['attempts'] > MAX_RETRIES:
+            return entry, message, None
+        return entry, message, min(RETRY_DELAY * 2 ** (message['attempts'] - 1), RETRY_MAX_DELAY)
+
+    def _replay_target(self, data: str, queue: str = None) -> Optional[Tuple[str, dict]]:
+        """死信条目要放回的 (队列名, 重试次数清零的消息)，不属于 queue 时返回 None"""
+        entry = json.loads(data)
+        if queue and entry['queue'] != queue:
+            return None
+        message = entry['message']
+        message['attempts'] = 0
+        return entry['queue'], message
+
+    def _retention_limits(self, redis_key: str) -> Tuple[float, int, Optional[str]]:
+        """返回集合的 (截止时间戳, 数量上限, 会话订单集合的会话ID)，0 表示不限制"""
+        if redis_key.startswith(f"{self.session_order_queue}_"):
+            max_age = RETENTION['session_order_max_age']
+            session_id = self._session_id_from_key(self.session_order_queue, redis_key)
+            return (time.time() - max_age if max_age else 0,
+                    RETENTION['session_order_max_count'], session_id)
+        max_age = RETENTION['processed_max_age']
+        return time.time() - max_age if max_age else 0, RETENTION['processed_max_count'], None
+
+
+class QueueBackend(QueueEntries, ABC):
+    """消息队列、已处理消息去重与订单到会话映射的存储接口
+
+    redis、进程内存与 sqlite 三种实现由 QUEUE_BACKEND 选择。重试、死信、
+    去重的指纹计算与保留策略在这里实现，子类只提供存储原语。
+    """
+
+    def __init__(self):
+        # 写入过的集合，由保留策略批量裁剪
+        self.dirty_keys = set()
+        self.dirty_lock = threading.Lock()
+
+    # ---------- 消息队列 ----------
+
+    @abstractmethod
+    def put_wechat_message(self, message: Message):
+        """将微信消息放入队列"""
+
+    @abstractmethod
+    def get_wechat_message(self) -> Optional[dict]:
+        """从队列获取微信消息"""
+
+    @abstractmethod
+    def put_yto_message(self, message: Message):
+        """将圆通消息放入队列"""
+
+    @abstractmethod
+    def get_yto_message(self) -> Optional[dict]:
+        """从队列获取圆通消息"""
+
+    @abstractmethod
+    def wait_for_message(self, queues: List[str], timeout: int) -> Optional[Tuple[str, dict]]:
+        """阻塞等待多个队列，任一队列有消息立即返回 (队列名, 消息)，超时返回None"""
+
+    def ack_message(self, queue: str, message: dict):
+        """确认消息已处理完成，取出即删除的队列无需确认"""
+        pass
+
+    # ---------- 重试与死信 ----------
+
+    @abstractmethod
+    def _add_retries(self, entries: Dict[str, float]):
+        """写入重试队列，值为到期时间"""
+
+    @abstractmethod
+    def _pop_due_retry_entries(self, now: float, limit: int) -> List[str]:
+        """取出并删除已到期的重试消息"""
+
+    @abstractmethod
+    def _add_dead_letters(self, entries: List[str]):
+        """追加到死信队列末尾"""
+
+    @abstractmethod
+    def _peek_dead_letters(self, limit: Optional[int]) -> List[str]:
+        """查看死信队列头部的消息，limit 为 None 时返回全部"""
+
+    @abstractmethod
+    def _remove_dead_letters(self, entries: List[str]):
+        """从死信队列删除指定的消息，每条消息带唯一id，只删除一次"""
+
+    def schedule_retry(self, queue: str, message: dict, error: Exception = None) -> bool:
+        """发送失败的消息按指数退避放入重试队列，超过最大重试次数放入死信队列，返回是否会重试"""
+        try:
+            entry, message, delay = self._retry_plan(queue, message, error)
+            if delay is None:
+                self._add_dead_letters([entry])
+                logger.error(f"消息重试 {MAX_RETRIES} 次仍失败，放入死信队列: {message.get('content')}")
+                return False
+
+            self._add_retries({entry: time.time() + delay})
+            logger.warning(f"消息发送失败，{delay} 秒后第 {message['attempts']} 次重试: {message.get('content')}")
+            return True
+        except Exception as e:
+            logger.error(f"添加重试消息失败: {e}")
+            raise
+
+    def pop_due_retries(self, limit: int = 100) -> List[Tuple[str, dict]]:
+        """取出已到期的重试消息，返回 (队列名, 消息) 列表"""
+        try:
+            entries = [json.loads(data) for data in self._pop_due_retry_entries(time.time(), limit)]
+            return [(entry['queue'], entry['message']) for entry in entries]
+        except Exception as e:
+            logger.error(f"获取到期重试消息失败: {e}")
+            raise
+
+    def requeue_message(self, queue: str, message: dict):
+        """将消息重新放回原队列"""
+        if queue == self.wechat_queue:
+            self.put_wechat_message(Message.from_dict(message))
+        else:
+            self.put_yto_message(Message.from_dict(message))
+
+    def promote_due_retries(self, limit: int = 100) -> int:
+        """将到期的重试消息放回原队列，返回数量"""
+        due = self.pop_due_retries(limit)
+        for index, (queue, message) in enumerate(due):
+            try:
+                self.requeue_message(queue, message)
+            except Exception:
+                # 放回失败的消息立即重新进入重试队列，避免丢失
+                self._add_retries({
+                    self._retry_entry(failed_queue, failed_message): time.time()
+                    for failed_queue, failed_message in due[index:]
+                })
+                raise
+        return len(due)
+
+    def list_dead_letters(self, limit: int = 100) -> List[dict]:
+        """查看死信队列中的消息"""
+        try:
+            return [json.loads(data) for data in self._peek_dead_letters(limit)]
+        except Exception as e:
+            logger.error(f"查看死信队列失败: {e}")
+            raise
+
+    def replay_dead_letters(self, limit: int = None, queue: str = None) -> int:
+        """将死信队列中的消息批量放回原队列，重试次数清零；queue 指定时只重放该队列的消息"""
+        try:
+            # 先查看再放回，只删除已放回的消息；中途失败时其余消息仍在死信队列，未选中的消息保持原有位置
+            replayed = []
+            try:
+                for data in self._peek_dead_letters(limit):
+                    target = self._replay_target(data, queue)
+                    if target is None:
+                        continue
+                    self.requeue_message(*target)
+                    replayed.append(data)
+            finally:
+                if replayed:
+                    self._remove_dead_letters(replayed)
+            logger.info(f"死信队列重放 {len(replayed)} 条消息")
+            return len(replayed)
+        except Exception as e:
+            logger.error(f"重放死信队列失败: {e}")
+            raise
+
+    # ---------- 已处理消息 ----------
+
+    @abstractmethod
+    def _check_and_mark(self, redis_key: str, members: List[str]) -> List[bool]:
+        """原子地检查并标记已处理，返回每个成员是否为新加入"""
+
+    @abstractmethod
+    def _is_member(self, redis_key: str, member: str) -> bool:
+        """判断成员是否在集合中"""
+
+    def _mark(self, redis_key: str, members: List[str]):
+        """只标记不检查，不需要返回结果的实现可以延后写入"""
+        self._check_and_mark(redis_key, members)
+
+    def put_wechat_processed_message(self, message: str, session_id: str, sender: str = None):
+        """将微信消息放入已处理队列"""
+        try:
+            redis_key = self._session_key(self.wechat_processed_queue, session_id)
+            self._mark(redis_key, [fingerprint(message, session_id, sender)])
+        except Exception as e:
+            logger.error(f"添加微信消息到已处理队列失败: {e}")
+            raise
+
+    def mark_wechat_processed(self, message: str, session_id: str, sender: str = None) -> bool:
+        """检查并标记微信消息为已处理，返回是否为新消息"""
+        return self.mark_wechat_processed_batch([message], session_id, [sender])[0]
+
+    def mark_wechat_processed_batch(self, messages: List[str], session_id: str,
+                                    senders: Optional[List[str]] = None) -> List[bool]:
+        """批量检查并标记微信消息为已处理，返回每条消息是否为新消息"""
+        try:
+            redis_key = self._session_key(self.wechat_processed_queue, session_id)
+            senders = senders or [None] * len(messages)
+            members = [fingerprint(message, session_id, sender) for message, sender in zip(messages, senders)]
+            return self._check_and_mark(redis_key, members)
+        except Exception as e:
+            logger.error(f"标记微信消息为已处理失败: {e}")
+            raise
+
+    def is_message_in_wechat_processed_queue(self, message: str, session_id: str, sender: str = None) -> bool:
+        """判断消息是否在已处理队列中"""
+        try:
+            redis_key = self._session_key(self.wechat_processed_queue, session_id)
+            return self._is_member(redis_key, fingerprint(message, session_id, sender))
+        except Exception as e:
+            logger.error(f"判断消息是否在已处理队列中失败: {e}")
+            raise
+
+    def put_yto_processed_message(self, message: str):
+        """将圆通消息放入已处理队列"""
+        try:
+            self._mark(self.yto_processed_queue, [fingerprint(message)])
+        except Exception as e:
+            logger.error(f"添加圆通消息到已处理队列失败: {e}")
+            raise
+
+    def mark_yto_processed(self, message: str) -> bool:
+        """检查并标记圆通消息为已处理，返回是否为新消息"""
+        return self.mark_yto_processed_batch([message])[0]
+
+    def mark_yto_processed_batch(self, messages: List[str]) -> List[bool]:
+        """批量检查并标记圆通消息为已处理，返回每条消息是否为新消息"""
+        try:
+            members = [fingerprint(message) for message in messages]
+            return self._check_and_mark(self.yto_processed_queue, members)
+        except Exception as e:
+            logger.error(f"标记圆通消息为已处理失败: {e}")
+            raise
+
+    def is_message_in_yto_processed_queue(self, message: str) -> bool:
+        """判断消息是否在已处理队列中"""
+        try:
+            return self._is_member(self.yto_processed_queue, fingerprint(message))
+        except Exception as e:
+            logger.error(f"判断消息是否在已处理队列中失败: {e}")
+            raise
+
+    # ---------- 订单与会话 ----------
+
+    @abstractmethod
+    def put_orders_to_session(self, session_id: str, order_numbers: List[str]) -> int:
+        """处理订单列表，将不在会话中的订单添加到会话中，返回新增订单数量"""
+
+    @abstractmethod
+    def is_order_in_session(self, session_id: str, order_number: str) -> bool:
+        """判断订单是否已在会话中"""
+
+    @abstractmethod
+    def find_session_id_by_order_number(self, order_number: str) -> Optional[str]:
+        """根据订单号查找对应的会话ID"""
+
+    def put_session_order(self, session_id: str, order_number: str):
+        """将订单放入微信关联群"""
+        self.put_orders_to_session(session_id, [order_number])
+
+    # ---------- 保留策略与缓存 ----------
+
+    def _mark_dirty(self, redis_key: str):
+        """记录需要裁剪的集合；未运行后台裁剪的进程按概率顺带裁剪"""
+        with self.dirty_lock:
+            self.dirty_keys.add(redis_key)
+        if RETENTION['probability'] > 0 and random.random() < RETENTION['probability']:
+            self.enforce_retention()
+
+    def _take_dirty_keys(self) -> set:
+        """取出并清空写入过的集合"""
+        with self.dirty_lock:
+            redis_keys = self.dirty_keys
+            self.dirty_keys = set()
+        return redis_keys
+
+    def list_session_orders(self, session_ids: List[str]) -> Dict[str, List[str]]:
+        """返回各会话中的订单号，按写入顺序"""
+        return {}
+
+    @abstractmethod
+    def enforce_retention(self, full: bool = False) -> int:
+        """按时间窗口与数量上限裁剪写入过的集合，full 为 True 时裁剪全部集合，返回移除数量"""
+
+    def warm_up_cache(self, session_ids: List[str]):
+        """启动时预热本地缓存，没有本地缓存的实现无需预热"""
+        pass
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """本地缓存命中率"""
+        return {}
+
+    def flush_writes(self) -> bool:
+        """写入延后的数据，没有延后写入的实现无需刷新"""
+        return True
+
+
+def create_queue_backend() -> QueueBackend:
+    """按 QUEUE_BACKEND 与 QUEUE_TYPE 创建队列实现"""
+    if QUEUE_BACKEND == "memory":
+        from models.memory_queue import MemoryQueue
+        return MemoryQueue()
+    if QUEUE_BACKEND == "sqlite":
+        from models.sqlite_queue import SqliteQueue
+        return SqliteQueue()
+    if QUEUE_TYPE == "stream":
+        from models.stream_queue import RedisStreamQueue
+        return RedisStreamQueue()
+    from models.redis_queue import RedisQueue
+    return RedisQueue()
@@ -0,0 +1,56 @@
+import time
+from logger import logger
+from typing import Any, Optional, Dict, List, Tuple
+from config import RATE_LIMITS, WECHAT_ACCOUNT_ID
+from models.lua_scripts import ACQUIRE_TOKENS
+from models.redis_client import is_cluster_layout
+
+class RateLimiter:
+    """基于 redis 令牌桶的分布式限流，接收与发送两台服务器共享发送配额
+
+    发送到微信群同时消耗 全局、微信账号、群 三个桶，发送到圆通消耗 全局、圆通 两个桶，
+    所有桶在一次脚本调用中检查并扣减。
+    """
+
+    def __init__(self, redis_client):
+        # 脚本按速率计算等待时间，速率为0时无法计算，启动时拒绝
+        for name in ('global', 'account', 'group', 'yto'):
+            if RATE_LIMITS[name]['rate'] <= 0 or RATE_LIMITS[name]['burst'] <= 0:
+                raise ValueError(f"RATE_LIMITS['{name}'] 的 rate 与 burst 必须大于0: {RATE_LIMITS[name]}")
+        self.redis_client = redis_client
+        # 一次脚本调用涉及多个桶，cluster 键布局下共用 hash tag 位于同一槽位
+        self.key_prefix = '{rate_limit}' if is_cluster_layout() else 'rate_limit'
+        self.acquire_script = self.redis_client.register_script(ACQUIRE_TOKENS)
+
+    def _buckets(self, target: str, session_id: str = None) -> List[Tuple[str, dict]]:
+        """返回本次发送需要消耗的桶 (键, 配置)"""
+        buckets = [(f"{self.key_prefix}_global", RATE_LIMITS['global'])]
+        if target == "wechat":
+            buckets.append((f"{self.key_prefix}_account_{WECHAT_ACCOUNT_ID}", RATE_LIMITS['account']))
+            if session_id:
+                buckets.append((f"{self.key_prefix}_group_{session_id}", RATE_LIMITS['group']))
+        else:
+            buckets.append((f"{self.key_prefix}_yto", RATE_LIMITS['yto']))
+        return buckets
+
+    def acquire(self, target: str, session_id: str = None, cost: int = 1) -> float:
+        """申请发送配额，获取成功返回0，否则返回需要等待的秒数"""
+        try:
+            buckets = self._buckets(target, session_id)
+            args = [cost]
+            for _, bucket in buckets:
+                args.extend([bucket['rate'], bucket['burst']])
+            wait_ms = self.acquire_script(keys=[key for key, _ in buckets], args=args)
+            return int(wait_ms) / 1000
+        except Exception as e:
+            logger.error(f"申请发送配额失败: {e}")
+            raise
+
+    def wait(self, target: str, session_id: str = None, cost: int = 1):
+        """阻塞直到获取发送配额"""
+        while True:
+            wait_time = self.acquire(target, session_id, cost)
+            if wait_time <= 0:
+                return
+            logger.info(f"发送配额不足，等待 {wait_time:.2f} 秒: {target} {session_id or ''}")
+            time.sleep(wait_time)
@@ -0,0 +1,73 @@
+import redis
+from config import REDIS_CONFIG, REDIS_CLUSTER_NODES, KEY_LAYOUT, ASYNC_REDIS
+
+_async_client = None
+
+def is_cluster_client() -> bool:
+    """是否配置了 redis 集群节点"""
+    return bool(REDIS_CLUSTER_NODES)
+
+def is_cluster_layout() -> bool:
+    """是否使用 cluster 键布局，集群客户端必须使用"""
+    return is_cluster_client() or KEY_LAYOUT == "cluster"
+
+def create_redis_client(decode_responses: bool = None):
+    """按配置创建单节点或集群客户端，decode_responses 为 False 时返回 bytes，用于读取二进制消息"""
+    redis_config = dict(REDIS_CONFIG)
+    if decode_responses is not None:
+        redis_config['decode_responses'] = decode_responses
+    if not is_cluster_client():
+        return redis.Redis(**redis_config)
+
+    from redis.cluster import RedisCluster, ClusterNode
+    # 集群不支持选择 db，节点地址由 REDIS_CLUSTER_NODES 提供
+    cluster_config = {key: value for key, value in redis_config.items() if key not in ('host', 'port', 'db')}
+    startup_nodes = [ClusterNode(node['host'], node['port']) for node in REDIS_CLUSTER_NODES]
+    return RedisCluster(startup_nodes=startup_nodes, **cluster_config)
+
+def get_async_redis_client():
+    """返回进程内共享的异步客户端，首次调用时创建
+
+    单节点时所有协程共用一个连接池，连接数不超过 max_connections，全部占用时等待 pool_timeout 秒；
+    空闲超过 health_check_interval 的连接取用前先 PING，命令遇到连接错误时按带抖动的指数退避重连。
+    连接绑定创建时的事件循环，同一进程只在一个事件循环中使用。
+    """
+    global _async_client
+    if _async_client is not None:
+        return _async_client
+
+    import redis.asyncio
+    from redis.asyncio.retry import Retry
+    from redis.backoff import EqualJitterBackoff
+    base, cap = ASYNC_REDIS['reconnect_backoff']
+    connection_config = {key: value for key, value in REDIS_CONFIG.items() if key != 'max_connections'}
+    connection_config.update(
+        socket_timeout=ASYNC_REDIS['socket_timeout'],
+        socket_keepalive=True,
+        health_check_interval=ASYNC_REDIS['health_check_interval'],
+        # 只在连接错误时重试，超时的命令可能已执行，重试会重复写入
+        retry=Retry(EqualJitterBackoff(cap=cap, base=base), ASYNC_REDIS['reconnect_retries'],
+                    supported_errors=(redis.ConnectionError,)),
+    )
+    if not is_cluster_client():
+        pool = redis.asyncio.BlockingConnectionPool(max_connections=REDIS_CONFIG['max_connections'],
+                                                    timeout=ASYNC_REDIS['pool_timeout'], **connection_config)
+        _async_client = redis.asyncio.Redis(connection_pool=pool)
+    else:
+        from redis.asyncio.cluster import RedisCluster, ClusterNode
+        # 集群客户端每个节点一个连接池，max_connections 为每个节点的上限
+        cluster_config = {key: value for key, value in connection_config.items() if key not in ('host', 'port', 'db')}
+        startup_nodes = [ClusterNode(node['host'], node['port']) for node in REDIS_CLUSTER_NODES]
+        _async_client = RedisCluster(startup_nodes=startup_nodes, max_connections=REDIS_CONFIG['max_connections'],
+                                     **cluster_config)
+    return _async_client
+
+async def close_async_redis_client():
+    """关闭共享的异步客户端与连接池，进程退出前调用"""
+    global _async_client
+    if _async_client is None:
+        return
+    client, _async_client = _async_client, None
+    await client.aclose()
+    if not is_cluster_client():
+        await client.connection_pool.disconnect()
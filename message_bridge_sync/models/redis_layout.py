@@ -0,0 +1,135 @@
+import time
+from models.message import Message
+from typing import List, Tuple
+from config import (MONITORED_GROUPS, ORDER_INDEX_SHARDS, ORDER_INDEX_MODE, ORDER_INDEX_BUCKETS, RETENTION, YTO_QUEUE_MODE,
+                    WECHAT_QUEUE_MODE, PRIORITY_STALE_GRACE)
+from models.queue_backend import QueueEntries
+from models.envelope import encode_message
+from models.order_index import OrderIndex, ShardedOrderIndex, CompactOrderIndex
+from models.redis_client import is_cluster_client, is_cluster_layout
+from models.lua_scripts import (CHECK_AND_MARK_PROCESSED, REGISTER_SESSION_ORDERS, TRIM_SORTED_SET,
+                                PUT_SESSION_MESSAGE, POP_FAIR_MESSAGE, POP_EARLIEST_DEADLINE, POP_DUE_RETRIES)
+from models.priority import LANE_ORDER, lane_demotable
+
+class RedisLayout(QueueEntries):
+    """redis 键布局、订单映射与脚本参数，RedisQueue 与 AsyncRedisQueue 共用
+
+    两者可以同时读写同一个 redis，键名与脚本的 keys/args 在这里生成，子类只负责执行命令。
+    """
+
+    def _init_layout(self, redis_client, binary_client=None):
+        """初始化键名、订单映射并注册脚本；binary_client 用于读写二进制消息的脚本，默认与 redis_client 相同"""
+        binary_client = binary_client or redis_client
+        # cluster 键布局下，队列类键共用一个 hash tag，阻塞等待与脚本可以跨键操作；
+        # 每个群的已处理集合与订单集合以会话ID为 hash tag，订单映射按订单号分片
+        self.cluster_client = is_cluster_client()
+        self.cluster_layout = is_cluster_layout()
+        self.wechat_queue = self._shared_key(QueueEntries.wechat_queue)
+        self.yto_queue = self._shared_key(QueueEntries.yto_queue)
+        self.order_to_session_queue = 'order_to_session'
+        if ORDER_INDEX_MODE == "compact":
+            self.order_index = CompactOrderIndex(redis_client, self.order_to_session_queue, ORDER_INDEX_BUCKETS,
+                                                 RETENTION['session_order_max_age'], self.cluster_layout)
+        elif self.cluster_layout:
+            self.order_index = ShardedOrderIndex(redis_client, self.order_to_session_queue, ORDER_INDEX_SHARDS)
+        else:
+            self.order_index = OrderIndex(redis_client, self.order_to_session_queue)
+
+        # 重试队列按到期时间排序，超过重试次数进入死信队列
+        self.retry_queue = self._shared_key('retry_messages')
+        self.dead_letter_queue = self._shared_key('dead_letter_messages')
+
+        # 微信消息按意图分优先级通道，最早截止时间优先
+        self.priority_queue = WECHAT_QUEUE_MODE == "priority"
+        self.wechat_lane_queues = {priority: f"{self.wechat_queue}_lane_{priority.value}" for priority in LANE_ORDER}
+        self.wechat_stale_queue = f"{self.wechat_queue}_lane_stale"
+        self.wechat_notify_queue = f"{self.wechat_queue}_notify"
+
+        # 每个群一个圆通回复队列，就绪环记录非空的群，按权重轮询消费
+        self.per_session_queue = YTO_QUEUE_MODE == "per_session"
+        self.yto_session_queue_prefix = f"{self.yto_queue}_session_"
+        # 轮询脚本声明的群队列，找不到群的消息进入 unknown 队列
+        self.yto_session_queues = {session_id: self._yto_session_queue(session_id)
+                                   for session_id in [*MONITORED_GROUPS, 'unknown']}
+        self.yto_ready_queue = f"{self.yto_queue}_ready"
+        self.yto_served_queue = f"{self.yto_queue}_served"
+        self.yto_weight_queue = f"{self.yto_queue}_weight"
+        self.yto_notify_queue = f"{self.yto_queue}_notify"
+
+        # 注册服务端脚本，检查与标记在一次往返内完成
+        self.check_and_mark_script = redis_client.register_script(CHECK_AND_MARK_PROCESSED)
+        self.register_orders_script = redis_client.register_script(REGISTER_SESSION_ORDERS)
+        self.trim_script = redis_client.register_script(TRIM_SORTED_SET)
+        self.put_session_message_script = binary_client.register_script(PUT_SESSION_MESSAGE)
+        self.pop_fair_message_script = binary_client.register_script(POP_FAIR_MESSAGE)
+        self.pop_earliest_deadline_script = binary_client.register_script(POP_EARLIEST_DEADLINE)
+        self.pop_due_retries_script = redis_client.register_script(POP_DUE_RETRIES)
+
+    def _shared_key(self, name: str) -> str:
+        """队列类键，cluster 键布局下带公共 hash tag，全部位于同一槽位"""
+        return f"{{bridge}}{name}" if self.cluster_layout else name
+
+    def _yto_session_queue(self, session_id: str) -> str:
+        """群的圆通回复队列，与就绪环共用 hash tag"""
+        return f"{self.yto_session_queue_prefix}{session_id}"
+
+    def _session_key(self, prefix: str, session_id: str) -> str:
+        """群相关的键，cluster 键布局下以会话ID为 hash tag，同一群的键位于同一槽位"""
+        return f"{prefix}_{{{session_id}}}" if self.cluster_layout else f"{prefix}_{session_id}"
+
+    def _session_id_from_key(self, prefix: str, redis_key: str) -> str:
+        """从群相关的键中取出会话ID"""
+        session_id = super()._session_id_from_key(prefix, redis_key)
+        if session_id.startswith('{') and session_id.endswith('}'):
+            session_id = session_id[1:-1]
+        return session_id
+
+    def _pipeline(self, transaction: bool = False):
+        """集群客户端不支持事务，只用于同一个键的事务退化为普通 pipeline"""
+        return self.redis_client.pipeline(transaction=transaction and not self.cluster_client)
+
+    def _session_message_call(self, message: Message) -> Tuple[List[str], list]:
+        """返回写入群队列脚本的 keys 与 args，找不到群的消息进入 unknown 队列，由转发时再次匹配"""
+        session_id = message.session_id or 'unknown'
+        return ([self._yto_session_queue(session_id), self.yto_ready_queue, self.yto_notify_queue],
+                [session_id, encode_message(message)])
+
+    def _fair_pop_call(self) -> Tuple[List[str], list]:
+        """返回按群权重轮询脚本的 keys 与 args"""
+        return ([self.yto_ready_queue, self.yto_served_queue, self.yto_weight_queue, *self.yto_session_queues.values()],
+                [self.yto_session_queue_prefix])
+
+    def _declare_session_queue(self, result: list) -> bool:
+        """轮询脚本只返回会话ID时，就绪环中有未声明的群，加入后需要重新执行，返回是否需要重试"""
+        if not result or len(result) != 1:
+            return False
+        session_id = result[0].decode('utf-8')
+        self.yto_session_queues[session_id] = self._yto_session_queue(session_id)
+        return True
+
+    def _priority_pop_call(self) -> Tuple[List[str], list]:
+        """返回最早截止时间脚本的 keys 与 args"""
+        return ([*self.wechat_lane_queues.values(), self.wechat_stale_queue],
+                [time.time(), PRIORITY_STALE_GRACE, *['1' if lane_demotable(priority) else '0' for priority in LANE_ORDER]])
+
+    def _register_orders_call(self, session_id: str, order_numbers: List[str]) -> Tuple[List[str], list]:
+        """返回注册脚本的 keys 与 args"""
+        redis_key = self._session_key(self.session_order_queue, session_id)
+        # 单个映射与会话订单在同一脚本中更新；分片映射不在同一槽位，脚本返回新增订单后再写入
+        index_key = self.order_index.inline_key
+        return ([redis_key, index_key] if index_key else [redis_key],
+                [time.time(), session_id, *[self.order_index.encode(order_number) for order_number in order_numbers]])
+
+    def _retention_policy(self, redis_key: str) -> Tuple[List[str], list]:
+        """返回裁剪脚本的 keys 与 args；分片映射由脚本返回移除的订单后再清理"""
+        cutoff, limit, session_id = self._retention_limits(redis_key)
+        if session_id is None:
+            return [redis_key], [cutoff, limit, '', '0']
+        index_key = self.order_index.inline_key
+        if index_key:
+            return [redis_key, index_key], [cutoff, limit, session_id, '0']
+        return [redis_key], [cutoff, limit, session_id, '1']
+
+    def _retention_scan_patterns(self) -> List[str]:
+        """全量裁剪时扫描的群集合"""
+        return [f"{self.wechat_processed_queue}_*", f"{self.session_order_queue}_*"]
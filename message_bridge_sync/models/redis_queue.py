@@ -1,113 +1,489 @@
+import threading
 import redis
-import json
 from logger import logger
 from models.message import Message
-from typing import Any, Optional, Dict, List
+from typing import Any, Callable, Optional, Dict, List, Tuple
 import time
-from config import REDIS_CONFIG
-class RedisQueue:
+from config import LOCAL_CACHE, SESSION_QUEUE_WEIGHTS, SPILL, WRITE_BEHIND, PROCESSED_FINGERPRINT_SALT
+from models.local_cache import LocalCache
+from models.queue_backend import QueueBackend
+from models.redis_layout import RedisLayout
+from models.envelope import encode_message, decode_message
+from models.spill_journal import SpillJournal, SpillFullError
+from models.write_buffer import WriteBuffer
+from models.redis_client import create_redis_client
+from models.fingerprint import fingerprint, looks_like_fingerprint, is_fingerprint_enabled
+from models.priority import classify_priority, lane_deadline
+
+class RedisQueue(RedisLayout, QueueBackend):
+    """基于 redis 的队列实现，接收与发送服务器共享"""
+
     def __init__(self):
-        redis_config = REDIS_CONFIG
-        self.redis_client = redis.Redis(**redis_config)
-        self.wechat_queue = 'wechat_messages'
-        self.wechat_processed_queue = f"{self.wechat_queue}_processed"
-        self.yto_queue = 'yto_messages'
-        self.yto_processed_queue = f"{self.yto_queue}_processed"
-        self.max_processed_limit = 1000
-        self.session_order_queue = 'session_order'
-        self.order_to_session_queue = 'order_to_session'
+        super().__init__()
+        self.redis_client = create_redis_client()
+        # 队列消息可能是二进制信封，读写队列消息使用不解码响应的客户端
+        self.binary_client = create_redis_client(decode_responses=False)
+        self._init_layout(self.redis_client, self.binary_client)
+        if self.per_session_queue:
+            self._init_session_weights()
+
+        # 本地溢出日志，由常驻进程调用 enable_spill 启用
+        self.spill = None
+        # 延后写入，由常驻进程调用 enable_write_behind 启用
+        self.write_buffer = None
+
+        # 进程内缓存，由 redis 客户端跟踪通知失效，跟踪连接就绪前不使用
+        self.local_cache = None
+        self.cache_ready = threading.Event()
+        if LOCAL_CACHE['enabled'] and self.cluster_client:
+            # 客户端跟踪需要在每个节点上单独建立，集群下不使用本地缓存
+            logger.warning("redis 集群模式不支持本地缓存跟踪，已禁用本地缓存")
+        elif LOCAL_CACHE['enabled']:
+            self.local_cache = LocalCache(LOCAL_CACHE['max_size'])
+            self.tracking_prefixes = [self.order_to_session_queue, self.wechat_processed_queue, self.yto_processed_queue]
+            threading.Thread(target=self._track_invalidations, daemon=True).start()
+
+    def enable_spill(self, path: str):
+        """启用本地溢出日志，redis 不可用时写操作进入日志，恢复后按顺序回放；同一日志文件只能由一个进程使用"""
+        self.spill = SpillJournal(path, SPILL['max_bytes'], SPILL['fsync'], SPILL['fsync_interval'])
+        # redis 不可用期间已处理消息按本进程最近标记过的消息去重
+        self.spill_marks = LocalCache(SPILL['recent_marks'])
+        self.spill_failed_at = 0.0
+        self.replay_spill()
+
+    def _spill_guard(self, op: str, args: list, write: Callable[[], Any],
+                     fallback: Callable[[], Any] = lambda: None) -> Any:
+        """执行写操作；redis 不可用或溢出日志未回放完时写入溢出日志以保持顺序，返回 fallback 的结果"""
+        if self.spill is None:
+            return write()
+        if self.spill.pending() and not self.replay_spill():
+            return self._spill(op, args, fallback)
+        try:
+            return write()
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self.spill_failed_at = time.time()
+            logger.warning(f"redis 不可用，写入溢出日志: {e}")
+            return self._spill(op, args, fallback, e)
+
+    def _spill(self, op: str, args: list, fallback: Callable[[], Any], error: Exception = None) -> Any:
+        try:
+            self.spill.append(op, args)
+        except SpillFullError as e:
+            logger.error(f"{e}，写入失败")
+            raise error or e
+        return fallback()
+
+    def replay_spill(self) -> bool:
+        """按顺序回放溢出日志，全部回放完成返回 True；redis 不可用期间按间隔尝试"""
+        if self.spill is None or not self.spill.pending():
+            return True
+        if time.time() - self.spill_failed_at < SPILL['replay_interval']:
+            return False
+        try:
+            replayed = self.spill.replay(self._apply_spilled)
+            logger.info(f"redis 已恢复，溢出日志回放 {replayed} 条")
+            return True
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self.spill_failed_at = time.time()
+            logger.warning(f"回放溢出日志失败，稍后重试: {e}")
+            return False
+
+    def enable_write_behind(self):
+        """启用延后写入，已处理标记与会话订单由后台线程按间隔或积压条数批量写入；进程退出前调用 flush_writes"""
+        self.write_buffer = WriteBuffer(WRITE_BEHIND['max_items'])
+        self.flush_lock = threading.Lock()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self.write_buffer.ready.wait(WRITE_BEHIND['interval'])
+            if not self.flush_writes():
+                # 写入失败时稍后重试，期间的写入继续积压在内存中
+                time.sleep(WRITE_BEHIND['retry_delay'])
+
+    def flush_writes(self) -> bool:
+        """将延后的写入一次 pipeline 写入 redis，失败时保留到下次刷新，返回是否成功"""
+        if self.write_buffer is None:
+            return True
+        # 后台刷新与退出前的刷新串行执行，返回时之前的写入都已完成
+        with self.flush_lock:
+            marks, orders = self.write_buffer.take()
+            if not marks and not orders:
+                return True
+            try:
+                self._spill_guard('write_buffered', [marks, orders], lambda: self._write_buffered(marks, orders))
+            except Exception as e:
+                logger.error(f"延后写入失败，稍后重试: {e}")
+                self.write_buffer.restore()
+                return False
+
+            cache = self._cache()
+            for redis_key, members in marks.items():
+                if cache:
+                    for member in members:
+                        cache.put(redis_key, member, True)
+            self.write_buffer.done()
+        for redis_key in marks:
+            self._mark_dirty(redis_key)
+        for session_id in orders:
+            self._mark_dirty(self._session_key(self.session_order_queue, session_id))
+        return True
+
+    def _write_buffered(self, marks: Dict[str, List[str]], orders: Dict[str, List[str]]):
+        if self.cluster_client:
+            # 集群 pipeline 中的脚本在未加载过的节点上会失败，逐个键调用
+            for redis_key, members in marks.items():
+                self._mark_processed(redis_key, members)
+            for session_id, order_numbers in orders.items():
+                self._register_orders(session_id, order_numbers)
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for redis_key, members in marks.items():
+            self.check_and_mark_script(keys=[redis_key], args=[time.time(), *members], client=pipe)
+        for session_id, order_numbers in orders.items():
+            keys, args = self._register_orders_call(session_id, order_numbers)
+            self.register_orders_script(keys=keys, args=args, client=pipe)
+        results = pipe.execute()
+        if self.order_index.inline_key:
+            return
+        # 分片映射不在脚本中写入，按脚本返回的新增订单一次 pipeline 写入
+        pipe = self.redis_client.pipeline(transaction=False)
+        for session_id, added in zip(orders, results[len(marks):]):
+            if added:
+                self.order_index.queue_set_many(pipe, session_id, [self.order_index.decode(member) for member in added])
+        pipe.execute()
+
+    def _apply_spilled(self, op: str, args: list):
+        """回放一条溢出日志记录，redis 拒绝的记录跳过"""
+        operations = {
+            'put_wechat_message': lambda data: self._put_wechat_message(Message.from_dict(data)),
+            'put_yto_message': lambda data: self._put_yto_message(Message.from_dict(data)),
+            'check_and_mark': self._mark_processed,
+            'put_orders_to_session': self._register_orders,
+            'write_buffered': self._write_buffered,
+            'add_retries': lambda entries: self.redis_client.zadd(self.retry_queue, entries),
+            'add_dead_letters': lambda entries: self.redis_client.rpush(self.dead_letter_queue, *entries),
+        }
+        try:
+            operations[op](*args)
+        except redis.ResponseError as e:
+            logger.error(f"回放溢出日志记录失败，已跳过: {op} {e}")
+
+    def _init_session_weights(self):
+        """将配置的群权重写入redis，供轮询脚本读取"""
+        pipe = self._pipeline(transaction=True)
+        pipe.delete(self.yto_weight_queue)
+        if SESSION_QUEUE_WEIGHTS:
+            pipe.hset(self.yto_weight_queue, mapping=SESSION_QUEUE_WEIGHTS)
+        pipe.execute()
+
+    def _cache(self) -> Optional[LocalCache]:
+        """返回可用的本地缓存，跟踪连接未就绪时返回None"""
+        if self.local_cache is not None and self.cache_ready.is_set():
+            return self.local_cache
+        return None
+
+    def _track_invalidations(self):
+        """维持一条跟踪连接，接收键失效通知并清理本地缓存
+
+        连接空闲时定期 PING，静默断开的连接在两个心跳间隔内被发现，避免缓存一直使用过期的路由。
+        """
+        ping_interval = LOCAL_CACHE['ping_interval']
+        while True:
+            connection = self.redis_client.connection_pool.make_connection()
+            # 读写都有超时，并开启 TCP keepalive
+            connection.socket_timeout = ping_interval
+            connection.socket_keepalive = True
+            try:
+                connection.connect()
+                connection.send_command('CLIENT', 'ID')
+                client_id = connection.read_response()
+
+                # 广播模式跟踪相关键前缀，通知重定向到本连接，再订阅失效频道
+                tracking_args = ['CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST']
+                for prefix in self.tracking_prefixes:
+                    tracking_args.extend(['PREFIX', prefix])
+                connection.send_command(*tracking_args)
+                connection.read_response()
+                connection.send_command('SUBSCRIBE', '__redis__:invalidate')
+                connection.read_response()
+
+                # 跟踪建立之前的缓存内容不可信
+                self.local_cache.invalidate()
+                self.cache_ready.set()
+                logger.info("本地缓存跟踪连接已建立")
+
+                waiting_pong = False
+                while True:
+                    if not connection.can_read(timeout=ping_interval):
+                        if waiting_pong:
+                            raise redis.TimeoutError(f"跟踪连接 {ping_interval} 秒没有响应 PING")
+                        connection.send_command('PING')
+                        waiting_pong = True
+                        continue
+                    response = connection.read_response()
+                    # 收到任何数据都说明连接可用
+                    waiting_pong = False
+                    if isinstance(response, list) and len(response) == 3 and response[0] == 'message':
+                        # 键列表为空表示 FLUSHDB/FLUSHALL，全部失效
+                        self.local_cache.invalidate(
+                            [self.order_index.cache_key(redis_key) for redis_key in response[2]] if response[2] else None)
+            except Exception as e:
+                logger.warning(f"本地缓存跟踪连接断开，暂停使用缓存: {e}")
+            finally:
+                self.cache_ready.clear()
+                self.local_cache.invalidate()
+                connection.disconnect()
+            time.sleep(LOCAL_CACHE['reconnect_delay'])
+
+    def warm_up_cache(self, session_ids: List[str]):
+        """启动时批量加载监控群的已处理消息、订单与映射到本地缓存"""
+        if self.local_cache is None or not self.cache_ready.wait(timeout=5):
+            logger.warning("本地缓存未就绪，跳过预热")
+            return
+        try:
+            processed_keys = [self._session_key(self.wechat_processed_queue, session_id) for session_id in session_ids]
+            processed_keys.append(self.yto_processed_queue)
+            order_keys = [self._session_key(self.session_order_queue, session_id) for session_id in session_ids]
+            generations = {redis_key: self.local_cache.generation(redis_key) for redis_key in processed_keys}
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            for redis_key in processed_keys + order_keys:
+                pipe.zrange(redis_key, 0, -1)
+            results = pipe.execute()
+
+            for redis_key, members in zip(processed_keys, results):
+                for member in members:
+                    self.local_cache.put(redis_key, member, True, generations[redis_key])
+
+            order_numbers = [self.order_index.decode(order) for orders in results[len(processed_keys):] for order in orders]
+            for start in range(0, len(order_numbers), 500):
+                chunk = order_numbers[start:start + 500]
+                for index_key in {self.order_index.cache_key(self.order_index.key(order_number)) for order_number in chunk}:
+                    generations.setdefault(index_key, self.local_cache.generation(index_key))
+                for order_number, session_id in self.order_index.get_many(chunk).items():
+                    index_key = self.order_index.cache_key(self.order_index.key(order_number))
+                    self.local_cache.put(index_key, order_number, session_id, generations[index_key])
+            logger.info(f"本地缓存预热完成: {self.local_cache.stats()['size']}")
+        except Exception as e:
+            logger.error(f"本地缓存预热失败: {e}")
+            raise
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """本地缓存命中率，用于评估缓存大小"""
+        return self.local_cache.stats() if self.local_cache is not None else {}
 
     def put_wechat_message(self, message: Message):
         """将微信消息放入队列"""
         try:
-            self.redis_client.rpush(self.wechat_queue, json.dumps(message.to_dict()))
+            self._spill_guard('put_wechat_message', [message.to_dict()], lambda: self._put_wechat_message(message))
             logger.info(f"消息已加入微信队列: {message.content}")
         except Exception as e:
             logger.error(f"添加微信消息到队列失败: {e}")
             raise
-            
-    def put_wechat_processed_message(self, message: str, session_id: str):
-        """将微信消息放入已处理队列"""
-        try:
-            timestamp = time.time()
-            redis_key = f"{self.wechat_processed_queue}_{session_id}"
-            self.redis_client.zadd(redis_key, {message: timestamp}, nx=True)
-            
-            # 检查当前有序集合的大小
-            if self.redis_client.zcard(redis_key) > self.max_processed_limit:
-                # 移除分数最低的元素（最旧的元素）
-                self.redis_client.zremrangebyrank(redis_key, 0, 0)  # 删除排名最低的元素
-        except Exception as e:
-            logger.error(f"添加微信消息到已处理队列失败: {e}")
-            raise
 
+    def _put_wechat_message(self, message: Message):
+        if self.priority_queue:
+            # 按意图放入优先级通道，分数为截止时间，并唤醒阻塞的消费者
+            priority = classify_priority(message.content)
+            pipe = self.binary_client.pipeline(transaction=False)
+            pipe.zadd(self.wechat_lane_queues[priority],
+                      {encode_message(message): time.time() + lane_deadline(priority)})
+            pipe.rpush(self.wechat_notify_queue, 1)
+            pipe.ltrim(self.wechat_notify_queue, -1, -1)
+            pipe.execute()
+        else:
+            self.binary_client.rpush(self.wechat_queue, encode_message(message))
+            
     def get_wechat_message(self) -> Optional[dict]:
         """从队列获取微信消息"""
         try:
-            data = self.redis_client.lpop(self.wechat_queue)
-            return json.loads(data) if data else None
+            if self.priority_queue:
+                return self._pop_priority_wechat_message()
+            data = self.binary_client.lpop(self.wechat_queue)
+            return decode_message(data) if data else None
         except Exception as e:
             logger.error(f"从队列获取微信消息失败: {e}")
             raise
+
+    def _pop_priority_wechat_message(self) -> Optional[dict]:
+        """按最早截止时间取出下一条微信消息，一次往返"""
+        keys, args = self._priority_pop_call()
+        data = self.pop_earliest_deadline_script(keys=keys, args=args)
+        return decode_message(data) if data else None
     
-    def is_message_in_wechat_processed_queue(self, message: str, session_id: str) -> bool:
-        """判断消息是否在已处理队列中"""
+    def wait_for_message(self, queues: List[str], timeout: int) -> Optional[Tuple[str, dict]]:
+        """阻塞等待多个队列，任一队列有消息立即返回 (队列名, 消息)，超时返回None"""
         try:
-            redis_key = f"{self.wechat_processed_queue}_{session_id}"
-            score = self.redis_client.zscore(redis_key, message)  # 获取消息的分数
-            
-            return score is not None  # 如果分数不为 None，则表示消息在有序集合中
+            # 优先级通道与群队列不能直接阻塞，先尝试取一条，没有再阻塞等待唤醒列表
+            pollers = {}
+            if self.priority_queue and self.wechat_queue in queues:
+                pollers[self.wechat_queue] = (self.wechat_notify_queue, self._pop_priority_wechat_message)
+            if self.per_session_queue and self.yto_queue in queues:
+                pollers[self.yto_queue] = (self.yto_notify_queue, self._pop_fair_yto_message)
+            for queue, (_, pop_message) in pollers.items():
+                message = pop_message()
+                if message:
+                    return queue, message
+
+            block_queues = [pollers[queue][0] if queue in pollers else queue for queue in queues]
+            result = self.binary_client.blpop(block_queues, timeout=timeout)
+            if not result:
+                return None
+            block_queue, data = result
+            block_queue = block_queue.decode()
+            for queue, (notify_queue, pop_message) in pollers.items():
+                if block_queue == notify_queue:
+                    message = pop_message()
+                    return (queue, message) if message else None
+            return block_queue, decode_message(data)
         except Exception as e:
-            logger.error(f"判断消息是否在已处理队列中失败: {e}")
+            logger.error(f"阻塞获取队列消息失败: {e}")
             raise
 
+    def _add_retries(self, entries: Dict[str, float]):
+        self._spill_guard('add_retries', [entries], lambda: self.redis_client.zadd(self.retry_queue, entries))
+
+    def _pop_due_retry_entries(self, now: float, limit: int) -> List[str]:
+        return self.pop_due_retries_script(keys=[self.retry_queue], args=[now, limit])
+
+    def _add_dead_letters(self, entries: List[str]):
+        self._spill_guard('add_dead_letters', [entries],
+                          lambda: self.redis_client.rpush(self.dead_letter_queue, *entries))
+
+    def _peek_dead_letters(self, limit: Optional[int]) -> List[str]:
+        return self.redis_client.lrange(self.dead_letter_queue, 0, -1 if limit is None else limit - 1)
+
+    def _remove_dead_letters(self, entries: List[str]):
+        pipe = self._pipeline(transaction=False)
+        for entry in entries:
+            pipe.lrem(self.dead_letter_queue, 1, entry)
+        pipe.execute()
+
     def put_yto_message(self, message: Message):
         """将圆通消息放入队列"""
         try:
-            self.redis_client.rpush(self.yto_queue, json.dumps(message.to_dict()))
+            self._spill_guard('put_yto_message', [message.to_dict()], lambda: self._put_yto_message(message))
             logger.info(f"消息已加入圆通队列: {message.content}")
         except Exception as e:
             logger.error(f"添加圆通消息到队列失败: {e}")
             raise
+
+    def _put_yto_message(self, message: Message):
+        if self.per_session_queue:
+            keys, args = self._session_message_call(message)
+            self.put_session_message_script(keys=keys, args=args)
+        else:
+            self.binary_client.rpush(self.yto_queue, encode_message(message))
     
-    def put_yto_processed_message(self, message: str):
-        """将圆通消息放入已处理队列"""
-        try:
-            timestamp = time.time()
-            self.redis_client.zadd(self.yto_processed_queue, {message: timestamp}, nx=True)
-            
-            # 检查当前有序集合的大小
-            if self.redis_client.zcard(self.yto_processed_queue) > self.max_processed_limit:
-                # 移除分数最低的元素（最旧的元素）
-                self.redis_client.zremrangebyrank(self.yto_processed_queue, 0, 0)  # 删除排名最低的元素
-        except Exception as e:
-            logger.error(f"添加圆通消息到已处理队列失败: {e}")
-            raise
-    
+    def _check_and_mark(self, redis_key: str, members: List[str]) -> List[bool]:
+        """在服务端原子地完成 检查-标记-裁剪，一次往返；本地缓存已知处理过的消息不再访问redis"""
+        if not members:
+            return []
+        cache = self._cache()
+        result = [False] * len(members)
+        pending = [i for i, member in enumerate(members)
+                   if (cache is None or not cache.get(redis_key, member, 'processed'))
+                   and (self.write_buffer is None or not self.write_buffer.has_mark(redis_key, member))]
+        if not pending:
+            return result
+
+        generation = cache.generation(redis_key) if cache else None
+        pending_members = [members[i] for i in pending]
+        added = self._spill_guard('check_and_mark', [redis_key, pending_members],
+                                  lambda: self._mark_processed(redis_key, pending_members),
+                                  lambda: self._spilled_marks(redis_key, pending_members))
+        self._mark_dirty(redis_key)
+        for i, flag in zip(pending, added):
+            result[i] = bool(flag)
+            if cache:
+                cache.put(redis_key, members[i], True, generation)
+            if self.spill is not None:
+                self.spill_marks.put(redis_key, members[i], True)
+        return result
+
+    def _mark(self, redis_key: str, members: List[str]):
+        """只标记不检查，启用延后写入时进入缓冲"""
+        if self.write_buffer is None:
+            return super()._mark(redis_key, members)
+        self.write_buffer.add_marks(redis_key, members)
+
+    def _mark_processed(self, redis_key: str, members: List[str]) -> List[int]:
+        return self.check_and_mark_script(keys=[redis_key], args=[time.time(), *members])
+
+    def _spilled_marks(self, redis_key: str, members: List[str]) -> List[bool]:
+        """redis 不可用时按本进程最近标记过的消息去重"""
+        added = []
+        for member in members:
+            added.append(not self.spill_marks.get(redis_key, member, 'spill'))
+            self.spill_marks.put(redis_key, member, True)
+        return added
+
+    def _is_member(self, redis_key: str, member: str) -> bool:
+        if self.write_buffer is not None and self.write_buffer.has_mark(redis_key, member):
+            return True
+        return self.redis_client.zscore(redis_key, member) is not None
+
+    def migrate_processed_fingerprints(self, dry_run: bool = False) -> Dict[str, int]:
+        """将已处理集合中的完整消息内容迁移为指纹，保留原有时间戳，返回每个键迁移的数量"""
+        if not is_fingerprint_enabled():
+            logger.warning("未启用指纹，无需迁移")
+            return {}
+        if 'sender' in PROCESSED_FINGERPRINT_SALT:
+            # 集合中的原始消息没有保存发送者，算出的指纹与加入发送者的指纹不一致
+            logger.error("指纹盐包含 sender 时无法迁移已有的完整消息内容")
+            return {}
+
+        migrated = {}
+        keys = [self.yto_processed_queue]
+        keys.extend(self.redis_client.scan_iter(match=f"{self.wechat_processed_queue}_*", count=500))
+        for redis_key in keys:
+            session_id = (None if redis_key == self.yto_processed_queue
+                          else self._session_id_from_key(self.wechat_processed_queue, redis_key))
+            members = self.redis_client.zrange(redis_key, 0, -1, withscores=True)
+            old_members = [(member, score) for member, score in members if not looks_like_fingerprint(member)]
+            if not old_members:
+                continue
+
+            migrated[redis_key] = len(old_members)
+            if dry_run:
+                continue
+
+            # 同一键的删除与写入在一个事务中完成
+            pipe = self._pipeline(transaction=True)
+            pipe.zrem(redis_key, *[member for member, _ in old_members])
+            pipe.zadd(redis_key, {fingerprint(member, session_id): score for member, score in old_members}, nx=True)
+            pipe.execute()
+            logger.info(f"已处理集合 {redis_key} 迁移 {len(old_members)} 条消息为指纹")
+        return migrated
+
     def get_yto_message(self) -> Optional[dict]:
         """从队列获取圆通消息"""
         try:
-            data = self.redis_client.lpop(self.yto_queue)
-            return json.loads(data) if data else None
+            if self.per_session_queue:
+                return self._pop_fair_yto_message()
+            data = self.binary_client.lpop(self.yto_queue)
+            return decode_message(data) if data else None
         except Exception as e:
             logger.error(f"从队列获取圆通消息失败: {e}")
             raise
-    
-    def is_message_in_yto_processed_queue(self, message: str) -> bool:
-        """判断消息是否在已处理队列中"""
-        try:
-            score = self.redis_client.zscore(self.yto_processed_queue, message)  # 获取消息的分数
-            
-            return score is not None  # 如果分数不为 None，则表示消息在有序集合中
-        except Exception as e:
-            logger.error(f"判断消息是否在已处理队列中失败: {e}")
-            raise
+
+    def _pop_fair_yto_message(self) -> Optional[dict]:
+        """按群权重轮询取出下一条圆通消息，一次往返"""
+        while True:
+            keys, args = self._fair_pop_call()
+            result = self.pop_fair_message_script(keys=keys, args=args)
+            if not self._declare_session_queue(result):
+                return decode_message(result[1]) if result else None
     
     def is_order_in_session(self, session_id: str, order_number: str) -> bool:
         """判断消息是否在已处理队列中"""
         try:
-            redis_key = f"{self.session_order_queue}_{session_id}"
-            score = self.redis_client.zscore(redis_key, order_number)  # 获取消息的分数
+            if self.write_buffer is not None and self.write_buffer.has_order(session_id, order_number):
+                return True
+            redis_key = self._session_key(self.session_order_queue, session_id)
+            score = self.redis_client.zscore(redis_key, self.order_index.encode(order_number))  # 获取消息的分数
             
             return score is not None  # 如果分数不为 None，则表示消息在有序集合中
         except Exception as e:
@@ -115,41 +491,123 @@ class RedisQueue:
             raise
     def put_session_order(self, session_id: str, order_number: str):
         """将订单放入微信关联群"""
+        if self.write_buffer is not None:
+            self.write_buffer.add_orders(session_id, [order_number])
+            return
         try:
             timestamp = time.time()
-            redis_key = f"{self.session_order_queue}_{session_id}"
-            self.redis_client.zadd(redis_key, {order_number: timestamp}, nx=True)
+            redis_key = self._session_key(self.session_order_queue, session_id)
+            self.redis_client.zadd(redis_key, {self.order_index.encode(order_number): timestamp}, nx=True)
 
             # 更新订单到会话的映射
-            self.redis_client.hset(self.order_to_session_queue, order_number, session_id)
-            
-            # 检查当前有序集合的大小
-            if self.redis_client.zcard(redis_key) > self.max_processed_limit:
-                # 移除分数最低的元素（最旧的元素）
-                removed_order = self.redis_client.zrange(redis_key, 0, 0)[0]
-                self.redis_client.zremrangebyrank(redis_key, 0, 0)  # 删除排名最低的元素
-
-                 # 从映射中移除被删除的订单
-                self.redis_client.hdel(self.order_to_session_queue, removed_order)
+            self.order_index.set_many(session_id, [order_number])
+            self._mark_dirty(redis_key)
         except Exception as e:
             logger.error(f"将订单放入微信关联群失败: {e}")
             raise
 
-    def put_orders_to_session(self, session_id: str, order_numbers: List[str]):
-        """处理订单列表，将不在会话中的订单添加到会话中"""
+    def put_orders_to_session(self, session_id: str, order_numbers: List[str]) -> int:
+        """处理订单列表，将不在会话中的订单添加到会话中，一次往返完成，返回新增订单数量"""
         try:
-            for order_number in order_numbers:
-                if not self.is_order_in_session(session_id, order_number):
-                    self.put_session_order(session_id, order_number)
+            if not order_numbers:
+                return 0
+            if self.write_buffer is not None:
+                # 延后写入时新增数量未知，返回0
+                self.write_buffer.add_orders(session_id, order_numbers)
+                return 0
+            # redis 不可用时新增数量未知，返回0
+            added = self._spill_guard('put_orders_to_session', [session_id, order_numbers],
+                                      lambda: self._register_orders(session_id, order_numbers), lambda: 0)
+            self._mark_dirty(self._session_key(self.session_order_queue, session_id))
+            return added
         except Exception as e:
             logger.error(f"将订单加入微信会话失败: {e}")
             raise
+
+    def _register_orders(self, session_id: str, order_numbers: List[str]) -> int:
+        keys, args = self._register_orders_call(session_id, order_numbers)
+        added = self.register_orders_script(keys=keys, args=args)
+        if not self.order_index.inline_key:
+            self.order_index.set_many(session_id, [self.order_index.decode(member) for member in added])
+        return len(added)
         
     
+    def list_session_orders(self, session_ids: List[str]) -> Dict[str, List[str]]:
+        """返回各会话中的订单号，按写入顺序，一次 pipeline 完成"""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for session_id in session_ids:
+                pipe.zrange(self._session_key(self.session_order_queue, session_id), 0, -1)
+            return {session_id: [self.order_index.decode(member) for member in members]
+                    for session_id, members in zip(session_ids, pipe.execute())}
+        except Exception as e:
+            logger.error(f"获取会话订单失败: {e}")
+            raise
+
+    def enforce_retention(self, full: bool = False) -> int:
+        """按时间窗口与数量上限批量裁剪写入过的集合，一次 pipeline 完成；full 为 True 时扫描全部集合"""
+        try:
+            redis_keys = self._take_dirty_keys()
+            if full:
+                redis_keys = set(redis_keys)
+                redis_keys.add(self.yto_processed_queue)
+                for pattern in self._retention_scan_patterns():
+                    redis_keys.update(self.redis_client.scan_iter(match=pattern, count=500))
+            if not redis_keys:
+                return 0
+
+            policies = [self._retention_policy(redis_key) for redis_key in redis_keys]
+            if self.cluster_client:
+                # 集群 pipeline 中的脚本在未加载过的节点上会失败，逐个键调用
+                results = [self.trim_script(keys=keys, args=args) for keys, args in policies]
+            else:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for keys, args in policies:
+                    self.trim_script(keys=keys, args=args, client=pipe)
+                results = pipe.execute()
+
+            removed = 0
+            for (keys, args), result in zip(policies, results):
+                if isinstance(result, list):
+                    removed += len(result)
+                    if result:
+                        orders = [self.order_index.decode(member) for member in result]
+                        self.order_index.remove_if_owner(args[2], orders)
+                        self._invalidate_orders(orders)
+                else:
+                    removed += result
+            if removed:
+                logger.info(f"保留策略裁剪 {len(redis_keys)} 个集合, 移除 {removed} 条")
+            return removed
+        except Exception as e:
+            logger.error(f"执行保留策略失败: {e}")
+            raise
+
+    def _invalidate_orders(self, order_numbers: List[str]):
+        """清理映射后立即删除本进程缓存中两代映射键对应的条目，不等跟踪通知"""
+        cache = self._cache()
+        if cache:
+            cache.invalidate(list({self.order_index.cache_key(redis_key)
+                                   for redis_key in self.order_index.removal_groups(order_numbers)}))
+
     def find_session_id_by_order_number(self, order_number: str) -> Optional[str]:
         """根据订单号查找对应的会话ID"""
         try:
-            session_id = self.redis_client.hget(self.order_to_session_queue, order_number)
+            if self.write_buffer is not None:
+                session_id = self.write_buffer.session_of(order_number)
+                if session_id:
+                    return session_id
+            cache = self._cache()
+            index_key = self.order_index.cache_key(self.order_index.key(order_number))
+            if cache:
+                session_id = cache.get(index_key, order_number, 'order')
+                if session_id:
+                    return session_id
+                generation = cache.generation(index_key)
+
+            session_id = self.order_index.get(order_number)
+            if cache:
+                cache.put(index_key, order_number, session_id, generation)
             return session_id if session_id else None
         except Exception as e:
             logger.error(f"查找订单号对应的会话ID失败: {e}")
@@ -0,0 +1,82 @@
+import hashlib
+import uuid
+import redis
+from logger import logger
+from typing import Any, Callable, Optional, Dict, List, Tuple
+from config import SEND_LEDGER
+from models.lua_scripts import RESERVE_SEND, RELEASE_SEND
+
+class SendPendingError(Exception):
+    """同一条消息正在由其他发送方发送，或上次发送中途退出且预留尚未到期"""
+
+
+class SendLedger:
+    """基于 redis 的发送记录，避免进程重启或重试后重复发送
+
+    记录以 目的地、订单号、内容指纹 为键。发送前预留，发送成功后改为已发送并保留 ttl 秒，
+    发送失败时释放预留；已发送的记录直接跳过，不再占用几秒钟的界面发送。
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.key_prefix = 'send_ledger'
+        self.reserve_script = self.redis_client.register_script(RESERVE_SEND)
+        self.release_script = self.redis_client.register_script(RELEASE_SEND)
+
+    def key(self, destination: str, content: str, order_number: str = None) -> str:
+        """发送记录键，内容指纹固定 64 位，不受已处理消息指纹配置影响"""
+        digest = hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()
+        return f"{self.key_prefix}_{destination}_{order_number or ''}_{digest}"
+
+    def reserve(self, redis_key: str) -> Optional[str]:
+        """预留发送，返回预留令牌；已发送过返回 None，正在发送时抛出 SendPendingError"""
+        token = uuid.uuid4().hex
+        result = self.reserve_script(keys=[redis_key], args=[token, int(SEND_LEDGER['reserve_ttl'] * 1000)])
+        if result == 0:
+            return None
+        if result < 0:
+            raise SendPendingError(f"消息正在发送或上次发送未完成: {redis_key}")
+        return token
+
+    def confirm(self, redis_key: str):
+        """记录为已发送"""
+        self.redis_client.set(redis_key, 'sent', ex=SEND_LEDGER['ttl'])
+
+    def release(self, redis_key: str, token: str):
+        """发送失败，释放本次预留"""
+        self.release_script(keys=[redis_key], args=[token])
+
+    def send_once(self, destination: str, content: str, send: Callable[[], bool], order_number: str = None) -> bool:
+        """预留后调用 send 发送，成功记录为已发送，失败或抛出异常时释放预留；已发送过的直接返回 True"""
+        redis_key = self.key(destination, content, order_number)
+        try:
+            token = self.reserve(redis_key)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            # 发送记录不可用时照常发送，不因记录中断收发
+            logger.warning(f"发送记录不可用，直接发送: {e}")
+            return send()
+        if token is None:
+            logger.info(f"消息已发送过，跳过: {destination} {content}")
+            return True
+
+        try:
+            sent = send()
+        except BaseException:
+            self._release_quietly(redis_key, token)
+            raise
+        if not sent:
+            self._release_quietly(redis_key, token)
+            return False
+        try:
+            self.confirm(redis_key)
+        except Exception as e:
+            # 记录失败时预留仍然有效，到期前的重放不会重复发送
+            logger.error(f"写入发送记录失败: {e}")
+        return True
+
+    def _release_quietly(self, redis_key: str, token: str):
+        try:
+            self.release(redis_key, token)
+        except Exception as e:
+            # 释放失败时预留到期后自动失效
+            logger.error(f"释放发送预留失败: {e}")
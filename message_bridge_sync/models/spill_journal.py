@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import time
+from logger import logger
+from typing import Any, Callable, Optional, Dict, List, Tuple
+
+class SpillFullError(Exception):
+    """溢出日志已达到大小上限"""
+
+
+class SpillJournal:
+    """redis 不可用时的本地预写日志
+
+    每条写操作以一行 JSON 追加到文件末尾，恢复后按写入顺序回放；
+    回放中途失败时保留未回放的部分，下次从该处继续。
+    fsync 策略 always 每条写入后同步到磁盘，interval 按间隔同步，never 由系统决定。
+    """
+
+    def __init__(self, path: str, max_bytes: int, fsync: str = 'interval', fsync_interval: float = 1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.last_fsync = 0.0
+        self.lock = threading.RLock()
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+    def pending(self) -> bool:
+        """是否有未回放的记录"""
+        return self.size > 0
+
+    def append(self, op: str, args: list):
+        """追加一条记录，超过大小上限时抛出 SpillFullError"""
+        line = (json.dumps({'op': op, 'args': args, 'ts': time.time()}, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock:
+            if self.size + len(line) > self.max_bytes:
+                raise SpillFullError(f"溢出日志已满 {self.size} 字节")
+            self.file.write(line)
+            self.file.flush()
+            self.size += len(line)
+            if self.fsync == 'always' or (self.fsync == 'interval' and time.time() - self.last_fsync >= self.fsync_interval):
+                os.fsync(self.file.fileno())
+                self.last_fsync = time.time()
+
+    def replay(self, apply: Callable[[str, list], None]) -> int:
+        """按顺序回放全部记录，apply 抛出异常时保留剩余记录并重新抛出，返回回放数量"""
+        with self.lock:
+            if not self.pending():
+                return 0
+            self.file.flush()
+            with open(self.path, 'rb') as journal:
+                lines = journal.read().splitlines(keepends=True)
+
+            replayed = 0
+            try:
+                for line in lines:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 写入中途崩溃留下的半行
+                        logger.warning(f"跳过损坏的溢出日志记录: {line[:100]}")
+                        replayed += 1
+                        continue
+                    apply(record['op'], record['args'])
+                    replayed += 1
+            finally:
+                self._rewrite(lines[replayed:])
+            return replayed
+
+    def _rewrite(self, lines: List[bytes]):
+        """用未回放的记录替换日志文件"""
+        self.file.close()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as temp:
+            temp.writelines(lines)
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
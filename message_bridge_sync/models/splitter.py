@@ -0,0 +1,98 @@
+from typing import Any, Optional, Dict, List, Tuple
+from models.message import Message
+from models.classifier import classify, ORDER_PATTERN
+from models.keyword_matcher import INTENT_MATCHER
+
+
+def _line_items(content: str) -> List[Tuple[Optional[str], Optional[str], str]]:
+    """逐行提取 (订单号, 意图, 所在行)，只有意图没有订单号的行记为 (None, 意图, 行)
+
+    同一行重复的订单号只保留一个，意图取第一个非空的。
+    """
+    items = []
+    for line in content.splitlines():
+        line = line.strip()
+        result = classify(line)
+        if result.waybills:
+            intents = {}
+            for waybill, intent in zip(result.waybills, result.waybill_intents):
+                if intents.get(waybill) is None:
+                    intents[waybill] = intent
+            items.extend((waybill, intent, line) for waybill, intent in intents.items())
+            continue
+        found = INTENT_MATCHER.find_all(line)
+        if found:
+            items.append((None, found[-1][1], line))
+    return items
+
+
+def _inherit_intents(items) -> List[Tuple[str, Optional[str], str, bool]]:
+    """没有意图的订单号使用后面最近的意图，后面没有时使用前面最近的意图
+
+    如 "YT1\\nYT2 催件" 两个都是催件，"拦截\\nYT1\\nYT2" 两个都是拦截。返回 (订单号, 意图, 所在行, 是否继承)。
+    """
+    following = [None] * len(items)
+    intent = None
+    for index in range(len(items) - 1, -1, -1):
+        following[index] = intent
+        intent = items[index][1] or intent
+
+    resolved = []
+    preceding = None
+    for index, (waybill, intent, line) in enumerate(items):
+        if waybill is not None:
+            inherited = intent or following[index] or preceding
+            resolved.append((waybill, inherited, line, intent is None))
+        preceding = intent or preceding
+    return resolved
+
+
+def _remainder(line: str) -> str:
+    """去掉行中全部订单号与意图关键字后剩下的内容，如改地址后面的新地址"""
+    chars = list(line)
+    spans = [match.span() for match in ORDER_PATTERN.finditer(line)]
+    spans.extend((start, start + len(keyword)) for start, keyword in INTENT_MATCHER.find_all(line))
+    for start, end in spans:
+        chars[start:end] = ' ' * (end - start)
+    return ' '.join(''.join(chars).split())
+
+
+def split_message(message: Message) -> List[Message]:
+    """把包含多个订单号的微信消息拆成每个订单号一条请求，去掉重复的 订单号+意图
+
+    拆出的请求共用原消息的 trace_id，各自带订单号，分别入队、发送与匹配回复；只有一个订单号时原样返回。
+    """
+    items = _inherit_intents(_line_items(message.content or ''))
+    waybills = {waybill for waybill, _, _, _ in items}
+    if len(waybills) <= 1:
+        if waybills and not message.order_number:
+            message.order_number = next(iter(waybills))
+        return [message]
+
+    # 行 -> 行中的订单号
+    lines = {}
+    for waybill, _, line, _ in items:
+        lines.setdefault(line, set()).add(waybill)
+
+    requests = []
+    seen = set()
+    for waybill, intent, line, inherited in items:
+        if (waybill, intent) in seen:
+            continue
+        seen.add((waybill, intent))
+        if len(lines[line]) == 1:
+            # 一行一个订单号时保留整行，改地址等请求后面的新地址不丢失
+            content = f"{line} {intent}" if inherited and intent else line
+        else:
+            # 一行多个订单号时每个请求保留去掉订单号与意图后的其余内容
+            content = ' '.join(part for part in (waybill, intent, _remainder(line)) if part)
+        requests.append(Message(
+            content=content,
+            source=message.source,
+            session_id=message.session_id,
+            order_number=waybill,
+            msg_type=message.type,
+            timestamp=message.timestamp,
+            trace_id=message.trace_id,
+        ))
+    return requests
@@ -0,0 +1,264 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from logger import logger
+from models.message import Message
+from typing import Any, Optional, Dict, List, Tuple
+from config import SQLITE_QUEUE
+from models.queue_backend import QueueBackend
+from models.envelope import encode_message, decode_message
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_messages_queue ON queue_messages (queue, id);
+CREATE TABLE IF NOT EXISTS sorted_sets (
+    key TEXT NOT NULL,
+    member TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (key, member)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sorted_sets_score ON sorted_sets (key, score);
+CREATE TABLE IF NOT EXISTS order_sessions (
+    order_number TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS retries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    due REAL NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS retries_due ON retries (due);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry TEXT NOT NULL
+);
+"""
+
+class SqliteQueue(QueueBackend):
+    """基于 sqlite 的本机实现，没有网络往返
+
+    数据库使用 WAL 模式，同一主机上的接收与发送进程可以共享同一个文件；
+    其他进程写入的消息没有通知，阻塞等待时按 poll_interval 轮询。
+    """
+
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.path = path or SQLITE_QUEUE['path']
+        # 一个连接由本进程的所有线程共享，访问由锁串行化
+        self.connection = sqlite3.connect(self.path, timeout=SQLITE_QUEUE['busy_timeout'] / 1000,
+                                          check_same_thread=False, isolation_level=None)
+        self.condition = threading.Condition()
+        with self.condition:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(f"PRAGMA busy_timeout={int(SQLITE_QUEUE['busy_timeout'])}")
+            self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        """写事务，开始时即获取写锁，避免读后升级写锁时死锁"""
+        with self.condition:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _put(self, queue: str, message: Message):
+        with self._transaction() as connection:
+            connection.execute("INSERT INTO queue_messages (queue, data) VALUES (?, ?)",
+                               (queue, encode_message(message)))
+            self.condition.notify_all()
+
+    def _pop(self, queues: List[str]) -> Optional[Tuple[str, dict]]:
+        with self._transaction() as connection:
+            for queue in queues:
+                row = connection.execute("SELECT id, data FROM queue_messages WHERE queue = ? ORDER BY id LIMIT 1",
+                                         (queue,)).fetchone()
+                if row:
+                    connection.execute("DELETE FROM queue_messages WHERE id = ?", (row[0],))
+                    return queue, decode_message(row[1])
+        return None
+
+    def put_wechat_message(self, message: Message):
+        """将微信消息放入队列"""
+        try:
+            self._put(self.wechat_queue, message)
+            logger.info(f"消息已加入微信队列: {message.content}")
+        except Exception as e:
+            logger.error(f"添加微信消息到队列失败: {e}")
+            raise
+
+    def get_wechat_message(self) -> Optional[dict]:
+        """从队列获取微信消息"""
+        try:
+            result = self._pop([self.wechat_queue])
+            return result[1] if result else None
+        except Exception as e:
+            logger.error(f"从队列获取微信消息失败: {e}")
+            raise
+
+    def put_yto_message(self, message: Message):
+        """将圆通消息放入队列"""
+        try:
+            self._put(self.yto_queue, message)
+            logger.info(f"消息已加入圆通队列: {message.content}")
+        except Exception as e:
+            logger.error(f"添加圆通消息到队列失败: {e}")
+            raise
+
+    def get_yto_message(self) -> Optional[dict]:
+        """从队列获取圆通消息"""
+        try:
+            result = self._pop([self.yto_queue])
+            return result[1] if result else None
+        except Exception as e:
+            logger.error(f"从队列获取圆通消息失败: {e}")
+            raise
+
+    def wait_for_message(self, queues: List[str], timeout: int) -> Optional[Tuple[str, dict]]:
+        """阻塞等待多个队列，本进程写入立即唤醒，其他进程写入按间隔轮询"""
+        try:
+            deadline = time.time() + timeout
+            while True:
+                result = self._pop(queues)
+                remaining = deadline - time.time()
+                if result or remaining <= 0:
+                    return result
+                with self.condition:
+                    self.condition.wait(min(remaining, SQLITE_QUEUE['poll_interval']))
+        except Exception as e:
+            logger.error(f"阻塞获取队列消息失败: {e}")
+            raise
+
+    def _add_retries(self, entries: Dict[str, float]):
+        with self._transaction() as connection:
+            connection.executemany("INSERT INTO retries (due, entry) VALUES (?, ?)",
+                                   [(due, entry) for entry, due in entries.items()])
+
+    def _pop_due_retry_entries(self, now: float, limit: int) -> List[str]:
+        with self._transaction() as connection:
+            rows = connection.execute("SELECT id, entry FROM retries WHERE due <= ? ORDER BY due LIMIT ?",
+                                      (now, limit)).fetchall()
+            connection.executemany("DELETE FROM retries WHERE id = ?", [(row[0],) for row in rows])
+        return [row[1] for row in rows]
+
+    def _add_dead_letters(self, entries: List[str]):
+        with self._transaction() as connection:
+            connection.executemany("INSERT INTO dead_letters (entry) VALUES (?)", [(entry,) for entry in entries])
+
+    def _peek_dead_letters(self, limit: Optional[int]) -> List[str]:
+        with self.condition:
+            rows = self.connection.execute("SELECT entry FROM dead_letters ORDER BY id LIMIT ?",
+                                           (-1 if limit is None else limit,)).fetchall()
+        return [row[0] for row in rows]
+
+    def _remove_dead_letters(self, entries: List[str]):
+        with self._transaction() as connection:
+            connection.executemany(
+                "DELETE FROM dead_letters WHERE id = (SELECT id FROM dead_letters WHERE entry = ? ORDER BY id LIMIT 1)",
+                [(entry,) for entry in entries])
+
+    def _check_and_mark(self, redis_key: str, members: List[str]) -> List[bool]:
+        timestamp = time.time()
+        with self._transaction() as connection:
+            added = [
+                connection.execute("INSERT OR IGNORE INTO sorted_sets (key, member, score) VALUES (?, ?, ?)",
+                                   (redis_key, member, timestamp + i * 0.000001)).rowcount == 1
+                for i, member in enumerate(members)
+            ]
+        self._mark_dirty(redis_key)
+        return added
+
+    def _is_member(self, redis_key: str, member: str) -> bool:
+        with self.condition:
+            row = self.connection.execute("SELECT 1 FROM sorted_sets WHERE key = ? AND member = ?",
+                                          (redis_key, member)).fetchone()
+        return row is not None
+
+    def put_orders_to_session(self, session_id: str, order_numbers: List[str]) -> int:
+        """处理订单列表，将不在会话中的订单添加到会话中，一个事务完成，返回新增订单数量"""
+        try:
+            redis_key = self._session_key(self.session_order_queue, session_id)
+            timestamp = time.time()
+            added = 0
+            with self._transaction() as connection:
+                for i, order_number in enumerate(order_numbers):
+                    cursor = connection.execute(
+                        "INSERT OR IGNORE INTO sorted_sets (key, member, score) VALUES (?, ?, ?)",
+                        (redis_key, order_number, timestamp + i * 0.000001))
+                    if cursor.rowcount == 1:
+                        connection.execute("INSERT OR REPLACE INTO order_sessions (order_number, session_id) VALUES (?, ?)",
+                                           (order_number, session_id))
+                        added += 1
+            self._mark_dirty(redis_key)
+            return added
+        except Exception as e:
+            logger.error(f"将订单加入微信会话失败: {e}")
+            raise
+
+    def is_order_in_session(self, session_id: str, order_number: str) -> bool:
+        """判断订单是否已在会话中"""
+        return self._is_member(self._session_key(self.session_order_queue, session_id), order_number)
+
+    def find_session_id_by_order_number(self, order_number: str) -> Optional[str]:
+        """根据订单号查找对应的会话ID"""
+        try:
+            with self.condition:
+                row = self.connection.execute("SELECT session_id FROM order_sessions WHERE order_number = ?",
+                                              (order_number,)).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"查找订单号对应的会话ID失败: {e}")
+            raise
+
+    def list_session_orders(self, session_ids: List[str]) -> Dict[str, List[str]]:
+        """返回各会话中的订单号，按写入顺序"""
+        orders = {}
+        with self.condition:
+            for session_id in session_ids:
+                rows = self.connection.execute("SELECT member FROM sorted_sets WHERE key = ? ORDER BY score",
+                                               (self._session_key(self.session_order_queue, session_id),))
+                orders[session_id] = [row[0] for row in rows]
+        return orders
+
+    def enforce_retention(self, full: bool = False) -> int:
+        """按时间窗口与数量上限裁剪写入过的集合，一个事务完成；full 为 True 时裁剪全部集合"""
+        try:
+            redis_keys = self._take_dirty_keys()
+            removed = 0
+            with self._transaction() as connection:
+                if full:
+                    redis_keys = {row[0] for row in connection.execute("SELECT DISTINCT key FROM sorted_sets")}
+                for redis_key in redis_keys:
+                    cutoff, limit, session_id = self._retention_limits(redis_key)
+                    expired = [row[0] for row in connection.execute(
+                        "SELECT member FROM sorted_sets WHERE key = ? AND score < ?", (redis_key, cutoff))]
+                    if limit:
+                        count = connection.execute("SELECT COUNT(*) FROM sorted_sets WHERE key = ?",
+                                                   (redis_key,)).fetchone()[0]
+                        overflow = count - len(expired) - limit
+                        if overflow > 0:
+                            expired.extend(row[0] for row in connection.execute(
+                                "SELECT member FROM sorted_sets WHERE key = ? AND score >= ? ORDER BY score LIMIT ?",
+                                (redis_key, cutoff, overflow)))
+                    connection.executemany("DELETE FROM sorted_sets WHERE key = ? AND member = ?",
+                                           [(redis_key, member) for member in expired])
+                    if session_id is not None:
+                        # 订单可能已被其他群重新提及，只清理仍指向本群的映射
+                        connection.executemany("DELETE FROM order_sessions WHERE order_number = ? AND session_id = ?",
+                                               [(member, session_id) for member in expired])
+                    removed += len(expired)
+            if removed:
+                logger.info(f"保留策略裁剪 {len(redis_keys)} 个集合, 移除 {removed} 条")
+            return removed
+        except Exception as e:
+            logger.error(f"执行保留策略失败: {e}")
+            raise
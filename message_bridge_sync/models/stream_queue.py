@@ -0,0 +1,162 @@
+import os
+import socket
+import redis
+from logger import logger
+from models.message import Message
+from models.redis_queue import RedisQueue
+from models.envelope import encode_message, decode_message
+from typing import Any, Optional, Dict, List, Tuple
+from config import STREAM_CONFIG
+
+class RedisStreamQueue(RedisQueue):
+    """基于 redis stream 消费组的消息队列
+
+    消息取出后进入待确认列表，发送成功后再确认；进程崩溃时未确认的消息
+    在空闲超过 claim_idle 后由其他消费者认领，多个发送进程可以共享同一队列。
+    """
+
+    def __init__(self):
+        super().__init__()
+        # stream 队列自身支持多消费者，不使用群队列与优先级通道
+        self.per_session_queue = False
+        self.priority_queue = False
+        self.group_name = STREAM_CONFIG['group']
+        self.consumer_name = STREAM_CONFIG.get('consumer') or f"{socket.gethostname()}-{os.getpid()}"
+        self.stream_maxlen = STREAM_CONFIG['maxlen']
+        self.claim_idle = STREAM_CONFIG['claim_idle']
+        self.max_deliveries = STREAM_CONFIG['max_deliveries']
+        # 与列表队列使用不同的键，避免与旧数据类型冲突
+        self.streams = {
+            self.wechat_queue: f"{self.wechat_queue}_stream",
+            self.yto_queue: f"{self.yto_queue}_stream",
+        }
+        for stream in self.streams.values():
+            self._ensure_group(stream)
+        # 每个队列的认领游标，下次从上次结束的位置继续扫描，扫描完一轮后回到 0-0
+        self.claim_cursors = {queue: '0-0' for queue in self.streams}
+
+    def _ensure_group(self, stream: str):
+        """创建消费组，已存在时忽略"""
+        try:
+            self.redis_client.xgroup_create(stream, self.group_name, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                logger.error(f"创建消费组失败: {e}")
+                raise
+
+    def _put(self, queue: str, message: Message):
+        """写入 stream，并按长度近似裁剪"""
+        self.binary_client.xadd(
+            self.streams[queue],
+            {'data': encode_message(message)},
+            maxlen=self.stream_maxlen,
+            approximate=True
+        )
+
+    def _to_message(self, stream_id: bytes, fields: Dict[bytes, bytes]) -> dict:
+        data = decode_message(fields[b'data'])
+        data['stream_id'] = stream_id.decode()
+        return data
+
+    def _claim(self, queue: str) -> Optional[dict]:
+        """认领崩溃消费者遗留的超时未确认消息，投递次数超过上限的确认后放入死信队列"""
+        stream = self.streams[queue]
+        while True:
+            result = self.binary_client.xautoclaim(
+                stream, self.group_name, self.consumer_name,
+                min_idle_time=self.claim_idle, start_id=self.claim_cursors[queue], count=1
+            )
+            if not result:
+                return None
+            cursor, claimed = result[0], result[1]
+            self.claim_cursors[queue] = cursor.decode() if isinstance(cursor, bytes) else cursor
+            if not claimed:
+                return None
+            stream_id, fields = claimed[0]
+            # 已被裁剪的消息只剩id，没有内容
+            if not fields:
+                continue
+            pending = self.binary_client.xpending_range(stream, self.group_name, min=stream_id, max=stream_id, count=1)
+            deliveries = pending[0]['times_delivered'] if pending else 0
+            if deliveries > self.max_deliveries:
+                self._dead_letter_claimed(queue, stream_id, fields, deliveries)
+                continue
+            logger.warning(f"认领超时未确认的消息: {stream_id.decode()}，第 {deliveries} 次投递")
+            return self._to_message(stream_id, fields)
+
+    def _dead_letter_claimed(self, queue: str, stream_id: bytes, fields: Dict[bytes, bytes], deliveries: int):
+        """放入死信队列后再确认，确认前退出时消息仍在待确认列表中"""
+        try:
+            message = decode_message(fields[b'data'])
+        except Exception as e:
+            # 无法解码的消息可能正是反复失败的原因，保留原始内容
+            logger.error(f"解码认领的消息失败: {e}")
+            message = {'data': fields[b'data'].decode('utf-8', 'replace')}
+        error = f"投递 {deliveries} 次仍未确认"
+        self._add_dead_letters([self._retry_entry(queue, message, error)])
+        self.redis_client.xack(self.streams[queue], self.group_name, stream_id)
+        logger.error(f"消息{error}，放入死信队列: {stream_id.decode()}")
+
+    def _read(self, queues: List[str], block: Optional[int]) -> Optional[Tuple[str, dict]]:
+        """读取消费组中的新消息"""
+        result = self.binary_client.xreadgroup(
+            self.group_name, self.consumer_name,
+            streams={self.streams[queue]: '>' for queue in queues},
+            count=1, block=block
+        )
+        stream_queues = {stream: queue for queue, stream in self.streams.items()}
+        for stream, entries in result or []:
+            for stream_id, fields in entries:
+                return stream_queues[stream.decode()], self._to_message(stream_id, fields)
+        return None
+
+    def _get(self, queue: str) -> Optional[dict]:
+        message = self._claim(queue)
+        if message:
+            return message
+        result = self._read([queue], None)
+        return result[1] if result else None
+
+    def _put_wechat_message(self, message: Message):
+        self._put(self.wechat_queue, message)
+
+    def get_wechat_message(self) -> Optional[dict]:
+        """从队列获取微信消息，处理完成后需调用 ack_message 确认"""
+        try:
+            return self._get(self.wechat_queue)
+        except Exception as e:
+            logger.error(f"从队列获取微信消息失败: {e}")
+            raise
+
+    def _put_yto_message(self, message: Message):
+        self._put(self.yto_queue, message)
+
+    def get_yto_message(self) -> Optional[dict]:
+        """从队列获取圆通消息，处理完成后需调用 ack_message 确认"""
+        try:
+            return self._get(self.yto_queue)
+        except Exception as e:
+            logger.error(f"从队列获取圆通消息失败: {e}")
+            raise
+
+    def wait_for_message(self, queues: List[str], timeout: int) -> Optional[Tuple[str, dict]]:
+        """先认领遗留消息，再阻塞等待多个队列的新消息"""
+        try:
+            for queue in queues:
+                message = self._claim(queue)
+                if message:
+                    return queue, message
+            return self._read(queues, timeout * 1000)
+        except Exception as e:
+            logger.error(f"阻塞获取队列消息失败: {e}")
+            raise
+
+    def ack_message(self, queue: str, message: dict):
+        """确认消息已处理完成，从待确认列表移除"""
+        try:
+            stream_id = message.get('stream_id')
+            if stream_id:
+                self.redis_client.xack(self.streams[queue], self.group_name, stream_id)
+        except Exception as e:
+            logger.error(f"确认队列消息失败: {e}")
+            raise
@@ -0,0 +1,133 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Optional, Dict, List, Tuple
+
+# 完整订单号的最少数字位数，与 ORDER_FORMAT 的 YT\d{13,15} 一致，更短的按部分订单号查找
+FULL_DIGITS = 13
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """两个订单号是否最多相差一次 替换、相邻交换、多一位或少一位"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    # 去掉相同的首尾后比较剩余部分
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    rest_a, rest_b = a[start:end_a], b[start:end_b]
+    if len(rest_a) <= 1 and len(rest_b) <= 1:
+        return True
+    return len(rest_a) == len(rest_b) == 2 and rest_a == rest_b[::-1]
+
+
+class WaybillIndex:
+    """内存中的订单号前缀/后缀索引，订单号映射不到群时按部分或输错的订单号查找
+
+    订单号的数字部分按正序和逆序各保存一个有序列表，前缀与后缀查找都是二分后顺序读取相邻的条目；
+    相比逐字符的字典树，两万个订单号只占两个列表，查找同样在微秒级。
+    """
+
+    def __init__(self, max_size: int, min_digits: int, max_candidates: int):
+        self.max_size = max_size
+        self.min_digits = min_digits
+        self.max_candidates = max_candidates
+        self.lock = threading.Lock()
+        # 数字部分 -> 会话ID，按写入顺序，超出上限时淘汰最早的
+        self.sessions: Dict[str, str] = {}
+        self.forward: List[str] = []
+        self.backward: List[str] = []
+
+    @staticmethod
+    def digits(order_number: str) -> str:
+        return re.sub(r'\D', '', order_number or '')
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, session_id: str, order_numbers: List[str]):
+        """记录群中出现的订单号，同一订单号以最后提及的群为准"""
+        with self.lock:
+            for order_number in order_numbers:
+                key = self.digits(order_number)
+                if not key:
+                    continue
+                if key in self.sessions:
+                    del self.sessions[key]
+                else:
+                    insort(self.forward, key)
+                    insort(self.backward, key[::-1])
+                self.sessions[key] = session_id
+            while len(self.sessions) > self.max_size:
+                self._discard(next(iter(self.sessions)))
+
+    def _discard(self, key: str):
+        del self.sessions[key]
+        del self.forward[bisect_left(self.forward, key)]
+        del self.backward[bisect_left(self.backward, key[::-1])]
+
+    @staticmethod
+    def _scan(keys: List[str], prefix: str, limit: int) -> Optional[List[str]]:
+        """有序列表中以 prefix 开头的条目，超过 limit 个时返回 None"""
+        found = []
+        for index in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[index].startswith(prefix):
+                break
+            if len(found) >= limit:
+                return None
+            found.append(keys[index])
+        return found
+
+    def _with_prefix(self, prefix: str, limit: int) -> Optional[List[str]]:
+        return self._scan(self.forward, prefix, limit)
+
+    def _with_suffix(self, suffix: str, limit: int) -> Optional[List[str]]:
+        found = self._scan(self.backward, suffix[::-1], limit)
+        return None if found is None else [key[::-1] for key in found]
+
+    def _similar(self, key: str) -> List[str]:
+        """最多相差一次编辑的订单号
+
+        一次编辑只改动相邻的两位 [k, k+1]，其前的前缀与其后的后缀都不变；对每个 k 取较长的一段二分查找，
+        再逐个校验。连号的订单只在末几位不同，候选过多时跳过该段。
+        """
+        found = set()
+        for k in range(len(key) - 1):
+            prefix, suffix = key[:k], key[k + 2:]
+            if len(suffix) >= len(prefix):
+                candidates = self._with_suffix(suffix, self.max_candidates)
+            else:
+                candidates = self._with_prefix(prefix, self.max_candidates)
+            for candidate in candidates or ():
+                if candidate.startswith(prefix) and candidate.endswith(suffix) and within_one_edit(key, candidate):
+                    found.add(candidate)
+        return sorted(found)
+
+    def lookup(self, order_number: str) -> Dict[str, str]:
+        """按完整、部分或输错的订单号查找，返回 {订单号数字部分: 会话ID}
+
+        先精确查找，找不到时查找相差一次编辑的订单号；部分订单号再按结尾、开头查找。
+        """
+        key = self.digits(order_number)
+        if len(key) < self.min_digits:
+            return {}
+        with self.lock:
+            if key in self.sessions:
+                return {key: self.sessions[key]}
+            # 少输一位的订单号也按输错查找
+            candidates = self._similar(key) if len(key) >= FULL_DIGITS - 1 else []
+            if not candidates and len(key) < FULL_DIGITS:
+                candidates = (self._with_suffix(key, self.max_candidates)
+                              or self._with_prefix(key, self.max_candidates) or [])
+            return {candidate: self.sessions[candidate] for candidate in candidates}
+
+    def resolve(self, order_number: str) -> Optional[str]:
+        """候选订单号都属于同一个群时返回该群，找不到或有歧义时返回 None"""
+        session_ids = set(self.lookup(order_number).values())
+        return session_ids.pop() if len(session_ids) == 1 else None
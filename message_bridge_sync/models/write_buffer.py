@@ -0,0 +1,113 @@
+import threading
+from typing import Any, Optional, Dict, List, Tuple
+
+class WriteBuffer:
+    """延后写入 redis 的已处理标记与会话订单
+
+    写入先进入 pending，刷新时整批移到 flushing，写入成功后清除，失败时放回 pending；
+    两者在写入完成之前都可以查询，本进程的去重与订单查询能读到自己尚未写入的数据。
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        # 已处理标记: 集合键 -> 成员列表; 会话订单: 会话ID -> 订单号列表
+        self.pending_marks: Dict[str, List[str]] = {}
+        self.pending_orders: Dict[str, List[str]] = {}
+        self.flushing_marks: Dict[str, List[str]] = {}
+        self.flushing_orders: Dict[str, List[str]] = {}
+        # 集合键或会话ID -> {成员: 在 pending/flushing 中出现的次数}，去重查询为 O(1)，不逐个扫描列表
+        self.buffered_marks: Dict[str, Dict[str, int]] = {}
+        self.buffered_orders: Dict[str, Dict[str, int]] = {}
+        # 订单号 -> 会话ID，与 pending/flushing 中的订单同步
+        self.order_sessions: Dict[str, str] = {}
+        self.size = 0
+
+    def add_marks(self, redis_key: str, members: List[str]):
+        with self.lock:
+            self.pending_marks.setdefault(redis_key, []).extend(members)
+            self._count(self.buffered_marks, redis_key, members, 1)
+            self._added(len(members))
+
+    def add_orders(self, session_id: str, order_numbers: List[str]):
+        with self.lock:
+            self.pending_orders.setdefault(session_id, []).extend(order_numbers)
+            self._count(self.buffered_orders, session_id, order_numbers, 1)
+            for order_number in order_numbers:
+                self.order_sessions[order_number] = session_id
+            self._added(len(order_numbers))
+
+    def _added(self, count: int):
+        self.size += count
+        if self.size >= self.max_items:
+            self.ready.set()
+
+    @staticmethod
+    def _count(counts: Dict[str, Dict[str, int]], key: str, items: List[str], delta: int):
+        """更新出现次数，减到 0 的成员与空的键删除"""
+        members = counts.setdefault(key, {})
+        for item in items:
+            count = members.get(item, 0) + delta
+            if count > 0:
+                members[item] = count
+            else:
+                members.pop(item, None)
+        if not members:
+            del counts[key]
+
+    def has_mark(self, redis_key: str, member: str) -> bool:
+        with self.lock:
+            return member in self.buffered_marks.get(redis_key, ())
+
+    def has_order(self, session_id: str, order_number: str) -> bool:
+        with self.lock:
+            return order_number in self.buffered_orders.get(session_id, ())
+
+    def session_of(self, order_number: str) -> Optional[str]:
+        """未写入的订单所属会话"""
+        with self.lock:
+            return self.order_sessions.get(order_number)
+
+    def take(self) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+        """取出待写入的数据移到 flushing，上一批完成前不会再次取出"""
+        with self.lock:
+            self.ready.clear()
+            if self.flushing_marks or self.flushing_orders:
+                return {}, {}
+            self.flushing_marks, self.pending_marks = self.pending_marks, {}
+            self.flushing_orders, self.pending_orders = self.pending_orders, {}
+            self.size = 0
+            return self.flushing_marks, self.flushing_orders
+
+    def done(self):
+        """本批已写入 redis"""
+        with self.lock:
+            for redis_key, members in self.flushing_marks.items():
+                self._count(self.buffered_marks, redis_key, members, -1)
+            # 先减去本批的订单，剩下的计数即为 pending 中的订单
+            for session_id, order_numbers in self.flushing_orders.items():
+                self._count(self.buffered_orders, session_id, order_numbers, -1)
+            for session_id, order_numbers in self.flushing_orders.items():
+                for order_number in order_numbers:
+                    # 订单可能在刷新期间被其他群再次提及
+                    if self.order_sessions.get(order_number) == session_id and not self._order_pending(order_number):
+                        del self.order_sessions[order_number]
+            self.flushing_marks = {}
+            self.flushing_orders = {}
+
+    def restore(self):
+        """本批写入失败，放回 pending 等待下次刷新，保持原有顺序"""
+        with self.lock:
+            for redis_key, members in self.pending_marks.items():
+                self.flushing_marks.setdefault(redis_key, []).extend(members)
+            for session_id, order_numbers in self.pending_orders.items():
+                self.flushing_orders.setdefault(session_id, []).extend(order_numbers)
+            self.pending_marks, self.flushing_marks = self.flushing_marks, {}
+            self.pending_orders, self.flushing_orders = self.flushing_orders, {}
+            self.size = sum(map(len, self.pending_marks.values())) + sum(map(len, self.pending_orders.values()))
+
+    def _order_pending(self, order_number: str) -> bool:
+        """只在 done 减去本批订单后调用"""
+        session_id = self.order_sessions.get(order_number)
+        return order_number in self.buffered_orders.get(session_id, ())
@@ -0,0 +1,136 @@
+import re
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Optional, Dict, List, NamedTuple, Tuple
+from models.classifier import classify
+from models.keyword_matcher import INTENT_MATCHER, KeywordMatcher
+
+class YtoReply(NamedTuple):
+    """圆通回复解析结果，采集时解析一次，随消息入队"""
+    waybill: Optional[str]  # 第一个订单号
+    waybills: Tuple[str, ...]  # 全部订单号
+    intent: Optional[str]  # 回复对应的意图
+    weight: Optional[float]  # 重量(公斤)
+    status: Optional[str]  # 物流状态
+    location: Optional[str]  # 所在网点或转运中心
+    intercept: Optional[str]  # 拦截结果: 成功、失败、处理中
+    replied_at: Optional[float]  # 回复时间戳
+
+
+# 物流状态关键字 -> 状态
+STATUS_KEYWORDS = {
+    '已签收': '已签收', '签收': '已签收',
+    '派件中': '派件中', '正在派件': '派件中', '派送中': '派件中',
+    '已揽收': '已揽收', '揽收': '已揽收',
+    '运输中': '运输中', '在途': '运输中', '发往': '运输中',
+    '已到达': '已到达', '到达': '已到达',
+    '退回': '已退回', '退件': '已退回',
+    '问题件': '问题件', '滞留': '问题件',
+}
+# 否定形式，如 未签收、尚未揽收；与肯定关键字在同一位置结束，匹配时取最长的关键字，不会被识别为已签收
+STATUS_NEGATIONS = ['未', '没', '没有', '尚未', '还未', '还没', '还没有']
+NEGATED_STATUSES = {'签收': '未签收', '揽收': '未揽收', '派件': '未派件', '派送': '未派件', '到达': '未到达', '退回': '未退回'}
+STATUS_KEYWORDS.update({negation + keyword: status
+                        for keyword, status in NEGATED_STATUSES.items() for negation in STATUS_NEGATIONS})
+STATUS_MATCHER = KeywordMatcher(list(STATUS_KEYWORDS))
+
+# 重量单位 -> 公斤
+WEIGHT_UNITS = {'kg': 1, '公斤': 1, '千克': 1, '斤': 0.5, 'g': 0.001, '克': 0.001}
+WEIGHT_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(kg|公斤|千克|斤|g|克)(?![a-z])|重量\s*[:：为是]?\s*(\d+(?:\.\d+)?)',
+                            re.IGNORECASE)
+
+# 同一位置先匹配失败，避免 拦截不成功 被识别为成功
+INTERCEPT_PATTERN = re.compile(
+    r'(?P<failed>拦截失败|拦截不成功|无法拦截|不能拦截)|(?P<success>拦截成功|已拦截|拦截已成功)|(?P<pending>拦截中|拦截处理中|已提交拦截|拦截申请)'
+)
+INTERCEPT_RESULTS = {'failed': '失败', 'success': '成功', 'pending': '处理中'}
+
+LOCATION_PATTERN = re.compile(
+    r'【([^【】]{2,30})】|(?:到达|发往|离开|位于)\s*([一-龥A-Za-z0-9]{2,20}?(?:转运中心|分拨中心|中心|网点|公司|站))'
+)
+
+# 页面上的消息时间格式，缺少的日期部分使用当天
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%m-%d %H:%M:%S', '%m-%d %H:%M', '%H:%M:%S', '%H:%M']
+# 补全日期后晚于采集时间超过该值时，视为前一天(或前一年)的消息，容许页面与本机时钟的偏差
+FUTURE_TOLERANCE = timedelta(minutes=1)
+
+
+def parse_send_time(send_time: str) -> Optional[float]:
+    """解析页面上的消息时间，无法解析时返回 None"""
+    send_time = (send_time or '').strip()
+    now = datetime.now()
+    for time_format in TIME_FORMATS:
+        if '%Y' in time_format:
+            candidates = [(send_time, time_format)]
+        elif '%m' in time_format:
+            # 补上年份再解析，02-29 只在闰年有效；晚于当前时间的是去年的消息
+            candidates = [(f"{year}-{send_time}", f"%Y-{time_format}") for year in (now.year, now.year - 1)]
+        else:
+            # 刚过零点采集的 23:50 是前一天的消息
+            candidates = [(f"{day:%Y-%m-%d} {send_time}", f"%Y-%m-%d {time_format}")
+                          for day in (now, now - timedelta(days=1))]
+        for value, value_format in candidates:
+            try:
+                parsed = datetime.strptime(value, value_format)
+            except ValueError:
+                continue
+            if '%Y' in time_format or parsed <= now + FUTURE_TOLERANCE:
+                return parsed.timestamp()
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _parse_text(text: str) -> YtoReply:
+    waybills = classify(text).waybills
+
+    weight = None
+    match = WEIGHT_PATTERN.search(text)
+    if match:
+        if match.group(1):
+            weight = float(match.group(1)) * WEIGHT_UNITS[match.group(2).lower()]
+        else:
+            weight = float(match.group(3))
+
+    intercept = None
+    match = INTERCEPT_PATTERN.search(text)
+    if match:
+        intercept = INTERCEPT_RESULTS[match.lastgroup]
+
+    status = STATUS_MATCHER.search(text)
+    status = STATUS_KEYWORDS[status] if status else None
+
+    location = None
+    match = LOCATION_PATTERN.search(text)
+    if match:
+        location = match.group(1) or match.group(2)
+
+    # 回复中带有意图关键字时直接使用，否则按解析出的内容推断
+    found = INTENT_MATCHER.find_all(text)
+    if found:
+        intent = found[0][1]
+    elif intercept:
+        intent = '拦截'
+    elif weight is not None:
+        intent = '重量'
+    elif status or location:
+        intent = '到哪里'
+    else:
+        intent = None
+
+    return YtoReply(waybills[0] if waybills else None, waybills, intent, weight, status, location, intercept, None)
+
+
+def parse_yto_reply(text: str, send_time: str = None) -> YtoReply:
+    """解析圆通回复的订单号、意图、重量、物流状态、网点与拦截结果；同一内容只解析一次"""
+    replied_at = parse_send_time(send_time) if send_time else None
+    return _parse_text(text or '')._replace(replied_at=replied_at or time.time())
+
+
+def reply_from_list(values) -> Optional[YtoReply]:
+    """从队列消息中的字段列表还原"""
+    if not values:
+        return None
+    values = list(values)
+    values[1] = tuple(values[1] or ())
+    return YtoReply(*values)
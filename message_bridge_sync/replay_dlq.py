@@ -0,0 +1,30 @@
+# replay_dlq.py
+# 查看死信队列，或将死信队列中的消息批量放回原队列重新发送
+# 用法: python replay_dlq.py --list
+#       python replay_dlq.py [--limit N] [--queue wechat|yto]
+import argparse
+from models.queue_backend import create_queue_backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="死信队列查看与重放")
+    parser.add_argument('--list', action='store_true', help="只查看死信队列，不重放")
+    parser.add_argument('--limit', type=int, default=None, help="最多处理的消息数量，默认全部")
+    parser.add_argument('--queue', choices=['wechat', 'yto'], default=None, help="只重放指定队列的消息")
+    args = parser.parse_args()
+
+    redis_queue = create_queue_backend()
+    if args.list:
+        for entry in redis_queue.list_dead_letters(args.limit or 100):
+            message = entry['message']
+            print(f"[{entry['queue']}] 群 {message.get('session_id')} 重试 {message.get('attempts')} 次, "
+                  f"错误: {entry['error']}, 内容: {message.get('content')}")
+        return
+
+    queues = {'wechat': redis_queue.wechat_queue, 'yto': redis_queue.yto_queue}
+    replayed = redis_queue.replay_dead_letters(limit=args.limit, queue=queues.get(args.queue))
+    print(f"已重放 {replayed} 条消息")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 import random
 import re
+import redis
 from threading import Thread
-from config import REDIS_CONFIG, MONITORED_GROUPS, PROCESS_TYPE
+from typing import Any, Optional, Dict, List
+from config import REDIS_CONFIG, MONITORED_GROUPS, PROCESS_TYPE, RUN_MODE, QUEUE_BLOCK_TIMEOUT, SEND_INTERVAL, LOCAL_CACHE, RETENTION, MAX_RETRIES, RETRY_DELAY, RETRY_MAX_DELAY, RATE_LIMITS, SPILL, WRITE_BEHIND, SEND_LEDGER, SPLIT_WAYBILLS
 from logger import logger
+from models.message import Message
 from models.redis_queue import RedisQueue
+from models.queue_backend import create_queue_backend
+from models.rate_limiter import RateLimiter
+from models.send_ledger import SendLedger
+from models.splitter import split_message
+from models.yto_reply import YtoReply, reply_from_list
 from handlers.wechat_handler import WeChatHandler
 from handlers.yto_handler import YtoHandler
 from models.order_manager import OrderManager
@@ -11,15 +19,38 @@ import time
 
 class MessageBridge:
     def __init__(self):
-        self.redis_queue = RedisQueue()
-        self.wechat = WeChatHandler(self.redis_queue)
-        self.yto = YtoHandler(self.redis_queue)
+        self.redis_queue = create_queue_backend()
+        if SPILL['enabled'] and isinstance(self.redis_queue, RedisQueue):
+            self.redis_queue.enable_spill(SPILL['path'].format(process_type=PROCESS_TYPE))
+        if WRITE_BEHIND['enabled'] and isinstance(self.redis_queue, RedisQueue):
+            self.redis_queue.enable_write_behind()
+        # 发送记录需要跨进程重启保存，依赖 redis 队列后端
+        send_ledger = None
+        if SEND_LEDGER['enabled']:
+            if isinstance(self.redis_queue, RedisQueue):
+                send_ledger = SendLedger(self.redis_queue.redis_client)
+            else:
+                logger.warning("发送记录依赖 redis 队列后端，重启后可能重复发送")
+        self.wechat = WeChatHandler(self.redis_queue, send_ledger)
+        self.yto = YtoHandler(self.redis_queue, send_ledger)
         self.order_manager = OrderManager(self.redis_queue)
         self.is_running = True
         
         # 重试配置
-        self.max_retries = 3
-        self.retry_delay = 5  # 秒
+        self.max_retries = MAX_RETRIES
+        self.retry_delay = RETRY_DELAY  # 秒
+
+        # 共享发送配额，未启用时按拟人化间隔发送
+        self.rate_limiter = None
+        if RATE_LIMITS['enabled']:
+            if isinstance(self.redis_queue, RedisQueue):
+                self.rate_limiter = RateLimiter(self.redis_queue.redis_client)
+            else:
+                logger.warning("发送限流依赖 redis 队列后端，使用固定发送间隔")
+
+        # 发送节奏，只在两次实际发送之间等待
+        self.last_send_time = 0.0
+        self.send_interval = 0.0
 
     def init(self) -> bool:
         """初始化所有组件"""
@@ -27,10 +58,18 @@ class MessageBridge:
             return False
         if not self.yto.init_browser():
             return False
+        if LOCAL_CACHE['enabled'] and LOCAL_CACHE['warm_up']:
+            self.redis_queue.warm_up_cache(list(MONITORED_GROUPS.keys()))
+        try:
+            self.order_manager.load_waybill_index(list(MONITORED_GROUPS.keys()))
+        except Exception as e:
+            # 索引只用于兜底查找，加载失败不影响启动，查找不到时会重新加载
+            logger.error(f"加载订单号索引失败: {e}")
         return True
 
     def process_wechat_messages(self):
         """处理微信消息的线程"""
+        error_count = 0
         while self.is_running:
             try:
                 messages = self.wechat.get_messages()
@@ -41,79 +80,266 @@ class MessageBridge:
                         self.order_manager.register_order(order_numbers, msg.session_id)
                         logger.info(f"从群 {msg.session_id} 提取到订单号: {order_numbers}")
                     
-                    # 将消息存储到redis
+                    # 将消息存储到redis，由转发线程阻塞消费；多个订单号拆成每个订单一条请求分别入队
                     if msg.content:
-                        # self.redis_queue.put_wechat_message(msg)
-                        # wechat_message = self.redis_queue.get_wechat_message()
-                        self.yto.send_message(msg.content)
-                    
-                    time.sleep(random.uniform(3.5, 5.5))
+                        for request in self.split(msg):
+                            self.redis_queue.put_wechat_message(request)
+                    # 全部入队后再标记，入队前退出时下一轮会重新读取
+                    self.wechat.mark_processed(msg)
                                 
                 time.sleep(0.5)
+                error_count = 0
             except Exception as e:
+                # 短暂出错时等待后继续，连续出错超过重试次数才退出
+                error_count += 1
                 logger.error(f"处理微信消息时出错: {e}")
-                self.is_running = False
+                if error_count > self.max_retries:
+                    self.is_running = False
+                else:
+                    time.sleep(self.retry_delay)
     
     def process_yto_messages(self):
         """处理圆通消息的线程"""
+        error_count = 0
         while self.is_running:
             try:
                 messages = self.yto.get_messages()
                 for msg in messages:
-                    # 将消息存储到redis
+                    # 将消息存储到redis，按订单号匹配群，放入对应的群队列
                     if msg.content:
+                        order_numbers = self.reply_order_numbers(msg.content, msg.reply)
+                        if order_numbers:
+                            try:
+                                msg.session_id = self.order_manager.get_session_id(order_numbers[0])
+                            except Exception as e:
+                                # 查不到群时照常入队，转发时会再次按订单号匹配
+                                logger.warning(f"查找订单对应的群失败: {e}")
                         self.redis_queue.put_yto_message(msg)
                                 
                 time.sleep(0.5)
+                error_count = 0
             except Exception as e:
+                # 短暂出错时等待后继续，连续出错超过重试次数才退出
+                error_count += 1
                 logger.error(f"处理微信消息时出错: {e}")
-                self.is_running = False
+                if error_count > self.max_retries:
+                    self.is_running = False
+                else:
+                    time.sleep(self.retry_delay)
+
+    def reply_order_numbers(self, content: str, reply: Optional[YtoReply]) -> Optional[List[str]]:
+        """圆通回复中的订单号，采集时已解析的直接使用"""
+        if reply is not None:
+            return list(reply.waybills) or None
+        return self.order_manager.extract_order_number(content)
 
-    def process_yto_response(self, response_text: str):
+    def process_yto_response(self, response_text: str, reply: YtoReply = None):
         """处理圆通的回复消息"""
         try:
             # 从回复中提取订单号
-            order_numbers = self.order_manager.extract_order_number(response_text)
+            order_numbers = self.reply_order_numbers(response_text, reply)
             if order_numbers:
-                # 查找对应的群
-                session_id = self.order_manager.get_session_id(order_numbers[0])
-                if session_id:
+                # 查找每个订单号对应的群，同一个群只发送一次
+                sessions = {}
+                for order_number in order_numbers:
+                    session_id = self.order_manager.get_session_id(order_number)
+                    if session_id and session_id not in sessions:
+                        sessions[session_id] = order_number
+                if not sessions:
+                    logger.warning(f"找不到订单 {order_numbers} 对应的群")
+                for session_id, order_number in sessions.items():
                     # 发送到对应的群
-                    self.wechat.send_message(response_text, session_id)
-                else:
-                    logger.warning(f"找不到订单 {order_numbers[0]} 对应的群")
+                    self.throttle("wechat", session_id)
+                    self.wechat.switch_to_session(session_id)
+                    self.wechat.send_message(response_text, session_id, MONITORED_GROUPS.get(session_id), order_number)
             else:
                 logger.warning(f"圆通回复中没有找到订单号: {response_text}")
         except Exception as e:
             logger.error(f"处理圆通回复时出错: {e}")
-            self.is_running = False
+            raise
+
+    def split(self, msg: Message):
+        """多个订单号的消息拆成每个订单一条请求，未启用时原样返回"""
+        return split_message(msg) if SPLIT_WAYBILLS else [msg]
+
+    def throttle(self, target: str, session_id: str = None):
+        """发送前申请共享发送配额，未启用限流时不等待"""
+        if self.rate_limiter:
+            self.rate_limiter.wait(target, session_id)
+
+    def wait_send_interval(self):
+        """距离上次发送不足拟人化间隔时补足等待，空闲时不额外等待"""
+        wait_time = self.last_send_time + self.send_interval - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def mark_sent(self):
+        """记录发送时间，并为下一次发送随机一个间隔"""
+        self.last_send_time = time.time()
+        self.send_interval = random.uniform(*SEND_INTERVAL)
 
     def forward_messages(self):
-        """转发消息的线程"""
+        """转发消息的线程，阻塞等待队列，有消息立即处理"""
+        queues = []
+        if PROCESS_TYPE == "message_bridge" or PROCESS_TYPE == "wechat_recieve":
+            # 处理微信到圆通的消息
+            queues.append(self.redis_queue.wechat_queue)
+        if PROCESS_TYPE == "message_bridge" or PROCESS_TYPE == "wechat_send":
+            # 处理圆通到微信的消息
+            queues.append(self.redis_queue.yto_queue)
+
+        next_promote_time = 0.0
+        error_count = 0
         while self.is_running:
             try:
-                if PROCESS_TYPE == "message_bridge" or PROCESS_TYPE == "wechat_recieve":
-                    # 处理微信到圆通的消息
-                    wechat_message = self.redis_queue.get_wechat_message()
-                    if wechat_message:
-                        self.yto.send_message(wechat_message['content'])
-                    
-                    time.sleep(random.uniform(3.5, 5.5))
-                
-                if PROCESS_TYPE == "message_bridge" or PROCESS_TYPE == "wechat_send":
-                    # 处理圆通到微信的消息
-                    yto_messages = self.redis_queue.get_yto_message()
-                    if yto_messages:
-                        self.process_yto_response(yto_messages['content'])
+                # 到期的重试消息放回原队列
+                if time.time() >= next_promote_time:
+                    self.redis_queue.promote_due_retries()
+                    next_promote_time = time.time() + 1
+
+                result = self.redis_queue.wait_for_message(queues, QUEUE_BLOCK_TIMEOUT)
+                error_count = 0
+                if not result:
+                    continue
 
-                    time.sleep(random.uniform(3.5, 5.5))
+                queue, message = result
+                if 'created_at' in message:
+                    logger.debug(f"消息 {message.get('trace_id')} 排队耗时 {time.time() - message['created_at']:.3f}s")
+                if not self.rate_limiter:
+                    self.wait_send_interval()
+                sent_before = (self.yto.last_sent_at, self.wechat.last_sent_at)
+                try:
+                    if queue == self.redis_queue.wechat_queue:
+                        self.throttle("yto")
+                        self.yto.send_message(message['content'], message.get('order_number'))
+                    else:
+                        self.process_yto_response(message['content'], reply_from_list(message.get('reply')))
+                except Exception as e:
+                    # 界面或圆通页面的临时错误，延迟重试，不中断转发
+                    logger.error(f"发送消息失败: {e}")
+                    self.redis_queue.schedule_retry(queue, message, e)
+                # 只在实际发送成功后计入发送节奏，发送失败或发送记录跳过时下一条不必等待
+                if (self.yto.last_sent_at, self.wechat.last_sent_at) != sent_before:
+                    self.mark_sent()
+                # 发送完成或已转入重试后再确认，进程中途退出时消息可被重新认领
+                self.redis_queue.ack_message(queue, message)
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                # redis 不可用时按指数退避等待恢复，不退出；接收线程的消息在此期间写入溢出日志
+                error_count += 1
+                delay = min(self.retry_delay * 2 ** (error_count - 1), RETRY_MAX_DELAY)
+                logger.error(f"转发消息时 redis 不可用，{delay} 秒后重试: {e}")
+                # 分段等待，退出时不必等完整个退避时间
+                resume_time = time.time() + delay
+                while self.is_running and time.time() < resume_time:
+                    time.sleep(min(1, resume_time - time.time()))
             except Exception as e:
+                # 短暂出错时等待后继续，连续出错超过重试次数才退出
+                error_count += 1
                 logger.error(f"转发消息时出错: {e}")
-                self.is_running = False
+                if error_count > self.max_retries:
+                    self.is_running = False
+                else:
+                    time.sleep(self.retry_delay)
+                
+    def handle_wechat_message(self, msg: Message, group_name: str):
+        """发送微信消息到圆通，并等待圆通回复转发回微信群"""
+        if not msg.content:
+            return
+        
+        # 提取订单号并注册关联
+        order_numbers = self.order_manager.extract_order_number(msg.content)
+        if not order_numbers:
+            return
+        
+        self.order_manager.register_order(order_numbers, msg.session_id)
+        logger.info(f"从群 {msg.session_id} 提取到订单号: {order_numbers}")
+        
+        # 每个订单一条请求，全部发出后再统一等待回复，回复先到的订单先转发，不等待最慢的订单
+        requests = self.split(msg)
+        pending = set()
+        for request in requests:
+            # 未启用限流时拆出的请求之间按拟人化间隔发送，与队列模式的转发一致
+            if not self.rate_limiter:
+                self.wait_send_interval()
+            sent_before = self.yto.last_sent_at
+            try:
+                self.throttle("yto")
+                self.yto.send_message(request.content, request.order_number or order_numbers[0])
+                if self.yto.last_sent_at != sent_before:
+                    self.mark_sent()
+            except Exception as e:
+                if len(requests) == 1:
+                    raise
+                # 单个订单发送失败延迟重试，不影响同一消息的其他订单
+                logger.error(f"发送订单 {request.order_number} 失败: {e}")
+                self.redis_queue.schedule_retry(self.redis_queue.wechat_queue, request.to_dict(), e)
+                continue
+            pending.update([request.order_number] if request.order_number else order_numbers)
+        sent_orders = set(pending)
+
+        # 获取圆通消息
+        retry_count = 0
+        send_times = 0
+        max_while_times = 30
+        while_times = 0
+        while pending:
+            while_times += 1
+            time.sleep(random.uniform(0.5, 1))
+            yto_messages = self.yto.handle_yto_message()
+            is_send = False
+            for yto_msg in yto_messages:
+                if not yto_msg.content:
+                    continue
+
+                yto_order_numbers = self.reply_order_numbers(yto_msg.content, yto_msg.reply)
+                matched = [order_number for order_number in yto_order_numbers or [] if order_number in sent_orders]
+                if not matched:
+                    continue
+
+                # 将消息发送到微信
+                self.throttle("wechat", msg.session_id)
+                self.wechat.send_message(yto_msg.content, msg.session_id, group_name, matched[0])
+                pending.difference_update(matched)
+                is_send = True
+                send_times += 1
+                if not self.rate_limiter:
+                    time.sleep(random.uniform(1, 2))
+
+            if not is_send:
+                retry_count += 1
+            
+            logger.info(f"获取圆通消息循环次数: {retry_count}, 发送次数: {send_times}, 等待回复的订单: {len(pending)}")
+
+            if retry_count >= self.max_retries:
+                break
                 
+            if while_times >= max_while_times:
+                break
+
+    def retry_due_messages(self):
+        """重新处理到期的重试消息，仍失败时按退避再次进入重试队列"""
+        try:
+            due = self.redis_queue.pop_due_retries()
+        except Exception as e:
+            # 获取失败不影响本轮扫描，下一轮再取
+            logger.error(f"获取到期重试消息失败: {e}")
+            return
+        for queue, message in due:
+            msg = Message.from_dict(message)
+            try:
+                logger.info(f"重试第 {msg.attempts} 次: {msg.content}")
+                self.wechat.switch_to_session(msg.session_id)
+                self.handle_wechat_message(msg, MONITORED_GROUPS.get(msg.session_id))
+            except Exception as e:
+                logger.error(f"重试消息失败: {e}")
+                self.redis_queue.schedule_retry(queue, message, e)
+
     def process(self):
+        error_count = 0
         while self.is_running:
             try:
+                self.retry_due_messages()
+
                 groups = self.wechat.get_groups_to_handle()
                 if not groups:
                     # logger.warning("没有需要处理的群")
@@ -125,61 +351,52 @@ class MessageBridge:
                     logger.info(f"处理群: {group.Name}, {id}")
                     wechat_messages = self.wechat.handle_group_message(id, group)
                     for msg in wechat_messages:
-                        if not msg.content:
-                            continue
-                        
-                        # 提取订单号并注册关联
-                        order_numbers = self.order_manager.extract_order_number(msg.content)
-                        if not order_numbers:
-                            continue
-                        
-                        self.order_manager.register_order(order_numbers, msg.session_id)
-                        logger.info(f"从群 {msg.session_id} 提取到订单号: {order_numbers}")
-                        
-                        # 发送消息到圆通
-                        self.yto.send_message(msg.content)
-
-                        # 获取圆通消息
-                        order_count = len(order_numbers)
-                        retry_count = 0
-                        send_times = 0
-                        max_while_times = 30
-                        while_times = 0
-                        while True:
-                            while_times += 1
-                            time.sleep(random.uniform(0.5, 1))
-                            yto_messages = self.yto.handle_yto_message()
-                            is_send = False
-                            for yto_msg in yto_messages:
-                                if not yto_msg.content:
-                                    continue
-
-                                yto_order_numbers = self.order_manager.extract_order_number(yto_msg.content)
-                                if not yto_order_numbers or yto_order_numbers[0] not in order_numbers:
-                                    continue
-
-                                # 将消息发送到微信
-                                self.wechat.send_message(yto_msg.content, msg.session_id, group_name)
-                                is_send = True
-                                send_times += 1
-                                time.sleep(random.uniform(1, 2))
-
-                            if not is_send:
-                                retry_count += 1
-                            
-                            logger.info(f"获取圆通消息循环次数: {retry_count}, 发送次数: {send_times}")
-
-                            if retry_count >= self.max_retries or send_times >= order_count:
-                                break
-                                
-                            if while_times >= max_while_times:
-                                break
+                        try:
+                            self.handle_wechat_message(msg, group_name)
+                        except Exception as e:
+                            # 单条消息失败延迟重试，不影响其他消息
+                            logger.error(f"处理消息失败: {e}")
+                            self.redis_queue.schedule_retry(self.redis_queue.wechat_queue, msg.to_dict(), e)
 
                     time.sleep(random.uniform(1, 2))
                 time.sleep(random.uniform(1, 2))
+                error_count = 0
             except Exception as e:
+                # 扫描出错时短暂等待后继续，连续出错超过重试次数才退出
+                error_count += 1
                 logger.error(f"执行出错: {e}")
-                self.is_running = False
+                if error_count > self.max_retries:
+                    self.is_running = False
+                else:
+                    time.sleep(self.retry_delay)
+
+    def enforce_retention(self):
+        """保留策略线程，定期批量裁剪已处理消息与会话订单"""
+        try:
+            self.redis_queue.enforce_retention(full=True)
+        except Exception as e:
+            logger.error(f"启动时裁剪失败: {e}")
+
+        last_time = time.time()
+        while self.is_running:
+            time.sleep(1)
+            if time.time() - last_time < RETENTION['interval']:
+                continue
+            last_time = time.time()
+            try:
+                self.redis_queue.enforce_retention()
+            except Exception as e:
+                # 裁剪失败不影响收发，下个周期重试
+                logger.error(f"执行保留策略出错: {e}")
+
+    def replay_spill(self):
+        """redis 恢复后回放溢出日志，没有新的写入时也能及时回放"""
+        if not isinstance(self.redis_queue, RedisQueue):
+            return
+        try:
+            self.redis_queue.replay_spill()
+        except Exception as e:
+            logger.error(f"回放溢出日志出错: {e}")
 
     def run(self):
 
@@ -191,17 +408,37 @@ class MessageBridge:
         time.sleep(10)
 
         # 启动处理线程
-        process_thread = Thread(target=self.process)
-        process_thread.start()
+        threads = []
+        if RUN_MODE == "queue":
+            if PROCESS_TYPE == "message_bridge" or PROCESS_TYPE == "wechat_recieve":
+                threads.append(Thread(target=self.process_wechat_messages))
+                threads.append(Thread(target=self.process_yto_messages))
+            threads.append(Thread(target=self.forward_messages))
+        else:
+            threads.append(Thread(target=self.process))
+
+        threads.append(Thread(target=self.enforce_retention))
+
+        for thread in threads:
+            thread.start()
 
         try:
+            last_stats_time = time.time()
             while self.is_running:
                 time.sleep(1)
+                self.replay_spill()
+                if LOCAL_CACHE['enabled'] and time.time() - last_stats_time >= LOCAL_CACHE['stats_interval']:
+                    logger.info(f"本地缓存命中率: {self.redis_queue.cache_stats()}")
+                    last_stats_time = time.time()
         except KeyboardInterrupt:
             logger.info("接收到退出信号，正在关闭...")
             self.is_running = False
 
-        process_thread.join()
+        for thread in threads:
+            thread.join()
+
+        # 延后写入的标记与订单在退出前写入
+        self.redis_queue.flush_writes()
 
         logger.info("程序已退出")
 
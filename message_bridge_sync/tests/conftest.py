@@ -0,0 +1,39 @@
+# conftest.py
+# 测试使用 fakeredis (需要 lupa 执行 lua 脚本)，未安装时跳过依赖 redis 的测试
+# 用法: 在 message_bridge_sync 目录下运行 python -m pytest -q tests
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_client(redis_server):
+    import fakeredis
+    return fakeredis.FakeRedis(server=redis_server, decode_responses=True)
+
+
+@pytest.fixture
+def make_redis_queue(redis_server, monkeypatch):
+    """创建连接 fakeredis 的 RedisQueue，可在调用前修改队列模式等配置；fakeredis 不支持 CLIENT TRACKING，关闭本地缓存"""
+    import fakeredis
+    import models.redis_queue as redis_queue_module
+    monkeypatch.setitem(config.LOCAL_CACHE, 'enabled', False)
+    monkeypatch.setattr(redis_queue_module, 'create_redis_client', lambda decode_responses=None: fakeredis.FakeRedis(
+        server=redis_server, decode_responses=True if decode_responses is None else decode_responses))
+    return redis_queue_module.RedisQueue
+
+
+@pytest.fixture
+def redis_queue(make_redis_queue):
+    return make_redis_queue()
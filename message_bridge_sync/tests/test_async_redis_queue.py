@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+import models.redis_layout as redis_layout
+from models.async_redis_queue import AsyncRedisQueue
+from models.message import Message, MessageSource
+
+
+@pytest.fixture
+def async_queue(redis_server):
+    import fakeredis
+    return AsyncRedisQueue(fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True))
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_shares_key_layout_with_redis_queue(async_queue, redis_queue):
+    run(async_queue.put_orders_to_session('g1', ['YT1', 'YT2']))
+    run(async_queue.mark_yto_processed('已签收'))
+    assert redis_queue.find_session_id_by_order_number('YT2') == 'g1'
+    assert redis_queue.mark_yto_processed('已签收') is False
+    assert run(async_queue.list_session_orders(['g1', 'g2'])) == {'g1': ['YT1', 'YT2'], 'g2': []}
+    assert run(async_queue.find_session_ids_by_order_numbers(['YT1', 'YT9'])) == {'YT1': 'g1', 'YT9': None}
+
+
+def test_reads_messages_written_by_redis_queue(make_redis_queue, redis_server, monkeypatch):
+    import fakeredis
+    monkeypatch.setattr(redis_layout, 'YTO_QUEUE_MODE', 'per_session')
+    redis_queue = make_redis_queue()
+    async_queue = AsyncRedisQueue(fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True))
+    redis_queue.put_yto_message(Message('已签收', MessageSource.YTO, session_id='1'))
+    assert run(async_queue.get_yto_message())['content'] == '已签收'
+    assert run(async_queue.get_yto_message()) is None
+
+
+def test_failed_replay_keeps_remaining_dead_letters(async_queue, monkeypatch):
+    for content in ['m1', 'm2', 'm3']:
+        message = Message(content, MessageSource.YTO, session_id='1').to_dict()
+        message['attempts'] = 99
+        run(async_queue.schedule_retry(async_queue.yto_queue, message))
+    requeued = []
+
+    async def requeue_message(queue, message):
+        if message['content'] == 'm2':
+            raise ConnectionError('redis 不可用')
+        requeued.append(message['content'])
+
+    monkeypatch.setattr(async_queue, 'requeue_message', requeue_message)
+    with pytest.raises(ConnectionError):
+        run(async_queue.replay_dead_letters())
+    assert requeued == ['m1']
+    assert [entry['message']['content'] for entry in run(async_queue.list_dead_letters())] == ['m2', 'm3']
+
+
+def test_cache_methods_are_no_ops(async_queue):
+    assert async_queue.cache_stats() == {}
+    assert run(async_queue.warm_up_cache(['1'])) is None
+    assert run(async_queue.flush_writes()) is True
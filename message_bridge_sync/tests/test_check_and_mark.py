@@ -0,0 +1,36 @@
+from models.lua_scripts import CHECK_AND_MARK_PROCESSED
+
+
+def test_script_marks_only_new_members(redis_client):
+    script = redis_client.register_script(CHECK_AND_MARK_PROCESSED)
+    assert script(keys=['processed'], args=[100, 'a', 'b']) == [1, 1]
+    assert script(keys=['processed'], args=[200, 'b', 'c', 'c']) == [0, 1, 0]
+    # 已存在的成员保留首次标记的时间
+    assert redis_client.zscore('processed', 'b') == 100.000001
+
+
+def test_script_orders_batch_members(redis_client):
+    script = redis_client.register_script(CHECK_AND_MARK_PROCESSED)
+    script(keys=['processed'], args=[100, 'x', 'y', 'z'])
+    assert redis_client.zrange('processed', 0, -1) == ['x', 'y', 'z']
+
+
+def test_mark_wechat_processed_batch(redis_queue):
+    assert redis_queue.mark_wechat_processed_batch(['查件', '催件'], 'group1') == [True, True]
+    assert redis_queue.mark_wechat_processed_batch(['查件', '拦截'], 'group1') == [False, True]
+    # 不同群的已处理集合互不影响
+    assert redis_queue.mark_wechat_processed('查件', 'group2') is True
+    assert redis_queue.is_message_in_wechat_processed_queue('拦截', 'group1')
+    assert not redis_queue.is_message_in_wechat_processed_queue('拦截', 'group2')
+
+
+def test_mark_wechat_processed_by_sender(redis_queue):
+    assert redis_queue.mark_wechat_processed('查件', 'group1', 'alice') is True
+    assert redis_queue.mark_wechat_processed('查件', 'group1', 'alice') is False
+
+
+def test_mark_yto_processed(redis_queue):
+    assert redis_queue.mark_yto_processed('已签收') is True
+    assert redis_queue.mark_yto_processed('已签收') is False
+    assert redis_queue.is_message_in_yto_processed_queue('已签收')
+    assert redis_queue.mark_yto_processed_batch([]) == []
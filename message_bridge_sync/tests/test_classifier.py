@@ -0,0 +1,66 @@
+import os
+import random
+import re
+from config import ORDER_FORMAT, WECHAT_MESSAGE_FORMATS
+from models.classifier import classify, extract_waybills, is_valid_message
+from models.priority import INTENT_LANES, classify_intent
+
+# 分类器替换之前的正则: 逐个格式 search、逐个订单号格式 findall、订单号后跟意图关键字
+ORIGINAL_FORMATS = [re.compile(pattern, re.DOTALL) for pattern in WECHAT_MESSAGE_FORMATS]
+ORIGINAL_ORDERS = [re.compile(pattern) for pattern in ORDER_FORMAT]
+ORIGINAL_INTENT = re.compile(
+    r'YT\d{13,15}\s*(' + '|'.join(sorted(map(re.escape, INTENT_LANES), key=len, reverse=True)) + ')'
+)
+
+# 随机输入数量，可用 CLASSIFIER_FUZZ_COUNT 调整
+FUZZ_COUNT = int(os.environ.get('CLASSIFIER_FUZZ_COUNT', 200000))
+KEYWORDS = ['催件', '拦截', '取消拦截', '查重', '到哪里', '到那里', '退回了吗', '改地址', '改址', '更址', '修改地址',
+            '重量', '取消', '修改', '到哪', '退回', '拦', '改']
+FILLERS = [' ', '  ', '\n', '\t', '，', '。', '你好', '帮忙', '看下', '谢谢', 'YT', 'yt', 'Y', 'T', '$', '.*', '1']
+
+
+def random_text(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(1, 8)):
+        kind = rng.random()
+        if kind < 0.35:
+            parts.append('YT' + ''.join(rng.choice('0123456789') for _ in range(rng.randint(11, 17))))
+            # 订单号后面经常紧跟意图关键字
+            if rng.random() < 0.5:
+                parts.append(rng.choice(['', ' ', '  ', '\n']) + rng.choice(KEYWORDS))
+        elif kind < 0.65:
+            parts.append(rng.choice(KEYWORDS))
+        else:
+            parts.append(rng.choice(FILLERS))
+    return ''.join(parts)
+
+
+def original(text: str):
+    valid = any(pattern.search(text) for pattern in ORIGINAL_FORMATS)
+    waybills = [waybill for pattern in ORIGINAL_ORDERS for waybill in pattern.findall(text)]
+    return valid, waybills, ORIGINAL_INTENT.findall(text)
+
+
+def current(text: str):
+    return is_valid_message(text), extract_waybills(text), classify_intent(text)
+
+
+def test_examples():
+    text = 'YT7509123456789 取消拦截\nYT7509123456780 到哪里了 YT7509123456781'
+    result = classify(text)
+    assert result.valid
+    assert result.waybills == ('YT7509123456789', 'YT7509123456780', 'YT7509123456781')
+    assert result.waybill_intents == ('取消拦截', '到哪里', None)
+    assert text[slice(*result.spans[0])] == 'YT7509123456789 取消拦截'
+    assert not classify('你好 YT7509123456789').valid
+    assert classify('').waybills == ()
+
+
+def test_matches_original_regexes_on_random_input():
+    rng = random.Random(20261017)
+    mismatches = []
+    for _ in range(FUZZ_COUNT):
+        text = random_text(rng)
+        if original(text) != current(text):
+            mismatches.append(text)
+    assert mismatches == []
@@ -0,0 +1,59 @@
+import models.redis_layout as redis_layout
+from models.lua_scripts import PUT_SESSION_MESSAGE, POP_FAIR_MESSAGE
+from models.message import Message, MessageSource
+
+PREFIX = 'yto_messages_session_'
+RING_KEYS = ['yto_messages_ready', 'yto_messages_served', 'yto_messages_weight']
+
+
+def put(redis_client, session_id, data):
+    script = redis_client.register_script(PUT_SESSION_MESSAGE)
+    script(keys=[f"{PREFIX}{session_id}", RING_KEYS[0], 'yto_messages_notify'], args=[session_id, data])
+
+
+def pop_all(redis_client, session_ids):
+    script = redis_client.register_script(POP_FAIR_MESSAGE)
+    keys = [*RING_KEYS, *[f"{PREFIX}{session_id}" for session_id in session_ids]]
+    popped = []
+    while True:
+        result = script(keys=keys, args=[PREFIX])
+        if not result:
+            return popped
+        popped.append(tuple(result))
+
+
+def test_weighted_round_robin(redis_client):
+    redis_client.hset('yto_messages_weight', mapping={'g1': 2})
+    for data in ['a1', 'a2', 'a3', 'a4']:
+        put(redis_client, 'g1', data)
+    for data in ['b1', 'b2']:
+        put(redis_client, 'g2', data)
+    assert [data for _, data in pop_all(redis_client, ['g1', 'g2'])] == ['a1', 'a2', 'b1', 'a3', 'a4', 'b2']
+    # 队列取空后移出就绪环
+    assert redis_client.llen('yto_messages_ready') == 0
+
+
+def test_ring_only_holds_non_empty_sessions(redis_client):
+    put(redis_client, 'g1', 'a1')
+    put(redis_client, 'g1', 'a2')
+    assert redis_client.lrange('yto_messages_ready', 0, -1) == ['g1']
+
+
+def test_undeclared_session_is_reported(redis_client):
+    put(redis_client, 'g3', 'c1')
+    script = redis_client.register_script(POP_FAIR_MESSAGE)
+    assert script(keys=[*RING_KEYS, f"{PREFIX}g1"], args=[PREFIX]) == ['g3']
+    assert redis_client.llen(f"{PREFIX}g3") == 1
+
+
+def test_redis_queue_pops_per_session(make_redis_queue, monkeypatch):
+    monkeypatch.setattr(redis_layout, 'YTO_QUEUE_MODE', 'per_session')
+    redis_queue = make_redis_queue()
+    for session_id, content in [('1', 'a1'), ('1', 'a2'), ('new', 'c1'), (None, 'u1')]:
+        redis_queue.put_yto_message(Message(content, MessageSource.YTO, session_id=session_id))
+    popped = [redis_queue.get_yto_message() for _ in range(5)]
+    assert [(message['session_id'], message['content']) for message in popped[:4]] == [
+        ('1', 'a1'), ('new', 'c1'), (None, 'u1'), ('1', 'a2')]
+    assert popped[4] is None
+    # 未配置的群在第一次出现时加入声明的群队列
+    assert 'new' in redis_queue.yto_session_queues
@@ -0,0 +1,37 @@
+import random
+import re
+import pytest
+from config import CUSTOME_SERVICE_PATTERNS
+from models.keyword_matcher import KeywordMatcher, NamePatternMatcher
+
+PATTERNS = [*CUSTOME_SERVICE_PATTERNS, r'^客服', r'^小圆$', r'(?i)yto\d+', r'售后.*组', r'\.*点', r'^a.*b$', r'在线']
+ALPHABET = ['小', '圆', '在', '线', '客', '服', '售', '后', '组', '点', '.', 'Y', 'y', 'T', 'O', 'o', 'a', 'b', '1', ' ']
+
+
+def test_keyword_matcher_finds_longest_at_each_end():
+    matcher = KeywordMatcher(['拦截', '取消拦截', '改址', '修改地址', '地址'])
+    assert matcher.find_all('请取消拦截并修改地址') == [(1, '取消拦截'), (6, '修改地址')]
+    assert matcher.search('先改址再拦截') == '改址'
+    assert matcher.search('查件') is None
+
+
+def test_keyword_matcher_prefix_is_longest():
+    matcher = KeywordMatcher(['拦截', '取消', '取消拦截'])
+    assert matcher.match_prefix('YT1 取消拦截了', 4) == '取消拦截'
+    assert matcher.match_prefix('取消吧') == '取消'
+    assert matcher.match_prefix('请取消') is None
+
+
+@pytest.mark.parametrize('name', ['小圆在线客服', 'Y', 'YY', '客服小王', '小圆', '小圆2', 'YTO123', 'xx售后一组', '..点', 'a-b', ''])
+def test_name_matcher_examples(name):
+    expected = any(re.search(pattern, name, re.DOTALL) for pattern in PATTERNS)
+    assert NamePatternMatcher(PATTERNS).matches(name) == expected
+
+
+def test_name_matcher_matches_regex_search_on_random_names():
+    matcher = NamePatternMatcher(PATTERNS)
+    regexes = [re.compile(pattern, re.DOTALL) for pattern in PATTERNS]
+    rng = random.Random(20261017)
+    for _ in range(20000):
+        name = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 8)))
+        assert matcher.matches(name) == any(regex.search(name) for regex in regexes), name
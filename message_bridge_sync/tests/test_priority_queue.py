@@ -0,0 +1,53 @@
+import models.redis_layout as redis_layout
+from models.lua_scripts import POP_EARLIEST_DEADLINE
+from models.message import Message, MessageSource
+from models.priority import MessagePriority, classify_priority
+
+LANES = ['lane_high', 'lane_normal', 'lane_low', 'lane_stale']
+DEMOTABLE = ['0', '0', '1']
+
+
+def pop(redis_client, now, grace=600):
+    script = redis_client.register_script(POP_EARLIEST_DEADLINE)
+    return script(keys=LANES, args=[now, grace, *DEMOTABLE])
+
+
+def test_pops_earliest_deadline_across_lanes(redis_client):
+    redis_client.zadd('lane_high', {'h1': 1120})
+    redis_client.zadd('lane_normal', {'n1': 1050, 'n2': 1600})
+    redis_client.zadd('lane_low', {'l1': 1100})
+    assert [pop(redis_client, 1000) for _ in range(5)] == ['n1', 'l1', 'h1', 'n2', None]
+
+
+def test_overdue_low_lane_is_demoted(redis_client):
+    redis_client.zadd('lane_low', {'old': 100, 'fresh': 5000})
+    redis_client.zadd('lane_normal', {'n1': 4000})
+    # old 超过截止时间加宽限，移入降级队列，在其他通道都为空后才发送
+    assert pop(redis_client, 1000) == 'n1'
+    assert redis_client.zrange('lane_stale', 0, -1) == ['old']
+    assert pop(redis_client, 1000) == 'fresh'
+    assert pop(redis_client, 1000) == 'old'
+
+
+def test_overdue_high_lane_is_not_demoted(redis_client):
+    redis_client.zadd('lane_high', {'h1': 100})
+    assert pop(redis_client, 1000) == 'h1'
+    assert not redis_client.exists('lane_stale')
+
+
+def test_classify_priority():
+    assert classify_priority('YT7509123456789 拦截') == MessagePriority.HIGH
+    assert classify_priority('YT7509123456789 到哪里了') == MessagePriority.LOW
+    assert classify_priority('YT7509123456789 到哪里 YT7509123456780 拦截') == MessagePriority.HIGH
+    assert classify_priority('你好') == MessagePriority.NORMAL
+
+
+def test_redis_queue_sends_urgent_first(make_redis_queue, monkeypatch):
+    monkeypatch.setattr(redis_layout, 'WECHAT_QUEUE_MODE', 'priority')
+    redis_queue = make_redis_queue()
+    for content in ['YT7509123456789 查重', 'YT7509123456780 催件', 'YT7509123456781 拦截']:
+        redis_queue.put_wechat_message(Message(content, MessageSource.WECHAT, session_id='1'))
+    result = redis_queue.wait_for_message([redis_queue.wechat_queue], 1)
+    assert result[0] == redis_queue.wechat_queue and result[1]['content'].endswith('拦截')
+    assert [redis_queue.get_wechat_message()['content'][-2:] for _ in range(2)] == ['催件', '查重']
+    assert redis_queue.get_wechat_message() is None
@@ -0,0 +1,35 @@
+import pytest
+import config
+from models.lua_scripts import ACQUIRE_TOKENS
+from models.rate_limiter import RateLimiter
+
+
+def test_bucket_allows_burst_then_waits(redis_client):
+    script = redis_client.register_script(ACQUIRE_TOKENS)
+    assert [script(keys=['bucket'], args=[1, 1, 2]) for _ in range(2)] == [0, 0]
+    assert 0 < script(keys=['bucket'], args=[1, 1, 2]) <= 1000
+    # 桶补满后即可过期
+    assert 0 < redis_client.pttl('bucket') <= 3000
+
+
+def test_buckets_are_charged_together(redis_client):
+    script = redis_client.register_script(ACQUIRE_TOKENS)
+    assert script(keys=['global', 'group'], args=[1, 10, 10, 0.5, 1]) == 0
+    # group 桶令牌不足时 global 桶也不扣减
+    assert script(keys=['global', 'group'], args=[1, 10, 10, 0.5, 1]) > 0
+    assert float(redis_client.hget('global', 'tokens')) == pytest.approx(9, abs=0.1)
+
+
+def test_rate_limiter_shares_global_bucket(redis_client, monkeypatch):
+    monkeypatch.setitem(config.RATE_LIMITS, 'global', {'rate': 0.01, 'burst': 2})
+    rate_limiter = RateLimiter(redis_client)
+    assert rate_limiter.acquire('yto') == 0
+    assert rate_limiter.acquire('wechat', '1') == 0
+    assert rate_limiter.acquire('yto') > 0
+
+
+@pytest.mark.parametrize('bucket', [{'rate': 0, 'burst': 3}, {'rate': 1, 'burst': 0}])
+def test_rate_limiter_rejects_non_positive_config(redis_client, monkeypatch, bucket):
+    monkeypatch.setitem(config.RATE_LIMITS, 'group', bucket)
+    with pytest.raises(ValueError):
+        RateLimiter(redis_client)
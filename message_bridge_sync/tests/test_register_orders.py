@@ -0,0 +1,32 @@
+from models.lua_scripts import REGISTER_SESSION_ORDERS
+
+
+def test_script_registers_new_orders_with_mapping(redis_client):
+    script = redis_client.register_script(REGISTER_SESSION_ORDERS)
+    assert script(keys=['session_order_g1', 'order_to_session'], args=[100, 'g1', 'YT1', 'YT2']) == ['YT1', 'YT2']
+    assert script(keys=['session_order_g1', 'order_to_session'], args=[200, 'g1', 'YT2', 'YT3']) == ['YT3']
+    assert redis_client.zrange('session_order_g1', 0, -1) == ['YT1', 'YT2', 'YT3']
+    assert redis_client.hgetall('order_to_session') == {'YT1': 'g1', 'YT2': 'g1', 'YT3': 'g1'}
+
+
+def test_script_without_mapping_key_only_returns_added(redis_client):
+    script = redis_client.register_script(REGISTER_SESSION_ORDERS)
+    assert script(keys=['session_order_g1'], args=[100, 'g1', 'YT1']) == ['YT1']
+    assert not redis_client.exists('order_to_session')
+
+
+def test_put_orders_to_session(redis_queue):
+    assert redis_queue.put_orders_to_session('g1', ['YT1', 'YT2']) == 2
+    assert redis_queue.put_orders_to_session('g1', ['YT2', 'YT3']) == 1
+    assert redis_queue.put_orders_to_session('g1', []) == 0
+    assert redis_queue.is_order_in_session('g1', 'YT3')
+    assert not redis_queue.is_order_in_session('g2', 'YT3')
+    assert redis_queue.find_session_id_by_order_number('YT1') == 'g1'
+    assert redis_queue.find_session_id_by_order_number('YT9') is None
+    assert redis_queue.list_session_orders(['g1']) == {'g1': ['YT1', 'YT2', 'YT3']}
+
+
+def test_order_moves_to_latest_session(redis_queue):
+    redis_queue.put_orders_to_session('g1', ['YT1'])
+    redis_queue.put_orders_to_session('g2', ['YT1'])
+    assert redis_queue.find_session_id_by_order_number('YT1') == 'g2'
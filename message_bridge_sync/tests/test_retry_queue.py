@@ -0,0 +1,70 @@
+import pytest
+import models.queue_backend as queue_backend
+from models.memory_queue import MemoryQueue
+from models.message import Message, MessageSource
+from models.sqlite_queue import SqliteQueue
+
+
+@pytest.fixture(params=['redis', 'memory', 'sqlite'])
+def queue(request):
+    if request.param == 'redis':
+        return request.getfixturevalue('redis_queue')
+    if request.param == 'memory':
+        return MemoryQueue()
+    return SqliteQueue(':memory:')
+
+
+def failed_message(content: str, attempts: int = 0) -> dict:
+    message = Message(content, MessageSource.YTO, session_id='1').to_dict()
+    message['attempts'] = attempts
+    return message
+
+
+def test_retry_waits_for_backoff(queue):
+    assert queue.schedule_retry(queue.yto_queue, failed_message('m1'), RuntimeError('超时')) is True
+    assert queue.pop_due_retries() == []
+
+
+def test_due_retries_are_requeued(queue, monkeypatch):
+    monkeypatch.setattr(queue_backend, 'RETRY_DELAY', 0)
+    queue.schedule_retry(queue.yto_queue, failed_message('m1'))
+    assert queue.promote_due_retries() == 1
+    message = queue.get_yto_message()
+    assert (message['content'], message['attempts']) == ('m1', 1)
+    assert queue.promote_due_retries() == 0
+
+
+def test_exhausted_retries_go_to_dead_letters(queue):
+    assert queue.schedule_retry(queue.yto_queue, failed_message('m1', queue_backend.MAX_RETRIES), RuntimeError('失败')) is False
+    assert queue.pop_due_retries() == []
+    [entry] = queue.list_dead_letters()
+    assert (entry['queue'], entry['message']['content'], entry['error']) == (queue.yto_queue, 'm1', '失败')
+
+
+def test_replay_filters_by_queue_and_keeps_order(queue):
+    for queue_name, content in [(queue.yto_queue, 'y1'), (queue.wechat_queue, 'w1'),
+                                (queue.yto_queue, 'y2'), (queue.wechat_queue, 'w2')]:
+        queue.schedule_retry(queue_name, failed_message(content, queue_backend.MAX_RETRIES))
+    assert queue.replay_dead_letters(queue=queue.yto_queue) == 2
+    assert [queue.get_yto_message()['content'] for _ in range(2)] == ['y1', 'y2']
+    assert [entry['message']['content'] for entry in queue.list_dead_letters()] == ['w1', 'w2']
+    assert queue.replay_dead_letters(limit=1) == 1
+    assert [entry['message']['content'] for entry in queue.list_dead_letters()] == ['w2']
+
+
+def test_failed_replay_keeps_remaining_dead_letters(queue, monkeypatch):
+    for content in ['m1', 'm2', 'm3']:
+        queue.schedule_retry(queue.yto_queue, failed_message(content, queue_backend.MAX_RETRIES))
+    requeued = []
+
+    def requeue_message(queue_name, message):
+        if message['content'] == 'm2':
+            raise ConnectionError('redis 不可用')
+        requeued.append((message['content'], message['attempts']))
+
+    monkeypatch.setattr(queue, 'requeue_message', requeue_message)
+    with pytest.raises(ConnectionError):
+        queue.replay_dead_letters()
+    # 只删除已放回的消息，其余消息仍在死信队列
+    assert requeued == [('m1', 0)]
+    assert [entry['message']['content'] for entry in queue.list_dead_letters()] == ['m2', 'm3']
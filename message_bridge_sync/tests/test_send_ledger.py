@@ -0,0 +1,37 @@
+import pytest
+from models.send_ledger import SendLedger, SendPendingError
+
+
+def test_sends_once(redis_client):
+    ledger = SendLedger(redis_client)
+    sent = []
+    send = lambda: sent.append(1) or True
+    assert ledger.send_once('wechat_1', '已签收', send, 'YT1') is True
+    assert ledger.send_once('wechat_1', '已签收', send, 'YT1') is True
+    assert ledger.send_once('wechat_2', '已签收', send, 'YT1') is True
+    assert len(sent) == 2
+
+
+def test_failed_send_releases_reservation(redis_client):
+    def broken_send():
+        raise RuntimeError('界面异常')
+
+    ledger = SendLedger(redis_client)
+    assert ledger.send_once('yto', '查件', lambda: False) is False
+    with pytest.raises(RuntimeError):
+        ledger.send_once('yto', '查件', broken_send)
+    assert ledger.send_once('yto', '查件', lambda: True) is True
+    assert redis_client.get(ledger.key('yto', '查件')) == 'sent'
+
+
+def test_pending_reservation_blocks_other_senders(redis_client):
+    ledger = SendLedger(redis_client)
+    redis_key = ledger.key('yto', '查件')
+    token = ledger.reserve(redis_key)
+    with pytest.raises(SendPendingError):
+        ledger.reserve(redis_key)
+    # 只释放本次预留
+    ledger.release(redis_key, 'other')
+    assert redis_client.get(redis_key) == token
+    ledger.release(redis_key, token)
+    assert ledger.reserve(redis_key) is not None
@@ -0,0 +1,50 @@
+from models.message import Message, MessageSource
+from models.splitter import split_message
+
+YT1, YT2, YT3 = 'YT7509123456781', 'YT7509123456782', 'YT7509123456783'
+
+
+def split(content: str):
+    message = Message(content, MessageSource.WECHAT, session_id='1')
+    return [(request.order_number, request.content, request.trace_id == message.trace_id)
+            for request in split_message(message)]
+
+
+def test_single_waybill_is_unchanged():
+    message = Message(f"{YT1} 催件", MessageSource.WECHAT, session_id='1')
+    assert split_message(message) == [message]
+    assert message.order_number == YT1
+
+
+def test_message_without_waybill_is_unchanged():
+    assert split('你好') == [(None, '你好', True)]
+
+
+def test_one_request_per_line():
+    assert split(f"{YT1} 拦截\n{YT2} 改地址 上海市浦东新区") == [
+        (YT1, f"{YT1} 拦截", True),
+        (YT2, f"{YT2} 改地址 上海市浦东新区", True),
+    ]
+
+
+def test_waybills_inherit_following_then_preceding_intent():
+    assert split(f"{YT1}\n{YT2} 催件") == [(YT1, f"{YT1} 催件", True), (YT2, f"{YT2} 催件", True)]
+    assert split(f"拦截\n{YT1}\n{YT2}") == [(YT1, f"{YT1} 拦截", True), (YT2, f"{YT2} 拦截", True)]
+
+
+def test_several_waybills_on_one_line_keep_the_remainder():
+    assert split(f"{YT1} {YT2} 改地址 北京市朝阳区") == [
+        (YT1, f"{YT1} 改地址 北京市朝阳区", True),
+        (YT2, f"{YT2} 改地址 北京市朝阳区", True),
+    ]
+
+
+def test_duplicate_waybill_and_intent_are_dropped():
+    assert split(f"{YT1} 催件 {YT1}\n{YT2} 催件\n{YT1} 催件") == [
+        (YT1, f"{YT1} 催件 {YT1}", True),
+        (YT2, f"{YT2} 催件", True),
+    ]
+
+
+def test_same_waybill_with_different_intents_is_kept():
+    assert [order_number for order_number, _, _ in split(f"{YT1} 查重\n{YT1} 拦截\n{YT3}")] == [YT1, YT1, YT3]
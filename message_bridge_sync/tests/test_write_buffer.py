@@ -0,0 +1,75 @@
+import pytest
+import config
+from models.write_buffer import WriteBuffer
+
+
+@pytest.fixture
+def buffered_queue(redis_queue, monkeypatch):
+    """启用延后写入，后台线程不自动刷新，由测试调用 flush_writes"""
+    monkeypatch.setitem(config.WRITE_BEHIND, 'interval', 3600)
+    monkeypatch.setitem(config.WRITE_BEHIND, 'max_items', 10 ** 6)
+    redis_queue.enable_write_behind()
+    return redis_queue
+
+
+def test_buffer_keeps_entries_visible_until_written():
+    buffer = WriteBuffer(100)
+    buffer.add_marks('processed', ['a'])
+    marks, _ = buffer.take()
+    assert marks == {'processed': ['a']}
+    # 写入过程中再次标记同一成员，本批完成后仍在 pending 中
+    buffer.add_marks('processed', ['a'])
+    assert buffer.has_mark('processed', 'a')
+    buffer.done()
+    assert buffer.has_mark('processed', 'a')
+    buffer.take()
+    buffer.done()
+    assert not buffer.has_mark('processed', 'a')
+
+
+def test_buffer_tracks_latest_session_of_order():
+    buffer = WriteBuffer(100)
+    buffer.add_orders('g1', ['YT1'])
+    buffer.take()
+    buffer.add_orders('g2', ['YT1'])
+    buffer.done()
+    assert buffer.session_of('YT1') == 'g2'
+    assert buffer.has_order('g2', 'YT1') and not buffer.has_order('g1', 'YT1')
+
+
+def test_restore_keeps_write_order():
+    buffer = WriteBuffer(100)
+    buffer.add_orders('g1', ['YT1'])
+    buffer.take()
+    buffer.add_orders('g1', ['YT2'])
+    buffer.restore()
+    assert buffer.take()[1] == {'g1': ['YT1', 'YT2']}
+
+
+def test_queue_reads_its_own_buffered_writes(buffered_queue):
+    buffered_queue.put_yto_processed_message('已签收')
+    buffered_queue.put_session_order('g1', 'YT1')
+    assert not buffered_queue.redis_client.exists(buffered_queue.yto_processed_queue)
+    assert buffered_queue.is_message_in_yto_processed_queue('已签收')
+    assert buffered_queue.mark_yto_processed('已签收') is False
+    assert buffered_queue.is_order_in_session('g1', 'YT1')
+    assert buffered_queue.find_session_id_by_order_number('YT1') == 'g1'
+
+    assert buffered_queue.flush_writes() is True
+    assert buffered_queue.write_buffer.size == 0
+    assert buffered_queue.redis_client.zcard(buffered_queue.yto_processed_queue) == 1
+    assert buffered_queue.is_order_in_session('g1', 'YT1')
+    assert buffered_queue.find_session_id_by_order_number('YT1') == 'g1'
+
+
+def test_failed_flush_keeps_writes_buffered(buffered_queue, monkeypatch):
+    def broken_write(marks, orders):
+        raise ConnectionError('redis 不可用')
+
+    buffered_queue.put_yto_processed_message('已签收')
+    with monkeypatch.context() as patch:
+        patch.setattr(buffered_queue, '_write_buffered', broken_write)
+        assert buffered_queue.flush_writes() is False
+    assert buffered_queue.is_message_in_yto_processed_queue('已签收')
+    assert buffered_queue.flush_writes() is True
+    assert buffered_queue.redis_client.zcard(buffered_queue.yto_processed_queue) == 1